@@ -0,0 +1,76 @@
+# number of tiles' worth of results in each worker's message, when
+# benchmarking merging them in the parent.
+NUM_TILES = 10000
+
+
+def _fetch_fn(data):
+    # stands in for fetching, so that only the work done on the tile data is
+    # measured.
+    return lambda url: data
+
+
+def test_aggregator_add(benchmark, tile_data):
+    from scoville.percentiles import Aggregator
+
+    agg = Aggregator()
+    agg.fetch_fn = _fetch_fn(tile_data)
+    benchmark(agg.add, 'tile')
+
+
+def test_largest_n_add(benchmark, tile_data):
+    from scoville.percentiles import LargestN
+
+    agg = LargestN(3)
+    agg.fetch_fn = _fetch_fn(tile_data)
+    benchmark(agg.add, 'tile')
+
+
+def _worker_result(agg, num_tiles):
+    # a worker's result after num_tiles tiles, with sizes and names which vary
+    # so that they don't all compare equal. the results are filled in
+    # directly, as adding that many tiles would take far longer than the
+    # merge itself.
+    import random
+
+    rng = random.Random(0)
+    for i in range(num_tiles):
+        url = '16/%d/%d' % (i, i)
+        for name in ('~total', 'buildings', 'roads', 'water', 'pois'):
+            size = rng.randrange(100000)
+            if hasattr(agg, '_insert'):
+                agg._insert(name, (size, size // 2, size // 4, url))
+            else:
+                agg.results[name].append(size)
+    return agg.encode()
+
+
+def test_aggregator_merge(benchmark):
+    from scoville.percentiles import Aggregator
+
+    encoded = _worker_result(Aggregator(), NUM_TILES)
+
+    def merge():
+        Aggregator().merge_decode(encoded)
+
+    benchmark(merge)
+
+
+def test_largest_n_merge(benchmark):
+    from scoville.percentiles import LargestN
+
+    encoded = _worker_result(LargestN(3), NUM_TILES)
+
+    def merge():
+        LargestN(3).merge_decode(encoded)
+
+    benchmark(merge)
+
+
+def test_percentiles_from_lists(benchmark):
+    import random
+    from scoville.percentiles import list_percentiles
+
+    rng = random.Random(0)
+    values = [rng.randrange(1000000) for _ in range(1000000)]
+
+    benchmark(lambda: list_percentiles(list(values), [50, 90, 99, 99.9]))
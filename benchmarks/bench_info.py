@@ -0,0 +1,16 @@
+def test_summarise(benchmark, tile_data):
+    from scoville.info import summarise
+    from scoville.mvt import Tile
+
+    def run():
+        for layer in Tile(tile_data):
+            summarise(layer.features, 'kind')
+
+    benchmark(run)
+
+
+def test_tile_sizes(benchmark, tile_data):
+    from scoville.info import tile_sizes
+    from scoville.mvt import Tile
+
+    benchmark(tile_sizes, Tile(tile_data))
@@ -0,0 +1,31 @@
+def test_parse_layers(benchmark, tile_data):
+    from scoville.mvt import Tile
+
+    benchmark(lambda: [layer.size for layer in Tile(tile_data)])
+
+
+def test_feature_sizes(benchmark, tile_data):
+    from scoville.mvt import Tile
+
+    layers = list(Tile(tile_data))
+
+    def sizes():
+        total = 0
+        for layer in layers:
+            for feature in layer.features:
+                # features cache their unpacked data, so make them unpack
+                # again each time.
+                feature.unpacked = False
+                total += feature.properties_size + feature.geom_cmds_size
+        return total
+
+    benchmark(sizes)
+
+
+def test_feature_properties(benchmark, tile_data):
+    from scoville.mvt import Tile
+
+    layers = list(Tile(tile_data))
+
+    benchmark(lambda: [feature.properties for layer in layers
+                       for feature in layer.features])
@@ -0,0 +1,30 @@
+def _encoded_varints(n):
+    from scoville.pbf import encode_varint
+
+    return b''.join(encode_varint(i * 7919) for i in range(n))
+
+
+def test_decoder_varint(benchmark):
+    from scoville.pbf import Decoder
+
+    data = _encoded_varints(100000)
+
+    def decode():
+        decoder = Decoder(data)
+        while decoder.pos < decoder.end:
+            decoder.varint()
+
+    benchmark(decode)
+
+
+def test_message_fields(benchmark, tile_data):
+    from scoville.pbf import Message
+
+    # walk the top-level layer fields and each layer's own fields, without
+    # going into the features.
+    def walk():
+        for field in Message(tile_data):
+            for _ in Message(field.as_memoryview()):
+                pass
+
+    benchmark(walk)
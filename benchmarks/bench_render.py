@@ -0,0 +1,45 @@
+from conftest import scenario_tile
+
+
+def _tiles(renderer, z, x, y, data):
+    from scoville.mvt import Tile
+
+    return {key: Tile(data, '%d/%d/%d' % coord)
+            for key, coord in renderer.tiles_for(z, x, y).items()}
+
+
+def test_heatmap_render(benchmark):
+    from scoville.command import _heatmap_renderer
+
+    heatmap = _heatmap_renderer()
+    tiles = _tiles(heatmap, 10, 163, 395, scenario_tile('small_features'))
+
+    benchmark(heatmap.render, tiles)
+
+
+def test_heatmap_png(benchmark):
+    from scoville.command import _heatmap_renderer
+    from scoville.proxy import encode_tile
+
+    heatmap = _heatmap_renderer()
+    tiles = _tiles(heatmap, 10, 163, 395, scenario_tile('small_features'))
+
+    benchmark(encode_tile, heatmap, tiles, 'png')
+
+
+def test_treemap_render(benchmark, tile_data):
+    from scoville.proxy import Treemap
+
+    treemap = Treemap()
+    tiles = _tiles(treemap, 10, 163, 395, tile_data)
+
+    benchmark(treemap.render, tiles)
+
+
+def test_treemap_svg(benchmark, tile_data):
+    from scoville.proxy import Treemap
+
+    treemap = Treemap()
+    tiles = _tiles(treemap, 10, 163, 395, tile_data)
+
+    benchmark(treemap.render_svg, tiles)
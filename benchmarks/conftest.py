@@ -0,0 +1,33 @@
+import pytest
+
+# made-up tiles covering the shapes of data which stress different parts of
+# the decoder: lots of small features, a few huge polygons and lots of
+# properties with few distinct values.
+SCENARIOS = dict(
+    small_features=dict(num_layers=4, num_features=2000, num_properties=2,
+                        cardinality=50, vertices=4),
+    giant_polygons=dict(num_layers=1, num_features=4, num_properties=2,
+                        cardinality=4, vertices=50000),
+    heavy_dedup=dict(num_layers=4, num_features=1000, num_properties=12,
+                     cardinality=3, vertices=4),
+)
+
+_tiles = {}
+
+
+def scenario_tile(name):
+    """
+    Returns the bytes of the named scenario's tile, generating it on first
+    use.
+    """
+
+    from scoville.synthetic import synthetic_tile
+
+    if name not in _tiles:
+        _tiles[name] = synthetic_tile(**SCENARIOS[name])
+    return _tiles[name]
+
+
+@pytest.fixture(params=sorted(SCENARIOS.keys()))
+def tile_data(request):
+    return scenario_tile(request.param)
@@ -1,8 +1,13 @@
 import json
+from contextlib import contextmanager
+from functools import wraps
 
 import click
 
-from scoville.mvt import Tile
+# note: this module is imported for every command, including the ones we run
+# thousands of times from shell loops, so keep imports here to a minimum and
+# import anything heavier inside the command which needs it. the import time
+# is checked in tests/test_import_time.py.
 
 
 def print_tree(node, prefix=''):
@@ -15,50 +20,6 @@ def print_tree(node, prefix=''):
             click.echo('%s => %r' % (label, obj))
 
 
-_NAME_ALTERNATES = (
-    'int_name',
-    'loc_name',
-    'nat_name',
-    'official_name',
-    'old_name',
-    'reg_name',
-    'short_name',
-    'name_left',
-    'name_right',
-)
-
-
-def _is_name(k):
-    # return true if the key looks like a name
-    return k == 'name' or \
-        k.startswith('name:') or \
-        k in _NAME_ALTERNATES
-
-
-def summarise(features, kind_key):
-    sizes = {}
-    for feature in features:
-        props = feature.properties
-        kind = props.get(kind_key)
-
-        props_size = feature.properties_size
-        geom_cmds_size = feature.geom_cmds_size
-        metadata_size = feature.size - (props_size + geom_cmds_size)
-        names_count = sum(1 for k in props.keys() if _is_name(k))
-
-        if kind not in sizes:
-            sizes[kind] = dict(count=0, properties=0, geom_cmds=0, metadata=0,
-                               names=dict(count=0))
-
-        sizes[kind]['count'] += 1
-        sizes[kind]['properties'] += props_size
-        sizes[kind]['geom_cmds'] += geom_cmds_size
-        sizes[kind]['metadata'] += metadata_size
-        sizes[kind]['names']['count'] += names_count
-
-    return sizes
-
-
 def d3_output(node, name=''):
     children = []
     for k, v in node.items():
@@ -82,66 +43,323 @@ def cli():
     pass
 
 
+@contextmanager
+def _profiling(profile, output, threaded=False):
+    """
+    Profiles the code inside it if profile is true or output is given. At the
+    end, a summary of the time spent in each stage is written to stderr. If
+    output ends in .json, a Chrome trace is written to it, otherwise the
+    cProfile stats are written to it as a pstats file.
+
+    If threaded is true, then the work is done on threads which cProfile
+    can't see, so only a trace can be written.
+    """
+
+    if not profile and output is None:
+        yield
+        return
+
+    import sys
+    from scoville import profiling
+
+    trace = output is not None and output.endswith('.json')
+    cprofile = output is not None and not trace
+    if cprofile and threaded:
+        raise click.UsageError(
+            '--profile-output must be a .json trace file for this command, '
+            'as cProfile can\'t see the threads which serve requests.')
+
+    profiling.enable(profiling.Profiler(trace, cprofile))
+    try:
+        yield
+
+    finally:
+        profiler = profiling.disable()
+        profiler.write_summary(sys.stderr)
+        if trace:
+            profiler.write_trace(output)
+        elif cprofile:
+            profiler.write_pstats(output)
+
+
+def profile_options(threaded=False):
+    """
+    Decorator which adds --profile and --profile-output options to a command,
+    and profiles the command when they're given. See _profiling.
+    """
+
+    def decorator(fn):
+        @click.option('--profile/--no-profile', default=False, help='Time '
+                      'each stage of the work, such as fetching and parsing '
+                      'tiles, and print a summary of their latencies.')
+        @click.option('--profile-output', help='Also write the profile to '
+                      'this file, as a Chrome trace if it ends in .json or '
+                      'as cProfile stats otherwise. Implies --profile.')
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = kwargs.pop('profile')
+            output = kwargs.pop('profile_output')
+            with _profiling(profile, output, threaded):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def compression_options(fn):
+    """
+    Decorator which adds --compression and --compression-level options to a
+    command, and passes it a compressor argument which is a
+    scoville.compression.Compressor, or None if --compression wasn't given.
+    """
+
+    @click.option('--compression', type=click.Choice(['gzip', 'brotli']),
+                  help='Also measure the size of each tile and each layer '
+                  'when compressed with this, as it would be sent to '
+                  'clients. Brotli needs `pip install scoville[brotli]`.')
+    @click.option('--compression-level', type=click.IntRange(0, 11),
+                  help='Compression level to measure with. Defaults to 6 '
+                  'for gzip and 4 for brotli, which are typical of tile '
+                  'servers. Lower levels are quicker to measure.')
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        from scoville.compression import Compressor
+
+        method = kwargs.pop('compression')
+        level = kwargs.pop('compression_level')
+        compressor = None
+        if method is not None:
+            if method == 'gzip' and level is not None and level > 9:
+                raise click.BadParameter(
+                    'gzip levels go from 0 to 9.',
+                    param_hint='--compression-level')
+            try:
+                compressor = Compressor(method, level)
+            except ImportError as e:
+                raise click.ClickException(str(e))
+        return fn(*args, compressor=compressor, **kwargs)
+
+    return wrapper
+
+
+def _is_glob(mvt_file):
+    from glob import has_magic
+    from scoville.info import is_url
+
+    return not is_url(mvt_file) and has_magic(mvt_file)
+
+
+def _expand_sources(mvt_files, tiles_file, url):
+    """
+    Yields the tile file names and URLs to run info on, expanding any globs in
+    mvt_files and any coordinates in tiles_file.
+    """
+
+    from glob import glob
+
+    for mvt_file in mvt_files:
+        if _is_glob(mvt_file):
+            for file_name in sorted(glob(mvt_file)):
+                yield file_name
+        else:
+            yield mvt_file
+
+    if tiles_file:
+        for tile_url in read_urls(tiles_file, url):
+            yield tile_url
+
+
 @cli.command()
-@click.argument('mvt_file', required=1)
+@click.argument('mvt_file', nargs=-1)
 @click.option('--kind', help='Primary property key to segment features '
               'within a layer. By default, features will not be segmented.')
 @click.option('--d3-json/--no-d3-json', default=False,
               help='Output D3 JSON to use with the Treemap visualisation.')
-def info(mvt_file, kind, d3_json):
+@click.option('--tiles-file', '-t', help='File of z/x/y tile coordinates, '
+              'one per line, to fetch from the --url template.')
+@click.option('--url', '-u', help='URL to fetch the --tiles-file tiles '
+              'from, containing {z}, {x} and {y} replacements.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to fetch and parse tiles.')
+@click.option('--aggregate/--no-aggregate', default=False, help='Add up the '
+              'breakdowns of all the tiles and output the total.')
+@click.option('--json-lines/--no-json-lines', default=None, help='Output '
+              'one JSON record per tile. This is the default when there is '
+              'more than one tile.')
+@click.option('--records', '-r', default='-', help='File to write the '
+              'per-tile records to, rather than the console. Files ending in '
+              '.parquet are written as Parquet (needs pyarrow), anything else '
+              'as JSON lines.')
+def info(mvt_file, kind, d3_json, tiles_file, url, nprocs, aggregate,
+         json_lines, records):
     """
     Prints the detailed breakdown of bytes in MVT_FILE. If KIND is provided,
     then this property is used to further break down features into categories.
 
     Alternatively, set --d3-json to dump a file suitable for using in D3's
     treemap visualisation.
+
+    MVT_FILE can be given more than once, and can be a URL or a glob. Tiles
+    can also be listed with --tiles-file and --url. When there is more than
+    one tile, a JSON record with the same breakdown is output for each one,
+    or use --aggregate to output the total across all the tiles.
     """
-    _info(mvt_file, kind, d3_json)
 
+    if bool(tiles_file) != bool(url):
+        raise click.UsageError('--tiles-file and --url must be used together.')
 
-def _info(mvt_file, kind, d3_json):
-    if mvt_file.startswith('http://') or \
-            mvt_file.startswith('https://'):
-        import requests
+    if not mvt_file and not tiles_file:
+        raise click.UsageError('At least one MVT_FILE or --tiles-file is '
+                               'required.')
 
-        res = requests.get(mvt_file)
-        if res.status_code == 200:
-            tile = Tile(res.content)
-        else:
-            click.echo('Failed to fetch tile, status was %r' %
-                       (res.status_code,))
-            return
+    single = len(mvt_file) == 1 and not tiles_file and \
+        not _is_glob(mvt_file[0])
+    if json_lines is None:
+        json_lines = not single
 
+    sources = _expand_sources(mvt_file, tiles_file, url)
+    if aggregate:
+        _info_aggregate(sources, kind, d3_json, nprocs)
+    elif json_lines or records != '-':
+        _info_records(sources, kind, nprocs, records)
     else:
-        with open(mvt_file, 'rb') as fh:
-            tile = Tile(fh.read())
-
-    sizes = {}
-    for layer in tile:
-        feat_and_prop_size = layer.properties_size + layer.features_size
-
-        layer_sizes = {}
-        layer_sizes['properties'] = {
-            'size': layer.properties_size,
-            'keys': dict(count=len(layer.keys)),
-            'values': dict(count=len(layer.values)),
-        }
-        layer_sizes['metadata'] = layer.size - feat_and_prop_size
-
-        if kind is None:
-            layer_sizes['features'] = layer.features_size
-        else:
-            layer_sizes['features'] = summarise(
-                layer.features, kind)
+        for source in sources:
+            _info(source, kind, d3_json)
 
-        sizes[layer.name] = layer_sizes
 
+def _info(mvt_file, kind, d3_json):
+    from scoville.info import FetchError, load_tile_data, tile_sizes
+    from scoville.mvt import Tile
+
+    try:
+        tile = Tile(load_tile_data(mvt_file))
+    except FetchError as e:
+        click.echo(str(e))
+        return
+
+    _output_sizes(tile_sizes(tile, kind), mvt_file, d3_json)
+
+
+def _output_sizes(sizes, name, d3_json):
     if d3_json:
-        print(json.dumps(d3_output(sizes, name=mvt_file)))
+        print(json.dumps(d3_output(sizes, name=name)))
     else:
         print_tree(sizes)
 
 
+def _info_records(sources, kind, nprocs, path):
+    from scoville.info import info_records
+
+    with _record_writer(path) as record_fn:
+        for source, sizes, error in info_records(sources, kind, nprocs):
+            record = dict(tile=source)
+            if error is None:
+                record['sizes'] = sizes
+            else:
+                record['error'] = error
+            record_fn(record)
+
+
+def _info_aggregate(sources, kind, d3_json, nprocs):
+    from scoville.info import info_records, merge_sizes
+
+    total = {}
+    num_tiles = num_errors = 0
+    for source, sizes, error in info_records(sources, kind, nprocs):
+        if error is None:
+            merge_sizes(total, sizes)
+            num_tiles += 1
+        else:
+            click.echo('%s: %s' % (source, error), err=True)
+            num_errors += 1
+
+    _output_sizes(total, 'aggregate of %d tiles' % (num_tiles,), d3_json)
+    if num_errors:
+        click.echo('%d tiles failed.' % (num_errors,), err=True)
+
+
+@cli.command()
+@click.argument('mvt_file', nargs=-1)
+@click.option('--drop-layer', multiple=True, help='Drop layers with names '
+              'matching this pattern. Can be used multiple times.')
+@click.option('--drop-key', multiple=True, help='Drop properties with keys '
+              'matching this pattern, i.e: "name:*". Can be used multiple '
+              'times.')
+@click.option('--drop-kind', multiple=True, help='Drop features where the '
+              '--kind-key property matches this pattern. Can be used '
+              'multiple times.')
+@click.option('--kind-key', default='kind', help='Property to match '
+              '--drop-kind against.')
+@click.option('--kind', help='Primary property key to segment features '
+              'within a layer. By default, features will not be segmented.')
+@click.option('--tiles-file', '-t', help='File of z/x/y tile coordinates, '
+              'one per line, to fetch from the --url template.')
+@click.option('--url', '-u', help='URL to fetch the --tiles-file tiles '
+              'from, containing {z}, {x} and {y} replacements.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to fetch and rewrite tiles.')
+@click.option('--records', '-r', help='Also write a record of the before '
+              'and after breakdown of each tile to this file. Files ending in '
+              '.parquet are written as Parquet (needs pyarrow), anything else '
+              'as JSON lines.')
+def rewrite(mvt_file, drop_layer, drop_key, drop_kind, kind_key, kind,
+            tiles_file, url, nprocs, records):
+    """
+    Estimates how much smaller tiles would be without some of their layers,
+    properties or features, without rebuilding the tileset.
+
+    Each tile is re-encoded without the dropped data, and the breakdown of
+    bytes before and after, added up across all the tiles, is printed in the
+    same format as the info command. Tiles are given in the same way as for
+    info. Features and layers which aren't changed are copied as they are,
+    so this is quick enough to run over a large sample of tiles.
+    """
+
+    from scoville.info import merge_sizes
+    from scoville.rewrite import Rewriter, rewrite_records
+
+    if bool(tiles_file) != bool(url):
+        raise click.UsageError('--tiles-file and --url must be used together.')
+
+    if not mvt_file and not tiles_file:
+        raise click.UsageError('At least one MVT_FILE or --tiles-file is '
+                               'required.')
+
+    rewriter = Rewriter(drop_layer, drop_key, drop_kind, kind_key)
+    sources = _expand_sources(mvt_file, tiles_file, url)
+
+    total = {}
+    num_tiles = num_errors = 0
+    with _record_writer(records) as record_fn:
+        for source, sizes, error in rewrite_records(sources, rewriter, kind,
+                                                    nprocs):
+            record = dict(tile=source)
+            if error is None:
+                merge_sizes(total, sizes)
+                num_tiles += 1
+                record['sizes'] = sizes
+            else:
+                click.echo('%s: %s' % (source, error), err=True)
+                num_errors += 1
+                record['error'] = error
+            if record_fn is not None:
+                record_fn(record)
+
+    print_tree(total)
+    if num_tiles:
+        before = total['before']['~total']
+        after = total['after']['~total']
+        change = ''
+        # empty tiles have nothing to take a percentage of.
+        if before > 0:
+            change = ', %+.1f%%' % (100.0 * (after - before) / before,)
+        click.echo('%d tiles: %d bytes before, %d after%s' % (
+            num_tiles, before, after, change))
+    if num_errors:
+        click.echo('%d tiles failed.' % (num_errors,), err=True)
+
+
 @cli.command()
 @click.argument('tiles_file', required=1)
 @click.argument('url1', required=1)
@@ -154,18 +372,22 @@ def compare(tiles_file, url1, url2, kind):
     See the info command for details on --kind
     """
 
-    tiles = read_tiles(tiles_file)
-    tile_urls1 = read_urls(tiles_file, url1)
-    tile_urls2 = read_urls(tiles_file, url2)
-    for tile, url1, url2 in zip(tiles, tile_urls1, tile_urls2):
+    from scoville.tilelist import UrlTemplate
+
+    tile_url1 = UrlTemplate(url1)
+    tile_url2 = UrlTemplate(url2)
+    for z, x, y in read_coords(tiles_file):
+        tile = '%d/%d/%d' % (z, x, y)
         print('===BEGIN===>%s' % tile)
 
-        print('url1: --->%s' % url1)
-        _info(url1, kind, None)
+        url = tile_url1(z, x, y)
+        print('url1: --->%s' % url)
+        _info(url, kind, None)
         print()
 
-        print('url2: --->%s' % url2)
-        _info(url1, kind, None)
+        url = tile_url2(z, x, y)
+        print('url2: --->%s' % url)
+        _info(url, kind, None)
 
         print('<===END===%s\n\n' % tile)
 
@@ -173,81 +395,553 @@ def compare(tiles_file, url1, url2, kind):
 @cli.command()
 @click.argument('url', required=1)
 @click.option('--port', default=8000, help='Port to serve tiles on.')
-def proxy(url, port):
+@click.option('--deadline', default=30.0, type=float, help='Maximum time, '
+              'in seconds, to wait for upstream tiles before giving up.')
+@click.option('--tile-store', help='Directory or .mbtiles file of treemaps '
+              'pre-rendered with the render command. Tiles found there are '
+              'served without fetching anything upstream.')
+@click.option('--access-log', type=click.File('a'), help='Append a JSON '
+              'line for each request, with its timings, to this file rather '
+              'than stderr.')
+@profile_options(threaded=True)
+def proxy(url, port, deadline, tile_store, access_log):
     """
     Proxies vector tiles available from URL to a local server on PORT, serving
     tiles showing the breakdown of size by layer.
 
-    URL should contain {z}, {x} and {y} replacements.
+    URL should contain {z}, {x} and {y} replacements. Metrics for Prometheus
+    are served on /metrics.
     """
 
     from scoville.proxy import serve_http, Treemap
-    serve_http(url, port, Treemap())
+    serve_http(url, port, Treemap(), deadline, store=_open_tile_store(
+        tile_store), access_log=access_log)
+
+
+def _open_tile_store(path, ext='png'):
+    if path is None:
+        return None
+
+    import sqlite3
+    from scoville.tilestore import open_reader
+
+    try:
+        return open_reader(path, ext)
+    except (OSError, sqlite3.Error) as e:
+        raise click.BadParameter(str(e), param_hint='--tile-store')
+
+
+@cli.command()
+@click.argument('tiles_file', required=1)
+@click.argument('url', required=1)
+@click.argument('output', required=1)
+@click.option('--format', '-F', 'fmt', type=click.Choice(['png', 'svg']),
+              default='png', help='Image format to write the treemaps in.')
+@click.option('--cache/--no-cache', default=False, help='Use a cache for '
+              'tiles. Can speed up multiple runs considerably.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to download and render tiles.')
+def treemap(tiles_file, url, output, fmt, cache, nprocs):
+    """
+    Renders the treemap for each tile listed in TILES_FILE, fetched from URL,
+    and writes them to OUTPUT.
+
+    If OUTPUT ends in .mbtiles then the treemaps are written to an MBTiles
+    database, otherwise OUTPUT is a directory which the treemaps are written
+    to as z/x/y files.
+    """
+
+    from scoville.proxy import Treemap
+    from scoville.render import render_tiles
+    from scoville.tilestore import open_store
+
+    store = open_store(output, fmt)
+    try:
+        num_rendered, num_failed = render_tiles(
+            read_coords(tiles_file), url, Treemap(), store, fmt, cache,
+            nprocs)
+    finally:
+        store.close()
+
+    click.echo('Rendered %d tiles, %d failed.' % (num_rendered, num_failed))
+
+
+# number of bad lines in a tiles file to print before just counting them.
+MAX_BAD_LINES_REPORTED = 10
+
+
+def _read_tile_list(file_name):
+    from scoville.tilelist import read_tile_list
+
+    bad_lines = [0]
+
+    def error_fn(line_number, line, e):
+        bad_lines[0] += 1
+        if bad_lines[0] <= MAX_BAD_LINES_REPORTED:
+            click.echo('%s:%d: %s, skipping %r' % (
+                file_name, line_number, e, line.rstrip('\n')), err=True)
+
+    for tile in read_tile_list(file_name, error_fn):
+        yield tile
+
+    if bad_lines[0] > MAX_BAD_LINES_REPORTED:
+        click.echo('Skipped %d bad lines in %s.' % (bad_lines[0], file_name),
+                   err=True)
+
+
+def read_weighted_coords(file_name):
+    """
+    Lazily reads (z, x, y, count) tuples from the tiles file, which can be
+    compressed and in any of the formats that scoville.tilelist can read, or
+    a 'bbox:W,S,E,N:MINZ-MAXZ' spec of tiles to generate. Bad lines are
+    skipped and reported on stderr.
+    """
+
+    from scoville.tilelist import BBOX_PREFIX
+    from scoville.tilelist import parse_bbox_spec
+
+    # check the bbox now, rather than when the first tile is wanted, which
+    # could be after worker processes have been started.
+    if file_name.startswith(BBOX_PREFIX):
+        try:
+            parse_bbox_spec(file_name)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='TILES_FILE')
+
+    return _read_tile_list(file_name)
+
+
+def read_coords(file_name):
+    for z, x, y, _ in read_weighted_coords(file_name):
+        yield z, x, y
+
+
+def read_archive_jobs(file_name):
+    """
+    Lazily reads every tile from the MBTiles file, in file order, and yields
+    (z, x, y, tile) tuples, where each tile is a LocalTile which can be
+    used in place of a URL.
+    """
+
+    from scoville.percentiles import LocalTile
+    from scoville.tilestore import read_mbtiles
+
+    for z, x, y, data in read_mbtiles(file_name):
+        yield z, x, y, LocalTile('%s/%d/%d/%d' % (file_name, z, x, y), data)
+
+
+def _check_archive(file_name):
+    """
+    Checks that file_name is an MBTiles or PMTiles file which can be read,
+    for commands which read every tile from TILES_FILE when it's given
+    without a URL. This is done up front, rather than when the tiles are
+    read, which could be after worker processes have been started.
+    """
+
+    import sqlite3
+    from scoville.pmtiles import is_pmtiles, PMTiles
+    from scoville.tilestore import is_mbtiles, read_mbtiles
+
+    if is_pmtiles(file_name):
+        try:
+            PMTiles(file_name).close()
+        except (IOError, ValueError) as e:
+            raise click.BadParameter('Can\'t read tiles from %s: %s' %
+                                     (file_name, e), param_hint='TILES_FILE')
+        return
+
+    if not is_mbtiles(file_name):
+        raise click.UsageError('A URL is needed, unless TILES_FILE is an '
+                               'MBTiles or PMTiles file.')
+
+    tiles = read_mbtiles(file_name, 1)
+    try:
+        next(tiles, None)
+    except sqlite3.Error as e:
+        raise click.BadParameter('Can\'t read tiles from %s: %s' %
+                                 (file_name, e), param_hint='TILES_FILE')
+    finally:
+        tiles.close()
+
+
+def read_jobs(file_name, url_pattern):
+    """
+    Lazily reads (z, x, y, url) tuples for the tiles file, with URLs from
+    url_pattern. If url_pattern is None, then the tiles file should be an
+    MBTiles file, and all the tiles are read from it. See read_archive_jobs.
+    """
+
+    from scoville.tilelist import UrlTemplate
+
+    if url_pattern is None:
+        for job in read_archive_jobs(file_name):
+            yield job
+        return
+
+    tile_url = UrlTemplate(url_pattern)
+    for z, x, y in read_coords(file_name):
+        yield z, x, y, tile_url(z, x, y)
 
 
 def read_urls(file_name, url_pattern):
-    with open(file_name, 'r') as fh:
-        for line in fh:
-            zxy = line.split(' ', 1)[0]
-            z, x, y = list(map(int, zxy.split('/', 2)))
+    for _, _, _, u in read_jobs(file_name, url_pattern):
+        yield u
+
+
+def read_weighted_urls(file_name, url_pattern):
+    from scoville.tilelist import UrlTemplate
+
+    tile_url = UrlTemplate(url_pattern)
+    for z, x, y, count in read_weighted_coords(file_name):
+        yield tile_url(z, x, y), count
+
+
+def sample_urls(file_name, url_pattern, size, weighted=False, seed=None):
+    """
+    Reads the tiles file once and returns a sample of size tiles from it,
+    stratified by zoom, as a list of (url, weight) pairs. See
+    StratifiedSampler.
+    """
+
+    from scoville.sampling import StratifiedSampler
+    from scoville.tilelist import UrlTemplate
+
+    sampler = StratifiedSampler(size, weighted, seed)
+    for z, x, y, count in read_weighted_coords(file_name):
+        sampler.add(z, (z, x, y), count)
+
+    tile_url = UrlTemplate(url_pattern)
+    return [(tile_url(z, x, y), weight)
+            for (z, x, y), weight in sampler.sample()]
+
+
+@contextmanager
+def _record_writer(path, fields=None):
+    """
+    Opens a record writer for path, and yields its write function, or None if
+    path is None.
+    """
+
+    if path is None:
+        yield None
+        return
+
+    from scoville.output import open_writer
 
-            u = url_pattern \
-                .replace('{z}', str(z)) \
-                .replace('{x}', str(x)) \
-                .replace('{y}', str(y))
+    try:
+        writer = open_writer(path, fields)
+    except ImportError as e:
+        raise click.ClickException(str(e))
 
-            yield u
+    try:
+        yield writer.write
+    finally:
+        writer.close()
 
 
-def read_tiles(file_name):
-    with open(file_name, 'r') as fh:
-        for line in fh:
-            yield line.strip()
+def _checkpoint(path, resume, tiles_file, urls, aggregator):
+    """
+    Returns a Checkpoint for path, or None if path is None.
+
+    The tiles file, URLs and aggregator, a dict describing the kind of
+    aggregation and any options which change its state, are saved with the
+    checkpoint. Resuming from a checkpoint saved by a run where any of these
+    were different is an error.
+    """
+
+    if path is None:
+        if resume:
+            raise click.UsageError('--resume needs a --checkpoint file.')
+        return None
+
+    from scoville.percentiles import Checkpoint, CheckpointError
+
+    run = dict(tiles_file=tiles_file, urls=list(urls), aggregator=aggregator)
+    checkpoint = Checkpoint(path, resume, run=run)
+    try:
+        checkpoint.check()
+    except CheckpointError as e:
+        raise click.BadParameter(str(e), param_hint='--checkpoint')
+    return checkpoint
+
+
+def _compression_name(compressor):
+    if compressor is None:
+        return None
+    return '%s:%d' % (compressor.method, compressor.level)
+
+
+def _format_value(value):
+    # sizes are whole numbers of bytes, but ratios need some decimal places.
+    if isinstance(value, float):
+        return '%.3f' % (value,)
+    return '%d' % (value,)
 
 
-def _percentiles_output_text(percentiles, result):
+def _split_compressed(percentiles, result, compression):
+    """
+    Splits the compressed sizes out of result, if there are any, returning
+    the uncompressed result, the compressed result, and the headers for the
+    compressed columns.
+    """
+
+    if compression is None:
+        return result, {}, []
+
+    from scoville.compression import split_compressed
+
+    result, compressed = split_compressed(result, compression)
+    headers = ['%s p%r' % (compression, p) for p in percentiles]
+    return result, compressed, headers
+
+
+def _percentiles_output_text(percentiles, result, compression=None):
     """
     Output results to the console as columns of text, using ANSI colours where
-    available.
+    available. If compression is given, then the percentiles of the sizes
+    compressed with it are shown in extra columns.
     """
 
-    fmt = '%20s' + ' %8d' * len(percentiles)
-    header = '%20s' % ('TOTAL',)
+    result, compressed, extra_headers = _split_compressed(
+        percentiles, result, compression)
+
+    headers = ['p%r' % (percentile,) for percentile in percentiles] + \
+        extra_headers
+    widths = [max(8, len(h)) for h in headers]
+    fmt = '%20s' + ''.join(' %%%ds' % (w,) for w in widths)
+    click.secho(fmt % tuple(['TOTAL'] + headers), fg='green', bold=True)
+    for name in sorted(result.keys()):
+        values = [_format_value(v) for v in result[name]]
+        if compression is not None:
+            values.extend([_format_value(v) for v in compressed[name]]
+                          if name in compressed else ['-'] * len(percentiles))
+        line = fmt % tuple([name] + values)
+        click.secho(line, bold=name.startswith('~'))
+
+
+def _percentiles_output_text_sampled(percentiles, result, confidence):
+    """
+    Output sampled results to the console as columns of text, followed by the
+    confidence intervals of each estimate.
+    """
+
+    _percentiles_output_text(percentiles, {
+        name: [estimate for estimate, _, _ in values]
+        for name, values in result.items()})
+
+    click.echo()
+    fmt = '%20s' + ' %17s' * len(percentiles)
+    header = '%20s' % ('%g%% CI' % (confidence * 100,),)
     for percentile in percentiles:
         pct_header = 'p%r' % (percentile,)
-        header += ' %8s' % (pct_header,)
+        header += ' %17s' % (pct_header,)
     click.secho(header, fg='green', bold=True)
     for name in sorted(result.keys()):
-        percentiles = result[name]
-        line = fmt % tuple([name] + percentiles)
+        intervals = ['%d-%d' % (lower, upper)
+                     for _, lower, upper in result[name]]
+        line = fmt % tuple([name] + intervals)
         click.secho(line, bold=name.startswith('~'))
 
 
-def _percentiles_output_csv(percentiles, result):
+def _percentiles_output_csv(percentiles, result, compression=None):
     """
-    Output text to the console as a CSV file.
+    Output text to the console as a CSV file, with extra columns for the
+    compressed sizes if compression is given.
     """
 
     import csv
     from sys import stdout
 
+    result, compressed, extra_headers = _split_compressed(
+        percentiles, result, compression)
+
     writer = csv.writer(stdout)
 
     headers = ['Layer']
     for percentile in percentiles:
         headers.append('p%r' % (percentile,))
+    headers.extend(h.replace(' ', '_') for h in extra_headers)
     writer.writerow(headers)
 
     for name in sorted(result.keys()):
         line = [name]
         for pct in result[name]:
             line.append(str(pct))
+        if compression is not None:
+            line.extend(str(pct) for pct in compressed.get(
+                name, [''] * len(percentiles)))
         writer.writerow(line)
 
 
+def _percentiles_output_csv_sampled(percentiles, result, confidence):
+    """
+    Output sampled results to the console as a CSV file, with the lower and
+    upper bounds of the confidence interval after each estimate.
+    """
+
+    import csv
+    from sys import stdout
+
+    writer = csv.writer(stdout)
+
+    headers = ['Layer']
+    for percentile in percentiles:
+        pct_header = 'p%r' % (percentile,)
+        headers.extend([pct_header, pct_header + '_lower',
+                        pct_header + '_upper'])
+    writer.writerow(headers)
+
+    for name in sorted(result.keys()):
+        line = [name]
+        for values in result[name]:
+            line.extend(str(v) for v in values)
+        writer.writerow(line)
+
+
+def _percentiles_dict(percentiles, values):
+    result = {}
+    for percentile, value in zip(percentiles, values):
+        if isinstance(value, tuple):
+            estimate, lower, upper = value
+            value = dict(estimate=estimate, lower=lower, upper=upper)
+        result['p%r' % (percentile,)] = value
+    return result
+
+
+def _percentiles_output_json(percentiles, result, grouped=False,
+                             compression=None):
+    """
+    Output results to the console as JSON, with an object of percentile name
+    to value for each layer. Grouped results have an extra level of objects
+    for the groups. If compression is given, then each layer's object has
+    another object of the compressed percentiles under that name.
+    """
+
+    if grouped:
+        output = {
+            group: {name: _percentiles_dict(percentiles, values)
+                    for name, values in layers.items()}
+            for group, layers in result.items()}
+    else:
+        result, compressed, _ = _split_compressed(
+            percentiles, result, compression)
+        output = {name: _percentiles_dict(percentiles, values)
+                  for name, values in result.items()}
+        for name, values in compressed.items():
+            output.setdefault(name, {})[compression] = _percentiles_dict(
+                percentiles, values)
+
+    click.echo(json.dumps(output, indent=2, sort_keys=True))
+
+
+def _group_sort_key(group):
+    # groups are usually zooms or zoom ranges, which should sort by their
+    # first number rather than as strings.
+    digits = ''
+    for c in group:
+        if not c.isdigit():
+            break
+        digits += c
+    return (int(digits) if digits else float('inf'), group)
+
+
+def _percentiles_output_text_grouped(percentiles, result, heading='Zoom %s',
+                                     groups=None):
+    """
+    Output grouped results to the console as a table of text for each group.
+    Groups are sorted by zoom, unless the list of groups is given.
+    """
+
+    if groups is None:
+        groups = sorted(result.keys(), key=_group_sort_key)
+
+    for i, group in enumerate(groups):
+        if i > 0:
+            click.echo()
+        click.secho(heading % (group,), fg='yellow', bold=True)
+        _percentiles_output_text(percentiles, result[group])
+
+
+def _percentiles_output_text_sources(percentiles, result, num_sources):
+    """
+    Output results from several sources to the console as a single table of
+    text, with a group of columns for each source. The rows of sizes are
+    followed by rows of the differences and ratios compared to the first
+    source, in the columns of the other sources.
+    """
+
+    from scoville.percentiles import source_labels
+
+    headers = ['p%r' % (percentile,) for percentile in percentiles]
+    widths = [max(8, len(h)) for h in headers]
+    group_width = sum(widths) + len(widths)
+    fmt = '%20s' + ''.join(' %%%ds' % (w,) for w in widths) * num_sources
+    blank = ['-'] * len(percentiles)
+
+    click.secho('%20s' % ('',) + ''.join(
+        '%*s' % (group_width, 'url%d' % (i + 1,))
+        for i in range(num_sources)), fg='yellow', bold=True)
+    click.secho(fmt % tuple(['TOTAL'] + headers * num_sources),
+                fg='green', bold=True)
+
+    def rows(labels):
+        names = set()
+        for label in labels:
+            names.update(result.get(label, ()))
+        for name in sorted(names):
+            values = []
+            for label in labels:
+                if label is not None and name in result.get(label, ()):
+                    values.extend(_format_value(v)
+                                  for v in result[label][name])
+                else:
+                    values.extend(blank)
+            click.secho(fmt % tuple([name] + values),
+                        bold=name.startswith('~'))
+
+    # the first source has no difference or ratio to itself, so its columns
+    # are left blank in those rows.
+    labels = source_labels(num_sources)
+    n = num_sources
+    rows(labels[:n])
+    click.secho('%20s' % ('difference',), fg='yellow', bold=True)
+    rows([None] + labels[n:2 * n - 1])
+    click.secho('%20s' % ('ratio',), fg='yellow', bold=True)
+    rows([None] + labels[2 * n - 1:])
+
+
+def _percentiles_output_csv_grouped(percentiles, result, column='Zoom',
+                                    groups=None):
+    """
+    Output grouped results to the console as a CSV file, with a row for each
+    layer in each group. Groups are sorted by zoom, unless the list of groups
+    is given.
+    """
+
+    import csv
+    from sys import stdout
+
+    writer = csv.writer(stdout)
+
+    headers = [column, 'Layer']
+    for percentile in percentiles:
+        headers.append('p%r' % (percentile,))
+    writer.writerow(headers)
+
+    if groups is None:
+        groups = sorted(result.keys(), key=_group_sort_key)
+
+    for group in groups:
+        for name in sorted(result[group].keys()):
+            line = [group, name]
+            for pct in result[group][name]:
+                line.append(str(pct))
+            writer.writerow(line)
+
+
 @cli.command()
 @click.argument('tiles_file', required=1)
-@click.argument('url', required=1)
+@click.argument('urls', nargs=-1)
 @click.option('--percentiles', '-p', multiple=True, type=float,
               help='Percentiles to display. Use decimal floats, i.e: 99.9, '
               'not 99_9. Can be used multiple times.')
@@ -255,105 +949,705 @@ def _percentiles_output_csv(percentiles, result):
               'tiles. Can speed up multiple runs considerably.')
 @click.option('--nprocs', '-j', default=1, type=int, help='Number of '
               'processes to use to download and do tile size aggregation.')
-@click.option('--output-format', '-f', type=click.Choice(['text', 'csv']),
-              default='text', help='Format to use when writing results to '
-              'the console.')
-def percentiles(tiles_file, url, percentiles, cache, nprocs, output_format):
+@click.option('--output-format', '-f',
+              type=click.Choice(['text', 'csv', 'json']), default='text',
+              help='Format to use when writing results to the console.')
+@click.option('--records', '-r', help='Also write a record of the sizes in '
+              'each tile to this file as each tile is processed. Files '
+              'ending in .parquet are written as Parquet (needs pyarrow), '
+              'anything else as JSON lines.')
+@click.option('--checkpoint', help='Periodically save the partial result to '
+              'this file, so that an interrupted run can be resumed.')
+@click.option('--resume/--no-resume', default=False, help='Carry on from the '
+              'state saved in the --checkpoint file, skipping tiles which '
+              'have already been processed.')
+@click.option('--weighted/--no-weighted', default=False, help='Weight each '
+              'tile by its request count, from "z|x|y|count" lines in the '
+              'tiles file, so that the percentiles reflect the bytes which '
+              'are actually downloaded.')
+@click.option('--sample', type=click.IntRange(1), help='Estimate the '
+              'percentiles from a random sample of this many tiles, rather '
+              'than fetching every tile. The sample is stratified by zoom '
+              'and, with --weighted, weighted by request count.')
+@click.option('--seed', type=int, help='Random seed for --sample, to make it '
+              'repeatable.')
+@click.option('--confidence', default=0.95, type=click.FloatRange(0, 1,
+              min_open=True, max_open=True), help='Confidence level of the '
+              'intervals reported for sampled estimates.')
+@click.option('--by-zoom/--no-by-zoom', default=False, help='Calculate '
+              'the percentiles separately for each zoom level.')
+@click.option('--zoom-buckets', help='Calculate the percentiles separately '
+              'for each of these ranges of zoom levels, i.e: "0-7,8-12,13-".')
+@click.option('--accuracy', default=0.01, type=click.FloatRange(0, 1,
+              max_open=True), help='Relative accuracy of the sizes when '
+              'grouping by zoom. Each group needs a few hundred numbers at '
+              'the default of 1%%, but 0 keeps every distinct size.')
+@compression_options
+@profile_options()
+def percentiles(tiles_file, urls, percentiles, cache, nprocs, output_format,
+                records, checkpoint, resume, weighted, sample, seed,
+                confidence, by_zoom, zoom_buckets, accuracy, compressor):
     """
     Download a bunch of tiles and display the percentiles of size, breakdown by
     layer, and so forth.
 
     The tiles to download should be listed in TILES_FILE, one per line as
-    'z/x/y'. The URL to fetch them from should contain {z}, {x} and {y}
-    replacements.
+    'z/x/y' or 'z|x|y|count'. The URL to fetch them from should contain {z},
+    {x} and {y} replacements.
+
+    If more than one URL is given, then each tile is fetched from all of them
+    and the percentiles for each are displayed side by side, along with the
+    percentiles of the per-tile differences and ratios compared to the first
+    URL. Only tiles which could be fetched from every URL are counted.
+
+    If TILES_FILE is an MBTiles or PMTiles file and no URL is given, then
+    every tile in it is read, in file order, without any fetching. Gzipped
+    tiles are decompressed. PMTiles files are memory mapped and each process
+    reads its own range of the file, and tiles which the archive repeats for
+    many tile IDs are counted once for each.
+
+    With --compression, the percentiles of the compressed sizes of each tile
+    and of each layer, compressed on its own, are shown in extra columns.
     """
 
     from scoville.percentiles import calculate_percentiles
+    from scoville.pmtiles import is_pmtiles
 
     if not percentiles:
         percentiles = [50, 90, 99, 99.9]
 
-    tiles = read_urls(tiles_file, url)
-    result = calculate_percentiles(tiles, percentiles, cache, nprocs)
+    if not urls:
+        _check_archive(tiles_file)
+        if is_pmtiles(tiles_file):
+            _percentiles_pmtiles(tiles_file, percentiles, cache, nprocs,
+                                 output_format, records, checkpoint, resume,
+                                 weighted, sample, by_zoom or zoom_buckets,
+                                 compressor)
+            return
+        if weighted or sample is not None:
+            raise click.UsageError(
+                'Reading an MBTiles file can\'t be combined with --weighted '
+                'or --sample.')
+        urls = (None,)
+
+    if compressor is not None and (len(urls) > 1 or sample is not None or
+                                   by_zoom or zoom_buckets):
+        raise click.UsageError(
+            '--compression can\'t be combined with more than one URL, '
+            '--sample, --by-zoom or --zoom-buckets.')
+
+    if len(urls) > 1:
+        if weighted or sample is not None or by_zoom or zoom_buckets:
+            raise click.UsageError(
+                'Comparing more than one URL can\'t be combined with '
+                '--weighted, --sample, --by-zoom or --zoom-buckets.')
+
+        _percentiles_sources(tiles_file, urls, percentiles, cache, nprocs,
+                             output_format, records, checkpoint, resume)
+        return
+
+    url = urls[0]
+
+    if sample is not None:
+        _percentiles_sampled(tiles_file, url, percentiles, cache, nprocs,
+                             output_format, records, checkpoint, resume,
+                             weighted, sample, seed, confidence)
+        return
+
+    if by_zoom or zoom_buckets:
+        _percentiles_grouped(tiles_file, url, percentiles, cache, nprocs,
+                             output_format, records, checkpoint, resume,
+                             weighted, zoom_buckets, accuracy)
+        return
+
+    if weighted:
+        tiles = read_weighted_urls(tiles_file, url)
+    else:
+        tiles = read_urls(tiles_file, url)
+
+    checkpoint = _checkpoint(checkpoint, resume, tiles_file, [url], dict(
+        kind='percentiles', weighted=weighted,
+        compression=_compression_name(compressor)))
+    with _record_writer(records) as record_fn:
+        result = calculate_percentiles(tiles, percentiles, cache, nprocs,
+                                       record_fn, checkpoint, weighted,
+                                       compressor)
+
+    _percentiles_output(output_format, percentiles, result, compressor)
+
+
+def _percentiles_output(output_format, percentiles, result, compressor):
+    compression = compressor.method if compressor is not None else None
+    if output_format == 'text':
+        _percentiles_output_text(percentiles, result, compression)
+
+    elif output_format == 'csv':
+        _percentiles_output_csv(percentiles, result, compression)
+
+    elif output_format == 'json':
+        _percentiles_output_json(percentiles, result,
+                                 compression=compression)
+
+    else:
+        raise ValueError('Unknown output format %r' % (output_format,))
+
+
+def _percentiles_pmtiles(tiles_file, percentiles, cache, nprocs,
+                         output_format, records, checkpoint, resume, weighted,
+                         sample, grouped, compressor):
+    from scoville.percentiles import calculate_archive_percentiles
+
+    if cache or checkpoint is not None or resume or weighted or \
+            sample is not None or grouped:
+        raise click.UsageError(
+            'Reading a PMTiles file can\'t be combined with --cache, '
+            '--checkpoint, --resume, --weighted, --sample, --by-zoom or '
+            '--zoom-buckets.')
+
+    with _record_writer(records) as record_fn:
+        result = calculate_archive_percentiles(
+            tiles_file, percentiles, nprocs, record_fn, compressor)
+
+    _percentiles_output(output_format, percentiles, result, compressor)
+
+
+def _percentiles_sampled(tiles_file, url, percentiles, cache, nprocs,
+                         output_format, records, checkpoint, resume, weighted,
+                         sample, seed, confidence):
+    from scoville.sampling import sampled_percentiles
+
+    if checkpoint is not None or resume:
+        raise click.UsageError(
+            '--checkpoint and --resume can\'t be used with --sample.')
+
+    jobs = sample_urls(tiles_file, url, sample, weighted, seed)
+    with _record_writer(records) as record_fn:
+        result = sampled_percentiles(jobs, percentiles, cache, nprocs,
+                                     record_fn, confidence)
 
     if output_format == 'text':
-        _percentiles_output_text(percentiles, result)
+        _percentiles_output_text_sampled(percentiles, result, confidence)
 
     elif output_format == 'csv':
-        _percentiles_output_csv(percentiles, result)
+        _percentiles_output_csv_sampled(percentiles, result, confidence)
+
+    elif output_format == 'json':
+        _percentiles_output_json(percentiles, result)
 
     else:
         raise ValueError('Unknown output format %r' % (output_format,))
 
 
+def _percentiles_grouped(tiles_file, url, percentiles, cache, nprocs,
+                         output_format, records, checkpoint, resume, weighted,
+                         zoom_buckets, accuracy):
+    from scoville.percentiles import calculate_grouped_percentiles
+    from scoville.percentiles import group_by_zoom
+    from scoville.percentiles import ZoomBuckets
+    from scoville.tilelist import UrlTemplate
+
+    if zoom_buckets:
+        try:
+            group_fn = ZoomBuckets(zoom_buckets)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--zoom-buckets')
+    else:
+        group_fn = group_by_zoom
+
+    if url is None:
+        jobs = ((z, x, y, tile, 1)
+                for z, x, y, tile in read_archive_jobs(tiles_file))
+    else:
+        tile_url = UrlTemplate(url)
+        jobs = ((z, x, y, tile_url(z, x, y), count if weighted else 1)
+                for z, x, y, count in read_weighted_coords(tiles_file))
+
+    checkpoint = _checkpoint(checkpoint, resume, tiles_file, [url], dict(
+        kind='grouped', weighted=weighted, groups=zoom_buckets or 'zoom',
+        accuracy=accuracy))
+    with _record_writer(records) as record_fn:
+        result = calculate_grouped_percentiles(
+            jobs, percentiles, group_fn, cache, nprocs, record_fn, checkpoint,
+            accuracy)
+
+    if output_format == 'text':
+        _percentiles_output_text_grouped(percentiles, result)
+
+    elif output_format == 'csv':
+        _percentiles_output_csv_grouped(percentiles, result)
+
+    elif output_format == 'json':
+        _percentiles_output_json(percentiles, result, grouped=True)
+
+    else:
+        raise ValueError('Unknown output format %r' % (output_format,))
+
+
+def _percentiles_sources(tiles_file, urls, percentiles, cache, nprocs,
+                         output_format, records, checkpoint, resume):
+    from scoville.percentiles import calculate_source_percentiles
+    from scoville.percentiles import source_labels
+    from scoville.tilelist import UrlTemplate
+
+    tile_urls = [UrlTemplate(url) for url in urls]
+    jobs = ([tile_url(z, x, y) for tile_url in tile_urls]
+            for z, x, y in read_coords(tiles_file))
+
+    checkpoint = _checkpoint(checkpoint, resume, tiles_file, urls,
+                             dict(kind='sources'))
+    with _record_writer(records) as record_fn:
+        result = calculate_source_percentiles(
+            jobs, len(urls), percentiles, cache, nprocs, record_fn,
+            checkpoint)
+
+    groups = [label for label in source_labels(len(urls)) if label in result]
+
+    if output_format == 'text':
+        for i, url in enumerate(urls):
+            click.echo('url%d: %s' % (i + 1, url))
+        click.echo()
+        _percentiles_output_text_sources(percentiles, result, len(urls))
+
+    elif output_format == 'csv':
+        _percentiles_output_csv_grouped(percentiles, result, 'Source', groups)
+
+    elif output_format == 'json':
+        _percentiles_output_json(percentiles, result, grouped=True)
+
+    else:
+        raise ValueError('Unknown output format %r' % (output_format,))
+
+
+# upper bounds, in kB, of the heatmap colour buckets. tiles at or above the
+# last threshold get the last colour.
+HEATMAP_THRESHOLDS_KB = (6, 12, 25, 50, 75, 125, 250, 500, 750)
+HEATMAP_COLOURS = (
+    '#ffffff',
+    '#fff7ec',
+    '#fee8c8',
+    '#fdd49e',
+    '#fdbb84',
+    '#fc8d59',
+    '#ef6548',
+    '#d7301f',
+    '#990000',
+    '#000000',
+)
+
+
 @cli.command()
 @click.argument('url', required=1)
 @click.option('--port', default=8000, help='Port to serve tiles on.')
-def heatmap(url, port):
+@click.option('--deadline', default=30.0, type=float, help='Maximum time, '
+              'in seconds, to wait for upstream tiles. Any which have not '
+              'arrived by then are drawn in grey.')
+@click.option('--palette/--no-palette', default=True, help='Write heatmap '
+              'tiles as palette PNGs, which are smaller and faster to encode.')
+@click.option('--compress-level', default=6, type=click.IntRange(0, 9),
+              help='PNG compression level, from 0 (none, fastest) to 9 '
+              '(smallest, slowest).')
+@click.option('--tile-store', help='Directory or .mbtiles file of heatmaps '
+              'pre-rendered with the render command. Tiles found there are '
+              'served without fetching anything upstream.')
+@click.option('--access-log', type=click.File('a'), help='Append a JSON '
+              'line for each request, with its timings, to this file rather '
+              'than stderr.')
+@compression_options
+@profile_options(threaded=True)
+def heatmap(url, port, deadline, palette, compress_level, tile_store,
+            access_log, compressor):
     """
     Serves a heatmap of tile sizes on localhost:PORT.
 
-    URL should contain {z}, {x} and {y} replacements.
-    """
-
-    from scoville.proxy import serve_http, Heatmap
-
-    def colour_map(size):
-        kb = size / 1024
-
-        if kb < 6:
-            return '#ffffff'
-        elif kb < 12:
-            return '#fff7ec'
-        elif kb < 25:
-            return '#fee8c8'
-        elif kb < 50:
-            return '#fdd49e'
-        elif kb < 75:
-            return '#fdbb84'
-        elif kb < 125:
-            return '#fc8d59'
-        elif kb < 250:
-            return '#ef6548'
-        elif kb < 500:
-            return '#d7301f'
-        elif kb < 750:
-            return '#990000'
-        else:
-            return '#000000'
+    URL should contain {z}, {x} and {y} replacements. Sub-tiles which fail to
+    fetch are drawn in grey rather than failing the whole heatmap tile.
+    Metrics for Prometheus are served on /metrics. With --compression, tiles
+    are coloured by their compressed size rather than their raw size.
+    """
+
+    from scoville.proxy import serve_http
 
-    heatmap = Heatmap(3, 16, colour_map)
-    serve_http(url, port, heatmap)
+    heatmap = _heatmap_renderer(palette, compress_level, compressor)
+    serve_http(url, port, heatmap, deadline, store=_open_tile_store(
+        tile_store), access_log=access_log)
+
+
+def _heatmap_renderer(palette=True, compress_level=6, compressor=None):
+    from scoville.proxy import Heatmap, ColourMap
+
+    colour_map = ColourMap(
+        [kb * 1024 for kb in HEATMAP_THRESHOLDS_KB], HEATMAP_COLOURS)
+    return Heatmap(3, 16, colour_map, palette=palette,
+                   compress_level=compress_level, compressor=compressor)
+
+
+def _parse_bbox(ctx, param, value):
+    try:
+        bbox = tuple(float(v) for v in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise click.BadParameter('Expected west,south,east,north in degrees.')
+    return bbox
 
 
 @cli.command()
-@click.argument('tiles_file', required=1)
 @click.argument('url', required=1)
+@click.argument('output', required=1)
+@click.option('--style', '-s', type=click.Choice(['treemap', 'heatmap']),
+              default='heatmap', help='Which visualisation to render.')
+@click.option('--bbox', '-b', required=True, callback=_parse_bbox,
+              help='Area to render, as west,south,east,north in degrees. Use '
+              '--bbox=... if west is negative.')
+@click.option('--min-zoom', default=0, type=click.IntRange(0, 16),
+              help='Lowest zoom to render.')
+@click.option('--max-zoom', default=10, type=click.IntRange(0, 16),
+              help='Highest zoom to render.')
+@click.option('--format', '-F', 'fmt', type=click.Choice(['png', 'svg']),
+              default='png', help='Image format to render. SVG is only '
+              'available for treemaps.')
+@click.option('--cache/--no-cache', default=False, help='Use a cache for '
+              'tiles. Can speed up multiple runs considerably.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to download and render tiles.')
+@compression_options
+def render(url, output, style, bbox, min_zoom, max_zoom, fmt, cache, nprocs,
+           compressor):
+    """
+    Renders a pyramid of treemap or heatmap tiles covering BBOX from MIN_ZOOM
+    to MAX_ZOOM ahead of time, fetching upstream tiles from URL, and writes
+    them to OUTPUT.
+
+    If OUTPUT ends in .mbtiles then the tiles are written to an MBTiles
+    database, otherwise OUTPUT is a directory which the tiles are written to
+    as z/x/y files. Either can be passed to the proxy or heatmap commands'
+    --tile-store option, and a directory can also be served statically.
+    With --compression, heatmaps are coloured by compressed size, which is
+    measured in the worker processes. A tile is only written if all of the
+    upstream tiles it's drawn from could be fetched, otherwise it's counted
+    as failed.
+    """
+
+    from scoville.proxy import Treemap, can_encode
+    from scoville.render import pyramid_batches, render_batches
+    from scoville.tilestore import open_store
+
+    if style == 'treemap':
+        if compressor is not None:
+            raise click.UsageError('--compression only applies to heatmaps.')
+        renderer = Treemap()
+    else:
+        renderer = _heatmap_renderer(compressor=compressor)
+
+    if not can_encode(renderer, fmt):
+        raise click.UsageError('Cannot render %s as %s.' % (style, fmt))
+
+    batches = pyramid_batches(renderer, bbox, min_zoom, max_zoom)
+    store = open_store(output, fmt)
+    try:
+        num_rendered, num_failed = render_batches(
+            batches, url, renderer, store, fmt, cache, nprocs)
+    finally:
+        store.close()
+
+    click.echo('Rendered %d tiles, %d failed.' % (num_rendered, num_failed))
+
+
+@cli.command()
+@click.argument('tiles_file', required=1)
+@click.argument('url', required=False)
 @click.option('--cache/--no-cache', default=False, help='Use a cache for '
               'tiles. Can speed up multiple runs considerably.')
 @click.option('--nprocs', '-j', default=1, type=int, help='Number of '
               'processes to use to download and do tile size aggregation.')
 @click.option('--num-outliers-per-layer', '-n', type=int, default=3,
               help='Number of outliers for each layer to report on.')
-def outliers(tiles_file, url, cache, nprocs, num_outliers_per_layer):
+@click.option('--records', '-r', help='Also write a record of the sizes in '
+              'each tile to this file as each tile is processed. Files '
+              'ending in .parquet are written as Parquet (needs pyarrow), '
+              'anything else as JSON lines.')
+@click.option('--checkpoint', help='Periodically save the partial result to '
+              'this file, so that an interrupted run can be resumed.')
+@click.option('--resume/--no-resume', default=False, help='Carry on from the '
+              'state saved in the --checkpoint file, skipping tiles which '
+              'have already been processed.')
+@compression_options
+@profile_options()
+def outliers(tiles_file, url, cache, nprocs, num_outliers_per_layer,
+             records, checkpoint, resume, compressor):
     """
     From the distribution of tile coordinates given in TILES_FILE and fetched
     from the URL pattern, pull out some of the outlier tiles which have the
     largest sizes in each layer.
+
+    With --compression, the outliers are the layers which are largest when
+    compressed on their own, and their compressed size is shown as c.
+
+    If TILES_FILE is an MBTiles or PMTiles file and no URL is given, then
+    every tile in it is read, in file order, without any fetching.
     """
 
+    from scoville.percentiles import calculate_archive_outliers
     from scoville.percentiles import calculate_outliers
+    from scoville.pmtiles import is_pmtiles
 
-    tiles = read_urls(tiles_file, url)
-    result = calculate_outliers(tiles, num_outliers_per_layer, cache, nprocs)
+    if url is None:
+        _check_archive(tiles_file)
+
+    if url is None and is_pmtiles(tiles_file):
+        if cache or checkpoint is not None or resume:
+            raise click.UsageError('Reading a PMTiles file can\'t be '
+                                   'combined with --cache, --checkpoint or '
+                                   '--resume.')
+        with _record_writer(records) as record_fn:
+            result = calculate_archive_outliers(
+                tiles_file, num_outliers_per_layer, nprocs, record_fn,
+                compressor)
+
+    else:
+        tiles = read_urls(tiles_file, url)
+        checkpoint = _checkpoint(checkpoint, resume, tiles_file, [url], dict(
+            kind='outliers', num=num_outliers_per_layer,
+            compression=_compression_name(compressor)))
+        with _record_writer(records) as record_fn:
+            result = calculate_outliers(tiles, num_outliers_per_layer, cache,
+                                        nprocs, record_fn, checkpoint,
+                                        compressor)
 
     for name in sorted(result.keys()):
         click.secho('Layer %r' % name, fg='green', bold=True)
-        for size, features_size, properties_size, url in sorted(result[name]):
-            click.echo('t:%8d f:%8d p:%8d %s' %
+        for entry in sorted(result[name]):
+            prefix = ''
+            if compressor is not None:
+                prefix = 'c:%8d ' % (entry[0],)
+                entry = entry[1:]
+            size, features_size, properties_size, url = entry
+            click.echo(prefix + 't:%8d f:%8d p:%8d %s' %
                        (size, features_size, properties_size, url))
 
 
+LARGEST_FIELDS = ('layer', 'value', 'tile', 'index', 'size', 'geom_cmds_size',
+                  'properties_size', 'fid', 'kind')
+
+
+@cli.command()
+@click.argument('tiles_file', required=1)
+@click.argument('url', required=1)
+@click.option('--cache/--no-cache', default=False, help='Use a cache for '
+              'tiles. Can speed up multiple runs considerably.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to download and parse tiles.')
+@click.option('--num', '-n', type=click.IntRange(1), default=10,
+              help='Number of features for each layer to report on.')
+@click.option('--by', 'measure', default='geom_cmds',
+              type=click.Choice(['geom_cmds', 'properties', 'size']),
+              help='Rank features by the size of their geometry commands, '
+              'their properties, or the whole feature.')
+@click.option('--kind', default='kind', help='Property to report as each '
+              'feature\'s kind.')
+@click.option('--output-format', '-f',
+              type=click.Choice(['text', 'csv', 'json']), default='text',
+              help='Format to use when writing results to the console.')
+@click.option('--records', '-r', help='Also write a record of the sizes in '
+              'each tile to this file as each tile is processed. Files '
+              'ending in .parquet are written as Parquet (needs pyarrow), '
+              'anything else as JSON lines.')
+@click.option('--checkpoint', help='Periodically save the partial result to '
+              'this file, so that an interrupted run can be resumed.')
+@click.option('--resume/--no-resume', default=False, help='Carry on from the '
+              'state saved in the --checkpoint file, skipping tiles which '
+              'have already been processed.')
+@profile_options()
+def largest(tiles_file, url, cache, nprocs, num, measure, kind,
+            output_format, records, checkpoint, resume):
+    """
+    Finds the largest features in each layer of the tiles listed in
+    TILES_FILE and fetched from URL, with each one's ID, kind and the tile it
+    was found in. Only the largest NUM in each layer are kept in memory, so
+    this works for any number of tiles.
+    """
+
+    from scoville.percentiles import calculate_largest_features
+
+    jobs = read_jobs(tiles_file, url)
+    checkpoint = _checkpoint(checkpoint, resume, tiles_file, [url], dict(
+        kind='largest', num=num, measure=measure, kind_key=kind))
+    with _record_writer(records) as record_fn:
+        result = calculate_largest_features(
+            jobs, num, measure, kind, cache, nprocs, record_fn, checkpoint)
+
+    rows = [dict(zip(LARGEST_FIELDS, [name] + entry))
+            for name in sorted(result) for entry in result[name]]
+
+    if output_format == 'json':
+        click.echo(json.dumps(rows, indent=2))
+
+    elif output_format == 'csv':
+        import csv
+        import sys
+
+        writer = csv.DictWriter(sys.stdout, LARGEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    else:
+        for name in sorted(result):
+            click.secho('Layer %r' % name, fg='green', bold=True)
+            for _, tile, _, size, geom_cmds_size, properties_size, fid, \
+                    feature_kind in result[name]:
+                click.echo('t:%8d g:%8d p:%8d %-12s id:%s kind:%s' % (
+                    size, geom_cmds_size, properties_size, tile, fid,
+                    feature_kind))
+
+
+def _property_total(stats):
+    return stats['key_bytes'] + stats['tag_bytes'] + stats['value_bytes']
+
+
+def _properties_output_text(result):
+    for name in sorted(result):
+        click.secho('Layer %r' % name, fg='green', bold=True)
+        click.echo('%-24s %10s %10s %10s %10s %8s  %s' % (
+            'KEY', 'BYTES', 'REFS', 'VALUES', 'VALUE B', 'SINGLE%',
+            'TOP VALUES'))
+
+        keys = result[name]
+        for key in sorted(keys, key=lambda k: -_property_total(keys[k])):
+            stats = keys[key]
+            single = 0.0
+            if stats['values']:
+                single = 100.0 * stats['single_use'] / stats['values']
+            top = ', '.join('%r (%d)' % (v, cost)
+                            for v, cost in stats['top_values'])
+            click.echo('%-24s %10d %10d %10d %10d %7.1f%%  %s' % (
+                key, _property_total(stats), stats['refs'], stats['values'],
+                stats['value_bytes'], single, top))
+
+
+@cli.command()
+@click.argument('tiles_file', required=1)
+@click.argument('url', required=1)
+@click.option('--cache/--no-cache', default=False, help='Use a cache for '
+              'tiles. Can speed up multiple runs considerably.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to download and parse tiles.')
+@click.option('--num-values', '-n', type=click.IntRange(0), default=3,
+              help='Number of the most expensive values to show for each '
+              'key.')
+@click.option('--capacity', type=click.IntRange(1), default=100,
+              help='Number of values to track for each key. Any value which '
+              'takes up more than 1/(capacity+1) of the bytes spent on a '
+              'key\'s values is guaranteed to be found.')
+@click.option('--output-format', '-f',
+              type=click.Choice(['text', 'json']), default='text',
+              help='Format to use when writing results to the console.')
+@click.option('--records', '-r', help='Also write a record of the sizes in '
+              'each tile to this file as each tile is processed. Files '
+              'ending in .parquet are written as Parquet (needs pyarrow), '
+              'anything else as JSON lines.')
+@profile_options()
+def properties(tiles_file, url, cache, nprocs, num_values, capacity,
+               output_format, records):
+    """
+    Breaks down the bytes spent on properties in each layer of the tiles
+    listed in TILES_FILE and fetched from URL, by key.
+
+    For each key, this shows the bytes spent on the key itself, the tags
+    which refer to it and its values, how many times it's used, how many
+    distinct values it has in each tile, summed over all the tiles, and what
+    percentage of those are only used once, and so gain nothing from
+    deduplication. The values which take up the most bytes are also shown.
+    """
+
+    from scoville.properties import calculate_property_stats
+
+    tiles = read_urls(tiles_file, url)
+    with _record_writer(records) as record_fn:
+        result = calculate_property_stats(tiles, cache, nprocs, capacity,
+                                          num_values, record_fn)
+
+    if output_format == 'json':
+        click.echo(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        _properties_output_text(result)
+
+
+@cli.command()
+@click.argument('tiles_file', required=1)
+@click.argument('url', required=1)
+@click.argument('output', required=1)
+@click.option('--cache/--no-cache', default=False, help='Use a cache for '
+              'tiles. Can speed up multiple runs considerably.')
+@click.option('--nprocs', '-j', default=1, type=int, help='Number of '
+              'processes to use to download and parse tiles.')
+def export(tiles_file, url, output, cache, nprocs):
+    """
+    Writes a row for each layer of each tile in TILES_FILE, fetched from URL,
+    to OUTPUT. Each row has the tile coordinate, layer name, the layer's
+    size, features size and properties size, and its number of features,
+    keys and values.
+
+    OUTPUT is written as Parquet if it ends in .parquet (needs pyarrow), CSV
+    if it ends in .csv, and JSON lines otherwise. Rows are written as the
+    tiles are processed, so percentiles, outliers and the like can be
+    recalculated from OUTPUT without fetching the tiles again.
+    """
+
+    from scoville.percentiles import export_layers, LayerExporter
+
+    jobs = read_jobs(tiles_file, url)
+    with _record_writer(output, LayerExporter.FIELDS) as write:
+        def rows_fn(rows):
+            for row in rows:
+                write(row)
+
+        result = export_layers(jobs, cache, nprocs, rows_fn)
+
+    click.echo('Wrote %d rows from %d tiles, %d failed.' %
+               (result['rows'], result['tiles'], result['failed']), err=True)
+
+
+@cli.command()
+@click.option('--port', default=8000, help='Port to serve tiles on.')
+@click.option('--layers', default=4, type=click.IntRange(1), help='Number '
+              'of layers in each tile.')
+@click.option('--features', default=100, type=click.IntRange(0), help='Mean '
+              'number of features in each layer. Each tile has between half '
+              'and one and a half times this many.')
+@click.option('--properties', default=4, type=click.IntRange(0), help='Number '
+              'of properties on each feature, besides its kind.')
+@click.option('--cardinality', default=10, type=click.IntRange(1),
+              help='Number of distinct values of each property in a layer. '
+              'Lower values mean more deduplication.')
+@click.option('--vertices', default=8, type=click.IntRange(3), help='Number '
+              'of vertices in each line or polygon ring.')
+@click.option('--geom-type', default='polygon',
+              type=click.Choice(['point', 'linestring', 'polygon']),
+              help='Type of geometry for the features.')
+@click.option('--seed', default=0, type=int, help='Seed for the tile set. '
+              'The same seed always gives the same tiles.')
+@click.option('--latency', default=0.0, type=click.FloatRange(0), help='Time, '
+              'in seconds, to wait before responding to each request.')
+@click.option('--jitter', default=0.0, type=click.FloatRange(0), help='Vary '
+              'the latency by up to this many seconds either way.')
+@click.option('--error-rate', default=0.0, type=click.FloatRange(0, 1),
+              help='Fraction of requests to fail with a 500 error.')
+def synthetic(port, layers, features, properties, cardinality, vertices,
+              geom_type, seed, latency, jitter, error_rate):
+    """
+    Serves made-up vector tiles on PORT under /{z}/{x}/{y}.mvt, as a local
+    stand-in for a real tile server. This can be used as the URL for the
+    other commands to load test them without touching production.
+    """
+
+    from scoville.mvt import GeomType
+    from scoville.synthetic import serve_synthetic, SyntheticTiles
+
+    tiles = SyntheticTiles(layers, features, properties, cardinality,
+                           vertices, GeomType[geom_type], seed)
+    serve_synthetic(port, tiles, latency, jitter, error_rate, seed)
+
+
 def scoville_main():
     cli()
 
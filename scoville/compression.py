@@ -0,0 +1,135 @@
+METHODS = ('gzip', 'brotli')
+
+# levels which tile servers commonly use on the fly. lower levels are quicker
+# to measure, but give slightly larger sizes.
+DEFAULT_LEVELS = dict(gzip=6, brotli=4)
+
+# results for compressed sizes are kept alongside the uncompressed ones, under
+# the layer name with this separator and the method appended.
+SEPARATOR = '@'
+
+# leading bytes of a gzip stream. an MVT tile can never start with these, as
+# the only top-level field is layers, which always starts with 0x1a.
+GZIP_MAGIC = b'\x1f\x8b'
+
+# size of the chunks to read when decompressing a stream.
+CHUNK_SIZE = 64 * 1024
+
+
+def is_gzip(data):
+    return bytes(data[:2]) == GZIP_MAGIC
+
+
+def decompress(data):
+    """
+    Returns data, gunzipped if it's gzip compressed. Tiles are often stored
+    gzipped, for example in MBTiles files or on S3, and served without a
+    Content-Encoding header, so they arrive still compressed.
+    """
+
+    if is_gzip(data):
+        return decompress_chunks([data])
+    return data
+
+
+def decompress_chunks(chunks):
+    """
+    Joins the chunks of data from an iterable, such as a streamed HTTP
+    response, gunzipping them as they arrive if the data is gzip compressed.
+    """
+
+    import zlib
+
+    chunks = iter(chunks)
+    first = b''
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= len(GZIP_MAGIC):
+            break
+
+    if not is_gzip(first):
+        return first + b''.join(chunks)
+
+    # wbits of 31 expects a gzip header and trailer.
+    d = zlib.decompressobj(31)
+    parts = [d.decompress(first)]
+    for chunk in chunks:
+        parts.append(d.decompress(chunk))
+    parts.append(d.flush())
+    return b''.join(parts)
+
+
+def compressed_name(name, method):
+    return '%s%s%s' % (name, SEPARATOR, method)
+
+
+def split_compressed(result, method):
+    """
+    Splits a dict of results keyed by layer name, including compressed_name
+    entries, into a dict of layer name to the uncompressed result and a dict
+    of layer name to the compressed result.
+    """
+
+    suffix = SEPARATOR + method
+    uncompressed = {}
+    compressed = {}
+    for name, value in result.items():
+        if name.endswith(suffix):
+            compressed[name[:-len(suffix)]] = value
+        else:
+            uncompressed[name] = value
+    return uncompressed, compressed
+
+
+class Compressor(object):
+    """
+    Measures how large data would be when compressed with method, one of
+    METHODS, at level, or the method's DEFAULT_LEVELS if level is None.
+
+    Brotli needs the optional brotli dependency.
+    """
+
+    def __init__(self, method='gzip', level=None):
+        if method not in METHODS:
+            raise ValueError('Unknown compression method %r' % (method,))
+
+        if level is None:
+            level = DEFAULT_LEVELS[method]
+
+        if method == 'brotli':
+            try:
+                import brotli  # noqa: F401
+            except ImportError:
+                raise ImportError('Measuring brotli sizes needs brotli. '
+                                  'Install it with `pip install '
+                                  'scoville[brotli]`.')
+
+        self.method = method
+        self.level = level
+
+    def size(self, data):
+        """
+        Returns the length of data after compression.
+        """
+
+        if self.method == 'gzip':
+            import zlib
+
+            # wbits of 31 writes the gzip header and trailer, as a web server
+            # would, rather than a bare zlib stream.
+            c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            return len(c.compress(data)) + len(c.flush())
+
+        import brotli
+        return len(brotli.compress(bytes(data), quality=self.level))
+
+    def sizes(self, data, layers):
+        """
+        Returns a dict of the compressed size of the whole tile, as
+        '~total', and of each of its layers compressed on their own.
+        """
+
+        sizes = {'~total': self.size(data)}
+        for layer in layers:
+            sizes[layer.name] = self.size(layer.data)
+        return sizes
@@ -0,0 +1,173 @@
+_NAME_ALTERNATES = (
+    'int_name',
+    'loc_name',
+    'nat_name',
+    'official_name',
+    'old_name',
+    'reg_name',
+    'short_name',
+    'name_left',
+    'name_right',
+)
+
+
+def _is_name(k):
+    # return true if the key looks like a name
+    return k == 'name' or \
+        k.startswith('name:') or \
+        k in _NAME_ALTERNATES
+
+
+def summarise(features, kind_key):
+    sizes = {}
+    for feature in features:
+        props = feature.properties
+        kind = props.get(kind_key)
+
+        props_size = feature.properties_size
+        geom_cmds_size = feature.geom_cmds_size
+        metadata_size = feature.size - (props_size + geom_cmds_size)
+        names_count = sum(1 for k in props.keys() if _is_name(k))
+
+        if kind not in sizes:
+            sizes[kind] = dict(count=0, properties=0, geom_cmds=0, metadata=0,
+                               names=dict(count=0))
+
+        sizes[kind]['count'] += 1
+        sizes[kind]['properties'] += props_size
+        sizes[kind]['geom_cmds'] += geom_cmds_size
+        sizes[kind]['metadata'] += metadata_size
+        sizes[kind]['names']['count'] += names_count
+
+    return sizes
+
+
+def tile_sizes(tile, kind=None):
+    """
+    Returns the nested dict breakdown of bytes in each layer of the tile. If
+    kind is not None, then features are further broken down by the value of
+    that property.
+    """
+
+    sizes = {}
+    for layer in tile:
+        feat_and_prop_size = layer.properties_size + layer.features_size
+
+        layer_sizes = {}
+        layer_sizes['properties'] = {
+            'size': layer.properties_size,
+            'keys': dict(count=len(layer.keys)),
+            'values': dict(count=len(layer.values)),
+        }
+        layer_sizes['metadata'] = layer.size - feat_and_prop_size
+
+        if kind is None:
+            layer_sizes['features'] = layer.features_size
+        else:
+            layer_sizes['features'] = summarise(
+                layer.features, kind)
+
+        sizes[layer.name] = layer_sizes
+
+    return sizes
+
+
+def merge_sizes(total, sizes):
+    """
+    Adds the numbers in the nested dict sizes into total, in place, and
+    returns total.
+    """
+
+    for k, v in sizes.items():
+        if isinstance(v, dict):
+            merge_sizes(total.setdefault(k, {}), v)
+        else:
+            total[k] = total.get(k, 0) + v
+    return total
+
+
+class FetchError(Exception):
+    pass
+
+
+def is_url(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def load_tile_data(source, session=None):
+    """
+    Returns the bytes of the tile at source, which can be a URL or a file
+    name, gunzipped if they're gzip compressed. Raises FetchError if a URL
+    doesn't return a tile.
+    """
+
+    from scoville.compression import decompress
+
+    if is_url(source):
+        if session is None:
+            import requests
+            session = requests
+
+        res = session.get(source)
+        if res.status_code != 200:
+            raise FetchError('Failed to fetch tile, status was %r' %
+                             (res.status_code,))
+        return decompress(res.content)
+
+    with open(source, 'rb') as fh:
+        return decompress(fh.read())
+
+
+# each process keeps a session open, so that fetches from the same server
+# can reuse connections.
+_session = None
+
+
+def load_with_session(source):
+    """
+    Loads the tile data for source in the same way as load_tile_data, but
+    fetches URLs with a requests session which is kept open for the life of
+    the process, such as a pool worker.
+    """
+
+    global _session
+
+    if _session is None and is_url(source):
+        import requests
+        _session = requests.Session()
+
+    return load_tile_data(source, _session)
+
+
+def _info_worker(args):
+    from scoville.mvt import Tile
+
+    source, kind = args
+
+    try:
+        data = load_with_session(source)
+        return source, tile_sizes(Tile(data), kind), None
+
+    except (FetchError, OSError, EOFError, ValueError) as e:
+        return source, None, str(e)
+
+
+def info_records(sources, kind=None, nprocs=1):
+    """
+    Lazily calculates the tile_sizes breakdown for each of sources, using
+    nprocs processes. Yields (source, sizes, error) tuples in the same order
+    as sources, where exactly one of sizes and error is None.
+    """
+
+    tasks = ((source, kind) for source in sources)
+
+    if nprocs > 1:
+        from multiprocessing import Pool
+
+        with Pool(nprocs) as pool:
+            for record in pool.imap(_info_worker, tasks, chunksize=4):
+                yield record
+
+    else:
+        for task in tasks:
+            yield _info_worker(task)
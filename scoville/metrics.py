@@ -0,0 +1,153 @@
+import threading
+
+# upper bounds, in seconds, of the latency histogram buckets. these are the
+# same as the Prometheus client libraries use by default.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % (','.join('%s="%s"' % (name, _escape(value))
+                              for name, value in pairs),)
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    A count which only goes up, such as the number of requests, kept
+    separately for each combination of label values. If fn is given, then
+    the value is whatever it returns at the time the metrics are read, which
+    is useful for counts kept elsewhere.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            with self.lock:
+                self.values[()] = self.fn()
+
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    """
+    A value which can go up and down, such as the number of requests in
+    flight.
+    """
+
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(object):
+    """
+    Counts observations, such as latencies, in cumulative buckets, along with
+    their count and sum, for each combination of label values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        from bisect import bisect_left
+
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), count, total))
+                            for labels, (counts, count, total)
+                            in self.values.items())
+
+        for labels, (counts, count, total) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + '_bucket', _labels(
+                    self.labels, labels, [('le', _format_number(bound))]), \
+                    cumulative
+            label_text = _labels(self.labels, labels)
+            yield self.name + '_count', label_text, count
+            yield self.name + '_sum', label_text, total
+
+
+class Registry(object):
+    """
+    A set of metrics, which can be rendered in the Prometheus text format.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self._add(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _format_number(value)))
+        return '\n'.join(lines) + '\n'
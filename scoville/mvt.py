@@ -175,6 +175,17 @@ class Feature(object):
             properties[k] = _decode_value(v)
         return properties
 
+    @property
+    def tags(self):
+        """
+        The feature's properties as they are encoded in the tile: a list of
+        alternating indices into the layer's keys and values.
+        """
+
+        if not self.unpacked:
+            self.__unpack()
+        return self._properties
+
     @property
     def properties_size(self):
         if not self.unpacked:
@@ -213,6 +224,7 @@ class Layer(object):
         self.keys = []
         self.values = []
         self.extent = Layer.DEFAULT_EXTENT
+        self.data = data
         self.size = field.size
         self.features_size = 0
         self.properties_size = 0
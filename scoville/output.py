@@ -0,0 +1,158 @@
+import json
+
+
+def _flatten(node, prefix='', result=None):
+    """
+    Flattens a nested dict of sizes into a single-level dict with keys joined
+    by dots, in the same way that print_tree labels them.
+    """
+
+    if result is None:
+        result = {}
+    for key, value in node.items():
+        label = '%s.%s' % (prefix, key) if prefix else str(key)
+        if isinstance(value, dict):
+            _flatten(value, label, result)
+        else:
+            result[label] = value
+    return result
+
+
+class JSONLinesWriter(object):
+    """
+    Writes each record as a line of JSON as soon as it arrives, so that
+    downstream tools can consume them incrementally.
+    """
+
+    def __init__(self, fh, close_fh=False):
+        self.fh = fh
+        self.close_fh = close_fh
+
+    def write(self, record):
+        self.fh.write(json.dumps(record, sort_keys=True))
+        self.fh.write('\n')
+
+    def close(self):
+        self.fh.flush()
+        if self.close_fh:
+            self.fh.close()
+
+
+class CSVWriter(object):
+    """
+    Writes flat rows with the given fields as CSV.
+    """
+
+    def __init__(self, fh, fields, close_fh=False):
+        import csv
+
+        self.fh = fh
+        self.close_fh = close_fh
+        self.writer = csv.DictWriter(fh, [name for name, _ in fields])
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.fh.flush()
+        if self.close_fh:
+            self.fh.close()
+
+
+class ParquetWriter(object):
+    """
+    Writes records to a Parquet file in row groups of batch_size records, so
+    that only one batch is held in memory at a time. This needs the optional
+    pyarrow dependency.
+
+    If fields is given, it should be a list of (name, type) pairs, where type
+    is 'int' or 'string', and each record should be a flat dict with those
+    fields. Otherwise, each record has a 'tile' name, an optional 'error' and
+    a 'sizes' dict, which is flattened into a map of dotted names to sizes.
+    The optional 'compressed' sizes are flattened in the same way, and the
+    optional 'weight' is kept as it is.
+    """
+
+    def __init__(self, path, fields=None, batch_size=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Writing Parquet needs pyarrow. Install it with '
+                              '"pip install scoville[parquet]".')
+
+        self.pa = pa
+        if fields is None:
+            self.schema = pa.schema([
+                ('tile', pa.string()),
+                ('sizes', pa.map_(pa.string(), pa.int64())),
+                ('compressed', pa.map_(pa.string(), pa.int64())),
+                ('weight', pa.int64()),
+                ('error', pa.string()),
+            ])
+            self.convert = _convert_sizes_record
+        else:
+            types = dict(int=pa.int64(), string=pa.string())
+            self.schema = pa.schema([(name, types[typ])
+                                     for name, typ in fields])
+            self.convert = None
+
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, record):
+        if self.convert is not None:
+            record = self.convert(record)
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            table = self.pa.Table.from_pylist(self.batch, schema=self.schema)
+            self.writer.write_table(table)
+            self.batch = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def _convert_sizes_record(record):
+    compressed = record.get('compressed')
+    if compressed is not None:
+        compressed = _flatten(compressed)
+
+    return dict(
+        tile=record['tile'],
+        sizes=_flatten(record.get('sizes') or {}),
+        compressed=compressed,
+        weight=record.get('weight'),
+        error=record.get('error'),
+    )
+
+
+def open_writer(path, fields=None):
+    """
+    Opens a record writer for path. Paths ending in .parquet are written as
+    Parquet, anything else as JSON lines. A path of '-' writes JSON lines to
+    stdout.
+
+    If the records are flat rows, then fields should be a list of their
+    (name, type) pairs. This allows them to be written as CSV as well, for
+    paths ending in .csv.
+    """
+
+    if path == '-':
+        from sys import stdout
+        return JSONLinesWriter(stdout)
+
+    if path.endswith('.parquet'):
+        return ParquetWriter(path, fields)
+
+    if fields is not None and path.endswith('.csv'):
+        return CSVWriter(open(path, 'w', newline=''), fields, close_fh=True)
+
+    return JSONLinesWriter(open(path, 'w'), close_fh=True)
@@ -69,7 +69,8 @@ class _LengthDelimited(_Field):
         self.buf = decoder.get_bytes(self.num_bytes)
 
     def as_string(self):
-        return self.buf.decode('utf-8')
+        # str() rather than decode, as buf can be a memoryview.
+        return str(self.buf, 'utf-8')
 
     def as_memoryview(self):
         return self.buf
@@ -183,3 +184,53 @@ class Message(object):
         field.size = self.decoder.pos - start_pos
 
         return field
+
+
+def encode_varint(value):
+    """
+    Returns the protobuf varint encoding of the non-negative integer value.
+    """
+
+    out = bytearray()
+    while value > 127:
+        out.append((value & 127) | 128)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# encoded varints of small values, which is nearly all of them in geometries
+# and tags, built on first use.
+_SMALL_VARINTS = []
+_NUM_SMALL_VARINTS = 1 << 14
+
+
+def encode_varints(values):
+    """
+    Returns the concatenated varint encodings of values.
+    """
+
+    if not _SMALL_VARINTS:
+        _SMALL_VARINTS.extend(
+            encode_varint(v) for v in range(_NUM_SMALL_VARINTS))
+
+    table = _SMALL_VARINTS
+    n = _NUM_SMALL_VARINTS
+    return b''.join(table[v] if v < n else encode_varint(v) for v in values)
+
+
+def field_key(tag, wire_type):
+    return encode_varint((tag << 3) | wire_type.value)
+
+
+def bytes_field(tag, data):
+    return field_key(tag, WireType.length_delimited) + \
+        encode_varint(len(data)) + data
+
+
+def varint_field(tag, value):
+    return field_key(tag, WireType.varint) + encode_varint(value)
+
+
+def packed_field(tag, values):
+    return bytes_field(tag, encode_varints(values))
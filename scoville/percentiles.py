@@ -1,23 +1,68 @@
 from collections import defaultdict
+from functools import partial
 
-import requests
-
+from scoville import profiling
+from scoville.compression import compressed_name
+from scoville.compression import CHUNK_SIZE
+from scoville.compression import decompress
+from scoville.compression import decompress_chunks
 from scoville.mvt import Tile
 
 
+class LocalTile(str):
+    """
+    The name of a tile which has already been read from a local archive,
+    such as an MBTiles file, carrying its data along with it. These can be
+    given to the aggregators in place of URLs, and rather than fetching
+    them, their data is got by calling read.
+
+    Subclasses for archives which are read lazily, such as PMTiles files,
+    can pass None for the data and override read.
+    """
+
+    def __new__(cls, name, data=None):
+        tile = str.__new__(cls, name)
+        tile.data = data
+        return tile
+
+    def read(self):
+        # the data is only needed once. dropping it stops it being sent
+        # back from worker processes with the records which name the tile.
+        data, self.data = self.data, None
+        return data
+
+    def __reduce__(self):
+        return (LocalTile, (str(self), self.data))
+
+
 def _fetch_http(url):
     """
-    Fetch a tile over HTTP.
+    Fetch a tile over HTTP. Tiles which are gzipped, but served without a
+    Content-Encoding header, are decompressed as they're streamed in.
     """
 
-    res = requests.get(url)
+    import requests
+
+    if isinstance(url, LocalTile):
+        return url.read()
+
+    # streaming the body splits the time until the response headers arrive,
+    # which includes DNS and connecting, from the time to transfer the body.
+    with profiling.stage('http.connect'):
+        res = requests.get(url, stream=True)
 
     # TODO: retry? better error handling!
     if res.status_code != requests.codes.ok:
-        print('Got tile response %d for %s' % (res.status_code, url))
+        import click
+
+        # stdout may be carrying CSV or JSON output.
+        click.echo('Got tile response %d for %s' % (res.status_code, url),
+                   err=True)
+        res.close()
         return None
 
-    return res.content
+    with profiling.stage('http.transfer'):
+        return decompress_chunks(res.iter_content(CHUNK_SIZE))
 
 
 def _fetch_cache(url):
@@ -30,6 +75,9 @@ def _fetch_cache(url):
     from os import makedirs
     from hashlib import sha224
 
+    if isinstance(url, LocalTile):
+        return url.read()
+
     # we use the non-query part to store on disk. (tile won't depend on API
     # key, right?) partly because the API key can be very long and overflow
     # the max 255 chars for a filename when base64 encoded.
@@ -45,16 +93,18 @@ def _fetch_cache(url):
 
     data = None
     if isfile(file_name):
-        with open(file_name, 'rb') as fh:
-            data = fh.read()
+        with profiling.stage('cache.read'):
+            with open(file_name, 'rb') as fh:
+                data = decompress(fh.read())
 
     else:
         data = _fetch_http(url)
         if data:
-            if not isdir(dir_name):
-                makedirs(dir_name)
-            with open(file_name, 'wb') as fh:
-                fh.write(data)
+            with profiling.stage('cache.write'):
+                if not isdir(dir_name):
+                    makedirs(dir_name)
+                with open(file_name, 'wb') as fh:
+                    fh.write(data)
 
     return data
 
@@ -69,26 +119,71 @@ def fetch(url, cache=False):
     return _fetch_http(url)
 
 
+def _error_record(tile_url):
+    return dict(tile=tile_url, error='Failed to fetch tile')
+
+
+def _compressed_sizes(compressor, data, layers, record):
+    """
+    Measures the compressed size of the tile and each of its layers with
+    compressor, and adds them to the record. Returns a list of (name, size)
+    pairs, where the names are the compressed_names for the layers.
+    """
+
+    with profiling.stage('compress'):
+        sizes = compressor.sizes(data, layers)
+    record['compressed'] = sizes
+    return [(compressed_name(name, compressor.method), size)
+            for name, size in sizes.items()]
+
+
 class Aggregator(object):
     """
     Core of the algorithm. Fetches tiles and aggregates their total and
     per-layer sizes into a set of lists.
+
+    If a scoville.compression.Compressor is given, then the compressed size
+    of each tile and of each layer on its own are aggregated as well, under
+    the compressed_name of the layer.
     """
 
-    def __init__(self, cache=False):
+    def __init__(self, cache=False, compressor=None):
         self.fetch_fn = _fetch_http
         if cache:
             self.fetch_fn = _fetch_cache
+        self.compressor = compressor
 
+        self.reset()
+
+    def reset(self):
         self.results = defaultdict(list)
 
     def add(self, tile_url):
+        """
+        Fetches the tile and adds its sizes to the results. Returns a record
+        of the tile's sizes.
+        """
+
         data = self.fetch_fn(tile_url)
+        if data is None:
+            return _error_record(tile_url)
+
+        sizes = {'~total': len(data)}
         self.results['~total'].append(len(data))
 
-        tile = Tile(data)
-        for layer in tile:
-            self.results[layer.name].append(layer.size)
+        with profiling.stage('parse'):
+            layers = list(Tile(data))
+            for layer in layers:
+                self.results[layer.name].append(layer.size)
+                sizes[layer.name] = layer.size
+
+        record = dict(tile=tile_url, sizes=sizes)
+        if self.compressor is not None:
+            for name, size in _compressed_sizes(
+                    self.compressor, data, layers, record):
+                self.results[name].append(size)
+
+        return record
 
     # encode a message to be sent over the "wire" from a worker to the parent
     # process. we use msgpack encoding rather than pickle, as pickle was
@@ -104,6 +199,361 @@ class Aggregator(object):
             self.results[k].extend(v)
 
 
+class WeightedAggregator(object):
+    """
+    Like Aggregator, but each tile is given with a weight, such as the number
+    of times it was requested, and its sizes count in proportion to that.
+
+    Rather than a list of sizes, each layer keeps a dict of size to the total
+    weight of tiles with that size. This means that large weights don't take
+    up any more memory, and tiles with the same size share an entry.
+
+    Each job given to add is a (url, weight) tuple. Compressed sizes are
+    aggregated in the same way as for Aggregator.
+    """
+
+    def __init__(self, cache=False, compressor=None):
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+        self.compressor = compressor
+
+        self.reset()
+
+    def reset(self):
+        self.results = defaultdict(partial(defaultdict, int))
+
+    def add(self, job):
+        """
+        Fetches the tile and adds its sizes, with the job's weight, to the
+        results. Returns a record of the tile's sizes.
+        """
+
+        tile_url, weight = job
+        data = self.fetch_fn(tile_url)
+        if data is None:
+            return _error_record(tile_url)
+
+        sizes = {'~total': len(data)}
+        self.results['~total'][len(data)] += weight
+
+        with profiling.stage('parse'):
+            layers = list(Tile(data))
+            for layer in layers:
+                self.results[layer.name][layer.size] += weight
+                sizes[layer.name] = layer.size
+
+        record = dict(tile=tile_url, sizes=sizes, weight=weight)
+        if self.compressor is not None:
+            for name, size in _compressed_sizes(
+                    self.compressor, data, layers, record):
+                self.results[name][size] += weight
+
+        return record
+
+    # msgpack only allows string keys by default, so the size to weight dicts
+    # are sent as lists of pairs.
+    def encode(self):
+        from msgpack import packb
+        return packb({name: list(weights.items())
+                      for name, weights in self.results.items()})
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        results = unpackb(data)
+        for name, pairs in results.items():
+            weights = self.results[name]
+            for size, weight in pairs:
+                weights[size] += weight
+
+
+def weighted_percentiles(weights, percentiles):
+    """
+    Returns the value at each of percentiles in weights, a dict of value to
+    the total weight of that value.
+
+    This matches the unweighted calculation if all the weights are 1: the
+    value at percentile p is the first one where the cumulative weight
+    exceeds p% of the total.
+    """
+
+    values = sorted(weights.items())
+    total = sum(weight for _, weight in values)
+
+    result = [None] * len(percentiles)
+    order = sorted(range(len(percentiles)), key=lambda j: percentiles[j])
+    i = 0
+    cumulative = 0
+    for j in order:
+        threshold = total * percentiles[j] / 100.0
+        while i < len(values) - 1 and cumulative + values[i][1] <= threshold:
+            cumulative += values[i][1]
+            i += 1
+        result[j] = values[i][0]
+
+    return result
+
+
+class SizeBins(object):
+    """
+    Maps sizes to bins whose width grows with the size, so that any size can
+    be recovered to within relative_accuracy (i.e: 0.01 is 1%) of its true
+    value, but a whole distribution needs only a few hundred bins. This is
+    the same scheme as the DDSketch quantile sketch.
+
+    If relative_accuracy is 0, then every size gets a bin of its own.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        import math
+
+        self.relative_accuracy = relative_accuracy
+        if relative_accuracy > 0:
+            self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+            self.log_gamma = math.log(self.gamma)
+
+    def index(self, size):
+        import math
+
+        if self.relative_accuracy == 0 or size <= 0:
+            return size
+        # bin 0 is kept for zero sizes, so bins of non-zero sizes start at 1.
+        return int(math.ceil(math.log(size) / self.log_gamma)) + 1
+
+    def value(self, index):
+        if self.relative_accuracy == 0 or index <= 0:
+            return index
+        return int(round(2 * self.gamma ** (index - 1) / (self.gamma + 1)))
+
+
+def group_by_zoom(z, x, y):
+    return str(z)
+
+
+class ZoomBuckets(object):
+    """
+    Groups tiles into ranges of zoom levels given by a spec such as
+    "0-7,8-12,13-", where a missing upper bound means no limit. Tiles at
+    zooms which aren't in any of the ranges go in the group "other".
+    """
+
+    def __init__(self, spec):
+        self.buckets = []
+        for part in spec.split(','):
+            lower, sep, upper = part.strip().partition('-')
+            lower = int(lower)
+            if not sep:
+                upper = lower
+            elif upper:
+                upper = int(upper)
+            else:
+                upper = None
+
+            if upper is not None and upper < lower:
+                raise ValueError('Zoom range %r is empty.' % (part,))
+
+            label = part.strip()
+            self.buckets.append((lower, upper, label))
+
+    def __call__(self, z, x, y):
+        for lower, upper, label in self.buckets:
+            if lower <= z and (upper is None or z <= upper):
+                return label
+        return 'other'
+
+
+class GroupedAggregator(object):
+    """
+    Aggregates the total and per-layer sizes of tiles separately for each
+    group of tiles, where the group is given by group_fn(z, x, y). For
+    example, group_by_zoom keeps a separate distribution for each zoom.
+
+    Each distribution is a dict of size bin to total weight, see SizeBins,
+    so memory stays flat however many tiles are added.
+
+    Each job given to add is a (z, x, y, url, weight) tuple.
+    """
+
+    def __init__(self, group_fn, cache=False, relative_accuracy=0.01):
+        self.group_fn = group_fn
+        self.bins = SizeBins(relative_accuracy)
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+
+        self.reset()
+
+    def reset(self):
+        self.results = defaultdict(
+            partial(defaultdict, partial(defaultdict, int)))
+
+    def add(self, job):
+        """
+        Fetches the tile and adds its sizes, with the job's weight, to the
+        results for its group. Returns a record of the tile's sizes.
+        """
+
+        z, x, y, tile_url, weight = job
+        data = self.fetch_fn(tile_url)
+        if data is None:
+            return _error_record(tile_url)
+
+        group = self.results[self.group_fn(z, x, y)]
+        index = self.bins.index
+
+        sizes = {'~total': len(data)}
+        group['~total'][index(len(data))] += weight
+
+        with profiling.stage('parse'):
+            tile = Tile(data)
+            for layer in tile:
+                group[layer.name][index(layer.size)] += weight
+                sizes[layer.name] = layer.size
+
+        return dict(tile=tile_url, sizes=sizes)
+
+    def encode(self):
+        from msgpack import packb
+        return packb({
+            group: {name: list(weights.items())
+                    for name, weights in layers.items()}
+            for group, layers in self.results.items()})
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        results = unpackb(data)
+        for group, layers in results.items():
+            for name, pairs in layers.items():
+                weights = self.results[group][name]
+                for index, weight in pairs:
+                    weights[index] += weight
+
+
+def binned_percentiles(bins, results, percentiles):
+    """
+    Returns the sizes at each of percentiles in the GroupedAggregator results,
+    as a dict of group to a dict of layer name to the list of sizes. Bins
+    should be the SizeBins used to aggregate the results.
+    """
+
+    pct = {}
+    for group, layers in results.items():
+        pct[group] = {}
+        for name, weights in layers.items():
+            sizes = defaultdict(int)
+            for index, weight in weights.items():
+                sizes[bins.value(index)] += weight
+            pct[group][name] = weighted_percentiles(sizes, percentiles)
+    return pct
+
+
+def source_labels(num_sources):
+    """
+    Returns the labels of the columns of results from MultiSourceAggregator:
+    one for each source, then the differences and ratios of each source
+    after the first compared to the first.
+    """
+
+    labels = ['url%d' % (i + 1,) for i in range(num_sources)]
+    labels.extend('url%d-url1' % (i + 1,) for i in range(1, num_sources))
+    labels.extend('url%d/url1' % (i + 1,) for i in range(1, num_sources))
+    return labels
+
+
+class MultiSourceAggregator(object):
+    """
+    Fetches the same tile from several sources at once and aggregates the
+    total and per-layer sizes from each of them side by side, along with the
+    per-tile differences and ratios of each source compared to the first.
+
+    A tile only counts if it could be fetched from every source, so that the
+    columns are all made up of the same tiles. A layer missing from a tile
+    counts as zero bytes in the differences and ratios, but isn't counted in
+    the source's own sizes. Ratios with a zero-sized first source are left
+    out.
+
+    Each job given to add is a list of URLs, one for each source. The results
+    are a dict of label, see source_labels, to a dict of layer name to a list
+    of values.
+    """
+
+    def __init__(self, num_sources, cache=False):
+        self.num_sources = num_sources
+        self.labels = source_labels(num_sources)
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+
+        # the thread pool is started on first use, so that it's started in
+        # the worker process rather than in the one which created us.
+        self.executor = None
+        self.reset()
+
+    def reset(self):
+        self.results = defaultdict(partial(defaultdict, list))
+
+    def _fetch_all(self, tile_urls):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(self.num_sources)
+        return list(self.executor.map(self.fetch_fn, tile_urls))
+
+    def add(self, tile_urls):
+        """
+        Fetches the tile from each source and adds their sizes to the results.
+        Returns a record of the tile's sizes from each source.
+        """
+
+        assert len(tile_urls) == self.num_sources
+        datas = self._fetch_all(tile_urls)
+
+        failed = [url for url, data in zip(tile_urls, datas) if data is None]
+        if failed:
+            return dict(tile=tile_urls[0], error='Failed to fetch tile from '
+                        + ', '.join(failed))
+
+        all_sizes = []
+        for data in datas:
+            sizes = {'~total': len(data)}
+            with profiling.stage('parse'):
+                for layer in Tile(data):
+                    sizes[layer.name] = layer.size
+            all_sizes.append(sizes)
+
+        n = self.num_sources
+        base = all_sizes[0]
+        names = set().union(*all_sizes)
+        for i, sizes in enumerate(all_sizes):
+            for name, size in sizes.items():
+                self.results[self.labels[i]][name].append(size)
+
+            if i == 0:
+                continue
+
+            delta = self.results[self.labels[n + i - 1]]
+            ratio = self.results[self.labels[2 * n + i - 2]]
+            for name in names:
+                base_size = base.get(name, 0)
+                size = sizes.get(name, 0)
+                delta[name].append(size - base_size)
+                if base_size:
+                    ratio[name].append(size / float(base_size))
+
+        return dict(tile=tile_urls[0], sizes=dict(
+            zip(self.labels, all_sizes)))
+
+    def encode(self):
+        from msgpack import packb
+        return packb(self.results)
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        results = unpackb(data)
+        for label, layers in results.items():
+            for name, values in layers.items():
+                self.results[label][name].extend(values)
+
+
 class FactoryFunctionHolder(object):
     def __init__(self, factory_fn):
         self.factory_fn = factory_fn
@@ -115,32 +565,61 @@ class FactoryFunctionHolder(object):
 class LargestN(object):
     """
     Keeps a list of the largest N tiles for each layer.
+
+    Each entry is a (size, features_size, properties_size, url) tuple. If a
+    scoville.compression.Compressor is given, then the layers are ranked by
+    their compressed size instead, which is put at the start of each entry.
     """
 
-    def __init__(self, num, cache=False):
+    def __init__(self, num, cache=False, compressor=None):
         self.num = num
         self.fetch_fn = _fetch_http
         if cache:
             self.fetch_fn = _fetch_cache
+        self.compressor = compressor
+
+        self.reset()
 
+    def reset(self):
         self.results = defaultdict(list)
 
-    def _insert(self, name, size, features_size, properties_size, url):
+    def _insert(self, name, entry):
         largest = self.results.get(name, [])
-        largest.append((size, features_size, properties_size, url))
+        largest.append(entry)
         if len(largest) > self.num:
             largest.sort(reverse=True)
             del largest[self.num:]
         self.results[name] = largest
 
     def add(self, tile_url):
+        """
+        Fetches the tile and considers each of its layers for the largest N.
+        Returns a record of the tile's sizes.
+        """
+
         data = self.fetch_fn(tile_url)
         if not data:
-            return
-        tile = Tile(data)
-        for layer in tile:
-            self._insert(layer.name, layer.size, layer.features_size,
-                         layer.properties_size, tile_url)
+            return _error_record(tile_url)
+
+        sizes = {'~total': len(data)}
+        with profiling.stage('parse'):
+            layers = list(Tile(data))
+
+        record = dict(tile=tile_url, sizes=sizes)
+        compressed = {}
+        if self.compressor is not None:
+            _compressed_sizes(self.compressor, data, layers, record)
+            compressed = record['compressed']
+
+        for layer in layers:
+            entry = (layer.size, layer.features_size, layer.properties_size,
+                     tile_url)
+            if self.compressor is not None:
+                entry = (compressed[layer.name],) + entry
+            self._insert(layer.name, entry)
+            sizes[layer.name] = layer.size
+
+        return record
 
     def encode(self):
         from msgpack import packb
@@ -150,8 +629,172 @@ class LargestN(object):
         from msgpack import unpackb
         results = unpackb(data)
         for name, values in results.items():
-            for size, features_size, properties_size, url in values:
-                self._insert(name, size, features_size, properties_size, url)
+            for entry in values:
+                self._insert(name, tuple(entry))
+
+
+class LargestFeatures(object):
+    """
+    Keeps the largest num features in each layer across all the tiles, as
+    measured by measure, which is one of MEASURES: the whole feature's size,
+    or the size of its geometry commands or of its properties.
+
+    Each layer keeps a heap of its largest features so far, so memory is
+    bounded by the number of layers rather than tiles. A feature's size is
+    an upper bound on the other measures, so most features can be skipped
+    without decoding them at all once the heap is full.
+
+    Each job given to add is a (z, x, y, url) tuple. The results are a dict
+    of layer name to a list of [value, tile, index, size, geom_cmds_size,
+    properties_size, fid, kind], where tile is 'z/x/y', index is the
+    feature's position in the layer and kind is the value of the kind_key
+    property.
+    """
+
+    MEASURES = ('size', 'geom_cmds', 'properties')
+
+    def __init__(self, num, measure='geom_cmds', kind_key='kind',
+                 cache=False):
+        assert measure in self.MEASURES
+        self.num = num
+        self.measure = measure
+        self.kind_key = kind_key
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+
+        self.reset()
+
+    def reset(self):
+        self.results = defaultdict(list)
+
+    def _insert(self, name, entry):
+        from heapq import heappush, heapreplace
+
+        # the value, tile and index are unique within a layer, so entries are
+        # never compared on the fid or kind, which might be None.
+        heap = self.results[name]
+        if len(heap) < self.num:
+            heappush(heap, entry)
+        elif entry > heap[0]:
+            heapreplace(heap, entry)
+
+    def _value(self, feature):
+        if self.measure == 'geom_cmds':
+            return feature.geom_cmds_size
+        elif self.measure == 'properties':
+            return feature.properties_size
+        return feature.size
+
+    def add(self, job):
+        """
+        Fetches the tile and considers each of its features for the largest
+        in its layer. Returns a record of the tile's sizes.
+        """
+
+        z, x, y, tile_url = job
+        data = self.fetch_fn(tile_url)
+        if data is None:
+            return _error_record(tile_url)
+
+        tile = '%d/%d/%d' % (z, x, y)
+        sizes = {'~total': len(data)}
+        with profiling.stage('parse'):
+            for layer in Tile(data):
+                sizes[layer.name] = layer.size
+                heap = self.results[layer.name]
+                for index, feature in enumerate(layer.features):
+                    if len(heap) >= self.num and feature.size < heap[0][0]:
+                        continue
+
+                    value = self._value(feature)
+                    if len(heap) >= self.num and \
+                            (value, tile, index) <= tuple(heap[0][0:3]):
+                        continue
+
+                    self._insert(layer.name, [
+                        value, tile, index, feature.size,
+                        feature.geom_cmds_size, feature.properties_size,
+                        feature.fid, feature.properties.get(self.kind_key)])
+
+        return dict(tile=tile_url, sizes=sizes)
+
+    def encode(self):
+        from msgpack import packb
+        return packb(self.results)
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        results = unpackb(data)
+        for name, entries in results.items():
+            for entry in entries:
+                self._insert(name, entry)
+
+
+class LayerExporter(object):
+    """
+    Fetches tiles and produces one row per layer in each tile, with the tile
+    coordinate and the sizes and counts of things in the layer. Nothing is
+    kept in memory; the rows are returned from add to be written out.
+
+    Each job given to add is a (z, x, y, url) tuple.
+    """
+
+    FIELDS = (
+        ('z', 'int'),
+        ('x', 'int'),
+        ('y', 'int'),
+        ('layer', 'string'),
+        ('size', 'int'),
+        ('features_size', 'int'),
+        ('properties_size', 'int'),
+        ('num_features', 'int'),
+        ('num_keys', 'int'),
+        ('num_values', 'int'),
+    )
+
+    def __init__(self, cache=False):
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+
+        self.reset()
+
+    def reset(self):
+        self.results = dict(tiles=0, failed=0, rows=0)
+
+    def add(self, job):
+        z, x, y, tile_url = job
+        data = self.fetch_fn(tile_url)
+        if data is None:
+            self.results['failed'] += 1
+            return []
+
+        rows = []
+        for layer in Tile(data):
+            rows.append(dict(
+                z=z, x=x, y=y,
+                layer=layer.name,
+                size=layer.size,
+                features_size=layer.features_size,
+                properties_size=layer.properties_size,
+                num_features=len(layer.features),
+                num_keys=len(layer.keys),
+                num_values=len(layer.values),
+            ))
+
+        self.results['tiles'] += 1
+        self.results['rows'] += len(rows)
+        return rows
+
+    def encode(self):
+        from msgpack import packb
+        return packb(self.results)
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        for k, v in unpackb(data).items():
+            self.results[k] += v
 
 
 # special object to tell worker threads to exit
@@ -159,61 +802,425 @@ class Sentinel(object):
     pass
 
 
-def worker(input_queue, output_queue, aggregator):
+# number of per-tile records a worker batches up before sending them to the
+# parent process.
+RECORD_BATCH_SIZE = 100
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint file can't be resumed from, because it was
+    written in a different format or by a different run.
+    """
+
+    pass
+
+
+class Checkpoint(object):
+    """
+    Periodically saves the partial aggregated state of a long-running job to
+    a file, along with which of the jobs have been processed, so that an
+    interrupted run can be resumed.
+
+    Jobs are identified by their index in the input. Workers send their
+    partial state and the indices which went into it every flush_every jobs
+    or interval seconds, whichever comes first. The file is written by the
+    parent process at most once every interval seconds, and only ever
+    contains the state from complete flushes, so it is always consistent.
+
+    Run is a dict describing what's being run, such as the tiles file, URLs
+    and the kind of aggregation, which is saved with the state. Resuming
+    with a different run, or from a file in a different format, would merge
+    incompatible state, so it raises CheckpointError instead.
+
+    If resume is False, then any existing file is ignored and overwritten.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, resume=False, interval=60, flush_every=1000,
+                 run=None):
+        self.path = path
+        self.resume = resume
+        self.interval = interval
+        self.flush_every = flush_every
+        self.run = run or {}
+        self.done = bytearray()
+        self.last_write = None
+        self.saved = None
+
+    def check(self):
+        """
+        If resuming and the checkpoint file exists, read it and check that it
+        can be resumed from, raising CheckpointError if not. Returns True if
+        there is a checkpoint to resume from.
+        """
+
+        from os.path import isfile
+        from msgpack import packb, unpackb
+
+        if not self.resume or not isfile(self.path):
+            return False
+        if self.saved is not None:
+            return True
+
+        with open(self.path, 'rb') as fh:
+            saved = unpackb(fh.read())
+
+        version = saved.get('version') if isinstance(saved, dict) else None
+        if version != Checkpoint.VERSION:
+            raise CheckpointError(
+                'Checkpoint %s is in format version %r, but only version %d '
+                'can be resumed from.' % (self.path, version,
+                                          Checkpoint.VERSION))
+
+        # compare in the form it comes back from msgpack, with lists rather
+        # than tuples.
+        run = unpackb(packb(self.run))
+        saved_run = saved.get('run')
+        if saved_run != run:
+            diffs = ['%s was %r, now %r' % (k, saved_run.get(k), run.get(k))
+                     for k in sorted(set(saved_run) | set(run))
+                     if saved_run.get(k) != run.get(k)]
+            raise CheckpointError(
+                'Checkpoint %s was written by a different run: %s.' %
+                (self.path, '; '.join(diffs)))
+
+        self.saved = saved
+        return True
+
+    def load(self, agg):
+        """
+        If resuming and the checkpoint file exists, merge its state into agg
+        and remember which jobs it covers. Returns True if the file was loaded.
+        See check for the errors this can raise.
+        """
+
+        if not self.check():
+            return False
+
+        saved, self.saved = self.saved, None
+        agg.merge_decode(saved['state'])
+        self.done = bytearray(saved['done'])
+        return True
+
+    def is_done(self, index):
+        byte = index >> 3
+        return byte < len(self.done) and \
+            (self.done[byte] & (1 << (index & 7))) != 0
+
+    def mark_done(self, indices):
+        for index in indices:
+            byte = index >> 3
+            if byte >= len(self.done):
+                self.done.extend(bytes(byte + 1 - len(self.done)))
+            self.done[byte] |= 1 << (index & 7)
+
+    def num_done(self):
+        return sum(bin(b).count('1') for b in self.done)
+
+    def maybe_write(self, agg):
+        from time import monotonic
+
+        now = monotonic()
+        if self.last_write is None or now - self.last_write >= self.interval:
+            self.write(agg)
+            self.last_write = now
+
+    def write(self, agg):
+        import os
+        from msgpack import packb
+
+        data = packb(dict(version=Checkpoint.VERSION, run=self.run,
+                          state=agg.encode(), done=bytes(self.done)))
+
+        # write to a temporary file and rename, so that the checkpoint is
+        # never left half-written if we're interrupted.
+        tmp_name = self.path + '.tmp'
+        with open(tmp_name, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_name, self.path)
+
+
+def _pending(jobs, checkpoint):
+    """
+    Yields (index, job) for each of the jobs which the checkpoint doesn't
+    already cover.
+    """
+
+    for index, job in enumerate(jobs):
+        if checkpoint is None or not checkpoint.is_done(index):
+            yield index, job
+
+
+def worker(input_queue, output_queue, aggregator, send_records=False,
+           flush_every=None, flush_interval=None, profile=None):
     """
     Worker for multi-processing. Reads tasks from a queue and feeds them into
     the Aggregator. When all tasks are done it reads a Sentinel and sends the
     aggregated result back on the output queue.
+
+    If send_records is True, then the per-tile records from the Aggregator are
+    also sent back on the output queue, in batches, as they are produced.
+
+    If flush_every is set, then the partial result is sent back after that
+    many tasks or flush_interval seconds, whichever comes first, along with
+    the indices of the tasks which went into it. The aggregator is then reset,
+    so that each result sent is only what's new since the last one. Otherwise,
+    no indices are kept and the result is sent with an empty list.
+
+    If profile is given, it's the options for a Profiler which times each
+    stage in this worker, and which is sent back just before the result.
     """
 
+    from time import monotonic
+
+    if profile is not None:
+        profiling.enable(profiling.Profiler(**profile))
+
+    records = []
+    indices = []
+    last_flush = monotonic()
     while True:
-        obj = input_queue.get()
+        with profiling.stage('queue.get'):
+            obj = input_queue.get()
         if isinstance(obj, Sentinel):
             break
 
-        assert(isinstance(obj, str))
-        aggregator.add(obj)
+        index, job = obj
+        with profiling.stage('add'):
+            record = aggregator.add(job)
+        # indices are only needed for checkpoints. keeping them otherwise
+        # would grow with the number of jobs.
+        if flush_every is not None:
+            indices.append(index)
+        if send_records:
+            records.append(record)
+            if len(records) >= RECORD_BATCH_SIZE:
+                output_queue.put(('records', records))
+                records = []
+
+        if flush_every is not None and (
+                len(indices) >= flush_every or
+                monotonic() - last_flush >= flush_interval):
+            if records:
+                output_queue.put(('records', records))
+                records = []
+            with profiling.stage('encode'):
+                encoded = aggregator.encode()
+            output_queue.put(('partial', encoded, indices))
+            aggregator.reset()
+            indices = []
+            last_flush = monotonic()
+
         input_queue.task_done()
 
-    output_queue.put(aggregator.encode())
+    if records:
+        output_queue.put(('records', records))
+    with profiling.stage('encode'):
+        encoded = aggregator.encode()
+
+    profiler = profiling.disable()
+    if profiler is not None:
+        output_queue.put(('profile', profiler.encode()))
+    output_queue.put(('result', encoded, indices))
+
+
+class WorkerError(Exception):
+    """
+    Raised when a worker process exits without sending back its result.
+    """
+    pass
+
+
+# how often, in seconds, to check that the worker processes are still alive
+# while waiting on them.
+WORKER_POLL_INTERVAL = 1.0
+
+
+def _check_workers(workers, idle):
+    """
+    Raises WorkerError if any of the workers has failed. If idle is true,
+    then nothing is left on the output queue, so it's also an error if all
+    the workers have exited.
+    """
+
+    exited = [w for w in workers if w.exitcode is not None]
+    for w in exited:
+        if w.exitcode != 0:
+            raise WorkerError('Worker process %d exited with code %d'
+                              % (w.pid, w.exitcode))
+    if idle and len(exited) == len(workers):
+        raise WorkerError('Worker processes exited without sending back '
+                          'their results')
 
 
-def parallel(tile_urls, factory, nprocs):
+def _collect(output_queue, agg, workers, record_fn, checkpoint):
+    """
+    Reads from the output queue until every worker has sent its result,
+    passing per-tile records to record_fn and merging the results into agg.
+    Raises WorkerError if a worker exits without sending its result.
+    """
+
+    from queue import Empty
+    from time import monotonic
+
+    num_results = 0
+    last_check = monotonic()
+    while num_results < len(workers):
+        # the output queue may never be idle for long while the workers are
+        # busy, so they're checked on every so often whatever happens.
+        try:
+            msg = output_queue.get(timeout=WORKER_POLL_INTERVAL)
+        except Empty:
+            _check_workers(workers, True)
+            continue
+        if monotonic() - last_check >= WORKER_POLL_INTERVAL:
+            _check_workers(workers, False)
+            last_check = monotonic()
+
+        kind = msg[0]
+        if kind == 'records':
+            for record in msg[1]:
+                record_fn(record)
+            continue
+
+        if kind == 'profile':
+            profiling.active().merge_decode(msg[1])
+            continue
+
+        with profiling.stage('merge'):
+            agg.merge_decode(msg[1])
+        if checkpoint is not None:
+            checkpoint.mark_done(msg[2])
+            checkpoint.maybe_write(agg)
+        if kind == 'result':
+            num_results += 1
+
+
+class _Collector(object):
+    """
+    Runs _collect on a thread, so that output from the workers is handled as
+    it arrives. If that fails, then the workers are terminated rather than
+    being left blocked on a full output queue, and join re-raises the
+    exception in the calling thread.
+    """
+
+    def __init__(self, output_queue, agg, workers, record_fn=None,
+                 checkpoint=None):
+        from threading import Thread
+
+        self.workers = workers
+        self.error = None
+        self.thread = Thread(target=self._run, args=(
+            output_queue, agg, workers, record_fn, checkpoint))
+        self.thread.start()
+
+    def _run(self, *args):
+        try:
+            _collect(*args)
+        except BaseException as e:
+            self.error = e
+            for w in self.workers:
+                w.terminate()
+            for w in self.workers:
+                w.join()
+
+    def put(self, input_queue, obj):
+        """
+        Puts obj on the workers' input queue, waiting for space for as long
+        as the collector is still running normally. Returns False if the
+        collector failed, in which case nothing more should be sent.
+        """
+
+        from queue import Full
+
+        while self.error is None:
+            try:
+                input_queue.put(obj, timeout=WORKER_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def join(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def parallel(tile_urls, factory, nprocs, record_fn=None, checkpoint=None):
     """
     Fetch percentile data in parallel, using nprocs processes.
 
     This uses two queues; one for input to the workers and one for output from
     the workers. A pool of workers of size nprocs is started, fed with jobs
     from tile_urls, and the results are aggregated at the end and returned.
+
+    If record_fn is given, it is called with each per-tile record as the
+    workers produce them. The output queue is read by a thread while jobs are
+    still being fed to the workers, so that records are handled as they
+    arrive rather than at the end.
+
+    If checkpoint is given, then any state saved in it is loaded first and
+    the jobs it covers are skipped. Workers then send back partial results
+    periodically, which are saved to the checkpoint.
+
+    If profiling is on, then each worker profiles itself in the same way and
+    its profile is merged into this process's when it finishes.
+
+    If handling the output fails, or a worker process dies, then the workers
+    are terminated and the error is raised here.
     """
 
     from multiprocessing import Queue, JoinableQueue, Process
 
     input_queue = JoinableQueue(nprocs)
     output_queue = Queue(nprocs)
+    send_records = record_fn is not None
+
+    flush_every = flush_interval = None
+    if checkpoint is not None:
+        flush_every = checkpoint.flush_every
+        flush_interval = checkpoint.interval
+
+    profile = None
+    if profiling.active() is not None:
+        profile = profiling.active().options()
 
     workers = []
     for i in range(0, nprocs):
         w = Process(target=worker, args=(
-            input_queue, output_queue, factory.create()))
+            input_queue, output_queue, factory.create(), send_records,
+            flush_every, flush_interval, profile))
         w.start()
         workers.append(w)
 
-    for tile_url in tile_urls:
-        input_queue.put(tile_url)
+    agg = factory.create()
+    if checkpoint is not None:
+        checkpoint.load(agg)
+
+    collector = _Collector(output_queue, agg, workers, record_fn, checkpoint)
 
-    # join waits for all the tasks to be marked as done. this way we know that
-    # enqueuing the Sentinel isn't going to "jump the queue" in front of a task
-    # and mean we don't get the full result set back.
-    input_queue.join()
+    # time spent here is time that all the workers were busy.
+    for task in _pending(tile_urls, checkpoint):
+        with profiling.stage('queue.put'):
+            if not collector.put(input_queue, task):
+                break
+
+    # the queue is first in, first out, so the Sentinels can't "jump the
+    # queue" in front of a task. there's no waiting for the tasks to be done
+    # first, as that would never finish if a worker died part way through
+    # one.
     for i in range(0, nprocs):
-        input_queue.put(Sentinel())
+        if not collector.put(input_queue, Sentinel()):
+            break
 
     # after we've queued the Sentinels, each worker should output an aggregated
-    # result on the output queue.
-    agg = factory.create()
-    for i in range(0, nprocs):
-        agg.merge_decode(output_queue.get())
+    # result on the output queue, which the collector merges.
+    collector.join()
+    if checkpoint is not None:
+        checkpoint.write(agg)
 
     # and the worker should have exited, so we can clean up the processes.
     for w in workers:
@@ -222,14 +1229,64 @@ def parallel(tile_urls, factory, nprocs):
     return agg.results
 
 
-def sequential(tile_urls, factory_fn):
+def sequential(tile_urls, factory_fn, record_fn=None, checkpoint=None):
     agg = factory_fn()
-    for tile_url in tile_urls:
-        agg.add(tile_url)
+    if checkpoint is not None:
+        checkpoint.load(agg)
+
+    for index, tile_url in _pending(tile_urls, checkpoint):
+        with profiling.stage('add'):
+            record = agg.add(tile_url)
+        if record_fn is not None:
+            record_fn(record)
+        if checkpoint is not None:
+            checkpoint.mark_done((index,))
+            checkpoint.maybe_write(agg)
+
+    if checkpoint is not None:
+        checkpoint.write(agg)
     return agg.results
 
 
-def calculate_percentiles(tile_urls, percentiles, cache, nprocs):
+def list_percentiles(values, percentiles):
+    """
+    Returns the value at each of percentiles in the list values, which is
+    sorted in place.
+    """
+
+    values.sort()
+    pcts = []
+    for p in percentiles:
+        i = min(len(values) - 1, int(len(values) * p / 100.0))
+        pcts.append(values[i])
+    return pcts
+
+
+def aggregate_sizes(tile_urls, cache, nprocs, record_fn=None, checkpoint=None,
+                    weighted=False, compressor=None):
+    """
+    Fetch tiles and return the distribution of their total and per-layer
+    sizes, as a dict of layer name to the list of sizes or, if weighted is
+    true, to a dict of size to total weight. See calculate_percentiles for
+    the other arguments.
+    """
+
+    def factory_fn():
+        if weighted:
+            return WeightedAggregator(cache, compressor)
+        return Aggregator(cache, compressor)
+
+    if nprocs > 1:
+        return parallel(
+            tile_urls, FactoryFunctionHolder(factory_fn), nprocs, record_fn,
+            checkpoint)
+    else:
+        return sequential(tile_urls, factory_fn, record_fn, checkpoint)
+
+
+def calculate_percentiles(tile_urls, percentiles, cache, nprocs,
+                          record_fn=None, checkpoint=None, weighted=False,
+                          compressor=None):
     """
     Fetch tiles and calculate the percentile sizes in total and per-layer.
 
@@ -242,35 +1299,112 @@ def calculate_percentiles(tile_urls, percentiles, cache, nprocs):
     Nprocs is the number of processes to use for both fetching and aggregation.
     Even on a system with a single CPU, it can be worth setting this to a
     larger number to make concurrent nework requests for tiles.
+
+    If record_fn is given, it is called with a record of each tile's sizes as
+    soon as that tile has been processed.
+
+    If checkpoint is given, the partial result is saved to it periodically
+    and tiles which it already covers are skipped. See Checkpoint.
+
+    If weighted is true, then tile_urls should be (url, weight) tuples, and
+    each tile's sizes count in proportion to its weight. See
+    WeightedAggregator.
+
+    If compressor, a scoville.compression.Compressor, is given, then the
+    percentiles of the compressed sizes are calculated as well, under the
+    compressed_name of each layer. The compression is done in the worker
+    processes.
     """
 
     # check that the input values are in the range we need
+    for p in percentiles:
+        assert 0 <= p <= 100
+
+    results = aggregate_sizes(tile_urls, cache, nprocs, record_fn, checkpoint,
+                              weighted, compressor)
+
+    if weighted:
+        return {label: weighted_percentiles(weights, percentiles)
+                for label, weights in results.items()}
+
+    pct = {}
+    for label, values in results.items():
+        pct[label] = list_percentiles(values, percentiles)
+
+    return pct
+
+
+def calculate_grouped_percentiles(jobs, percentiles, group_fn, cache, nprocs,
+                                  record_fn=None, checkpoint=None,
+                                  relative_accuracy=0.01):
+    """
+    Fetch tiles and calculate the percentile sizes in total and per-layer for
+    each group of tiles, in a single pass. See GroupedAggregator.
+
+    Jobs should be an iterable of (z, x, y, url, weight) tuples, and group_fn
+    is called with each tile's (z, x, y) to get the name of its group. The
+    sizes are accurate to within relative_accuracy.
+
+    Returns a dict of group to a dict of layer name to the list of sizes at
+    each of percentiles. See calculate_percentiles for the other arguments.
+    """
+
     for p in percentiles:
         assert 0 <= p <= 100
 
     def factory_fn():
-        return Aggregator(cache)
+        return GroupedAggregator(group_fn, cache, relative_accuracy)
 
     if nprocs > 1:
         results = parallel(
-            tile_urls, FactoryFunctionHolder(factory_fn), nprocs)
+            jobs, FactoryFunctionHolder(factory_fn), nprocs, record_fn,
+            checkpoint)
     else:
-        results = sequential(tile_urls, factory_fn)
+        results = sequential(jobs, factory_fn, record_fn, checkpoint)
 
-    pct = {}
-    for label, values in results.items():
-        values.sort()
-        pcts = []
-        for p in percentiles:
-            i = min(len(values) - 1, int(len(values) * p / 100.0))
-            pcts.append(values[i])
+    return binned_percentiles(SizeBins(relative_accuracy), results,
+                              percentiles)
 
-        pct[label] = pcts
+
+def calculate_source_percentiles(jobs, num_sources, percentiles, cache,
+                                 nprocs, record_fn=None, checkpoint=None):
+    """
+    Fetch each tile from several sources and calculate the percentile sizes
+    in total and per-layer for each source, along with the percentiles of
+    the per-tile differences and ratios compared to the first source. See
+    MultiSourceAggregator.
+
+    Jobs should be an iterable of lists of num_sources URLs, one for each
+    source. Returns a dict of label, in the order given by source_labels, to
+    a dict of layer name to the list of values at each of percentiles. See
+    calculate_percentiles for the other arguments.
+    """
+
+    for p in percentiles:
+        assert 0 <= p <= 100
+
+    def factory_fn():
+        return MultiSourceAggregator(num_sources, cache)
+
+    if nprocs > 1:
+        results = parallel(
+            jobs, FactoryFunctionHolder(factory_fn), nprocs, record_fn,
+            checkpoint)
+    else:
+        results = sequential(jobs, factory_fn, record_fn, checkpoint)
+
+    pct = {}
+    for label in source_labels(num_sources):
+        if label in results:
+            pct[label] = {
+                name: list_percentiles(values, percentiles)
+                for name, values in results[label].items()}
 
     return pct
 
 
-def calculate_outliers(tile_urls, num_outliers, cache, nprocs):
+def calculate_outliers(tile_urls, num_outliers, cache, nprocs,
+                       record_fn=None, checkpoint=None, compressor=None):
     """
     Fetch tiles and calculate the outlier tiles per layer.
 
@@ -282,15 +1416,111 @@ def calculate_outliers(tile_urls, num_outliers, cache, nprocs):
     Nprocs is the number of processes to use for both fetching and aggregation.
     Even on a system with a single CPU, it can be worth setting this to a
     larger number to make concurrent nework requests for tiles.
+
+    If record_fn is given, it is called with a record of each tile's sizes as
+    soon as that tile has been processed.
+
+    If checkpoint is given, the partial result is saved to it periodically
+    and tiles which it already covers are skipped. See Checkpoint.
+
+    If compressor is given, then the outliers are the layers with the
+    largest compressed sizes. See LargestN.
     """
 
     def factory_fn():
-        return LargestN(num_outliers, cache)
+        return LargestN(num_outliers, cache, compressor)
 
     if nprocs > 1:
         results = parallel(
-            tile_urls, FactoryFunctionHolder(factory_fn), nprocs)
+            tile_urls, FactoryFunctionHolder(factory_fn), nprocs, record_fn,
+            checkpoint)
     else:
-        results = sequential(tile_urls, factory_fn)
+        results = sequential(tile_urls, factory_fn, record_fn, checkpoint)
 
     return results
+
+
+def calculate_archive_percentiles(path, percentiles, nprocs, record_fn=None,
+                                  compressor=None):
+    """
+    Read every tile in the PMTiles archive at path and calculate the
+    percentile sizes in total and per-layer, without any fetching. See
+    scoville.pmtiles.scan_archive.
+
+    Tiles which are stored once but repeated for a run of tile IDs, such as
+    empty ocean, are only parsed once but count once for each tile in the
+    run. See calculate_percentiles for the other arguments.
+    """
+
+    from scoville.pmtiles import scan_archive
+
+    for p in percentiles:
+        assert 0 <= p <= 100
+
+    def factory_fn():
+        return WeightedAggregator(compressor=compressor)
+
+    results = scan_archive(path, factory_fn, nprocs, record_fn,
+                           weighted=True)
+    return {label: weighted_percentiles(weights, percentiles)
+            for label, weights in results.items()}
+
+
+def calculate_archive_outliers(path, num_outliers, nprocs, record_fn=None,
+                               compressor=None):
+    """
+    Read every tile in the PMTiles archive at path and calculate the outlier
+    tiles per layer. See calculate_outliers.
+    """
+
+    from scoville.pmtiles import scan_archive
+
+    def factory_fn():
+        return LargestN(num_outliers, compressor=compressor)
+
+    return scan_archive(path, factory_fn, nprocs, record_fn)
+
+
+def calculate_largest_features(jobs, num, measure, kind_key, cache, nprocs,
+                               record_fn=None, checkpoint=None):
+    """
+    Fetch tiles and find the largest num features in each layer. See
+    LargestFeatures for the measure and kind_key, and calculate_outliers for
+    the other arguments.
+
+    Jobs should be an iterable of (z, x, y, url) tuples. Returns a dict of
+    layer name to a list of entries, as described in LargestFeatures, largest
+    first.
+    """
+
+    def factory_fn():
+        return LargestFeatures(num, measure, kind_key, cache)
+
+    if nprocs > 1:
+        results = parallel(
+            jobs, FactoryFunctionHolder(factory_fn), nprocs, record_fn,
+            checkpoint)
+    else:
+        results = sequential(jobs, factory_fn, record_fn, checkpoint)
+
+    return {name: sorted(entries, reverse=True)
+            for name, entries in results.items() if entries}
+
+
+def export_layers(jobs, cache, nprocs, rows_fn):
+    """
+    Fetch tiles and call rows_fn with the list of per-layer rows from each
+    tile as soon as it has been processed. See LayerExporter for the fields.
+
+    Jobs should be an iterable of (z, x, y, url) tuples. Returns a dict of the
+    number of tiles processed, tiles which failed and rows written.
+    """
+
+    def factory_fn():
+        return LayerExporter(cache)
+
+    if nprocs > 1:
+        return parallel(
+            jobs, FactoryFunctionHolder(factory_fn), nprocs, rows_fn)
+    else:
+        return sequential(jobs, factory_fn, rows_fn)
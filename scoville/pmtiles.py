@@ -0,0 +1,362 @@
+from struct import unpack_from
+
+from scoville.percentiles import LocalTile
+
+MAGIC = b'PMTiles'
+VERSION = 3
+HEADER_SIZE = 127
+
+# values of the header's internal (directory) and tile compression fields.
+COMPRESSION_UNKNOWN = 0
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+
+# the fields of the header which we need, after the magic and version.
+_HEADER_FORMAT = '<7sB' + 'Q' * 11 + 'BBBB'
+_HEADER_FIELDS = (
+    'root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+    'leaf_offset', 'leaf_length', 'data_offset', 'data_length',
+    'num_addressed_tiles', 'num_tile_entries', 'num_tile_contents',
+    'clustered', 'internal_compression', 'tile_compression', 'tile_type',
+)
+
+
+def is_pmtiles(path):
+    return path.endswith('.pmtiles')
+
+
+def _rotate(n, x, y, rx, ry):
+    if ry == 0:
+        if rx == 1:
+            x = n - 1 - x
+            y = n - 1 - y
+        x, y = y, x
+    return x, y
+
+
+def tile_id_to_zxy(tile_id):
+    """
+    Returns the (z, x, y) of a PMTiles tile ID, which numbers the tiles of
+    each zoom in turn along a Hilbert curve.
+    """
+
+    z = 0
+    first = 0
+    while True:
+        num_tiles = 1 << (2 * z)
+        if tile_id < first + num_tiles:
+            break
+        first += num_tiles
+        z += 1
+
+    t = tile_id - first
+    x = y = 0
+    s = 1
+    while s < (1 << z):
+        rx = 1 & (t >> 1)
+        ry = 1 & (t ^ rx)
+        x, y = _rotate(s, x, y, rx, ry)
+        x += s * rx
+        y += s * ry
+        t >>= 2
+        s <<= 1
+    return z, x, y
+
+
+def zxy_to_tile_id(z, x, y):
+    """
+    Returns the PMTiles tile ID of the tile (z, x, y).
+    """
+
+    n = 1 << z
+    first = ((1 << (2 * z)) - 1) // 3
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        x, y = _rotate(n, x, y, rx, ry)
+        s >>= 1
+    return first + d
+
+
+def _decompress(data, compression):
+    from scoville.compression import decompress
+
+    if compression in (COMPRESSION_NONE, COMPRESSION_GZIP,
+                       COMPRESSION_UNKNOWN):
+        # gzip is detected from the data itself, so this is also right for
+        # archives which don't say what their compression is.
+        return decompress(data)
+    raise ValueError('Unsupported PMTiles compression type %d.' %
+                     (compression,))
+
+
+def _read_directory(data):
+    """
+    Decodes a directory into a list of (tile_id, offset, length, run_length)
+    entries. Entries with a run_length of 0 point to leaf directories.
+    """
+
+    from scoville.pbf import Decoder
+
+    d = Decoder(data)
+    num_entries = d.varint()
+
+    tile_ids = []
+    tile_id = 0
+    for _ in range(num_entries):
+        tile_id += d.varint()
+        tile_ids.append(tile_id)
+
+    run_lengths = [d.varint() for _ in range(num_entries)]
+    lengths = [d.varint() for _ in range(num_entries)]
+
+    # an offset of 0 means that the entry directly follows the previous one,
+    # otherwise it's stored plus one.
+    offsets = []
+    for i in range(num_entries):
+        value = d.varint()
+        if value == 0 and i > 0:
+            offsets.append(offsets[i - 1] + lengths[i - 1])
+        else:
+            offsets.append(value - 1)
+
+    return list(zip(tile_ids, offsets, lengths, run_lengths))
+
+
+class PMTiles(object):
+    """
+    Reads a PMTiles (version 3) single-file tile archive. The file is memory
+    mapped, so reading tiles doesn't copy them, unless they need to be
+    decompressed, and the operating system takes care of caching.
+    """
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        if len(self.view) < HEADER_SIZE:
+            self.close()
+            raise ValueError('%s is too short to be a PMTiles file.' %
+                             (path,))
+        values = unpack_from(_HEADER_FORMAT, self.view)
+        magic, version = values[0:2]
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d PMTiles file.' %
+                             (path, VERSION))
+        self.header = dict(zip(_HEADER_FIELDS, values[2:]))
+
+    def _directory(self, offset, length):
+        data = self.view[offset:offset + length]
+        return _read_directory(
+            _decompress(data, self.header['internal_compression']))
+
+    def entries(self):
+        """
+        Yields (tile_id, offset, length, run_length) for each tile entry in
+        the archive, in tile ID order. Offsets are from the start of the file,
+        and run_length is the number of consecutive tile IDs which share the
+        same data.
+        """
+
+        h = self.header
+        stack = [iter(self._directory(h['root_offset'], h['root_length']))]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+                continue
+
+            tile_id, offset, length, run_length = entry
+            if run_length == 0:
+                stack.append(iter(self._directory(
+                    h['leaf_offset'] + offset, length)))
+            else:
+                yield tile_id, h['data_offset'] + offset, length, run_length
+
+    def tile(self, offset, length):
+        """
+        Returns the data of the tile at offset, as a memoryview into the
+        archive if it isn't compressed.
+        """
+
+        return _decompress(self.view[offset:offset + length],
+                           self.header['tile_compression'])
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # views of tiles are still in use somewhere, for example in a
+            # traceback, so the file is unmapped when they're freed instead.
+            pass
+
+
+class PMTilesTile(LocalTile):
+    """
+    A LocalTile for a tile in a PMTiles archive, which reads it from the
+    archive's memory map when it's needed. Only the name is pickled, so that
+    records which refer to the tile can be sent between processes.
+    """
+
+    def __new__(cls, name, archive, offset, length):
+        tile = LocalTile.__new__(cls, name)
+        tile.archive = archive
+        tile.offset = offset
+        tile.length = length
+        return tile
+
+    def read(self):
+        return self.archive.tile(self.offset, self.length)
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+
+def split_by_offset(entries, num):
+    """
+    Sorts entries by offset and splits them into up to num lists, each
+    covering a contiguous range of the archive with about the same number of
+    bytes, so that each worker reads its own part of the file in order.
+    """
+
+    entries = sorted(entries, key=lambda e: e[1])
+    total = sum(e[2] for e in entries)
+
+    parts = []
+    part = []
+    done = 0
+    for entry in entries:
+        part.append(entry)
+        done += entry[2]
+        if done * num >= total * (len(parts) + 1) and len(parts) < num - 1:
+            parts.append(part)
+            part = []
+    if part:
+        parts.append(part)
+    return parts
+
+
+class _EntryJobs(object):
+    """
+    Stands in for the input queue of percentiles.worker, handing out a job
+    for each of a list of entries and then a Sentinel.
+
+    Each job is a PMTilesTile or, if weighted, a (PMTilesTile, run_length)
+    tuple, so that tiles which are repeated many times, such as empty ocean,
+    are only read once.
+    """
+
+    def __init__(self, archive, entries, weighted):
+        self.archive = archive
+        self.entries = iter(entries)
+        self.weighted = weighted
+        self.index = 0
+
+    def get(self):
+        from scoville.percentiles import Sentinel
+
+        entry = next(self.entries, None)
+        if entry is None:
+            return Sentinel()
+
+        tile_id, offset, length, run_length = entry
+        z, x, y = tile_id_to_zxy(tile_id)
+        job = PMTilesTile('%s/%d/%d/%d' % (self.archive.path, z, x, y),
+                          self.archive, offset, length)
+        if self.weighted:
+            job = (job, run_length)
+
+        self.index += 1
+        return self.index - 1, job
+
+    def task_done(self):
+        pass
+
+    def jobs(self):
+        from scoville.percentiles import Sentinel
+
+        while True:
+            obj = self.get()
+            if isinstance(obj, Sentinel):
+                break
+            yield obj[1]
+
+
+def _scan_worker(path, entries, output_queue, aggregator, send_records,
+                 weighted, profile):
+    from scoville.percentiles import worker
+
+    archive = PMTiles(path)
+    try:
+        worker(_EntryJobs(archive, entries, weighted), output_queue,
+               aggregator, send_records, profile=profile)
+    finally:
+        archive.close()
+
+
+def scan_archive(path, factory_fn, nprocs, record_fn=None, weighted=False):
+    """
+    Feeds every tile in the PMTiles archive at path into aggregators made by
+    factory_fn, and returns the merged results, in the same way as
+    percentiles.parallel.
+
+    The directory is read up front, and each of nprocs worker processes is
+    given a contiguous byte range of the archive to read, from its own memory
+    map of the file. If weighted is true, then each job is a (tile, weight)
+    tuple, where the weight is the number of tiles which share that data,
+    otherwise each job is a tile.
+    """
+
+    from scoville import profiling
+    from scoville.percentiles import sequential
+
+    archive = PMTiles(path)
+    try:
+        with profiling.stage('directory'):
+            entries = list(archive.entries())
+
+        if nprocs <= 1:
+            jobs = _EntryJobs(archive, entries, weighted).jobs()
+            return sequential(jobs, factory_fn, record_fn)
+    finally:
+        # each worker process maps the file for itself.
+        archive.close()
+
+    return _scan_parallel(path, split_by_offset(entries, nprocs), factory_fn,
+                          record_fn, weighted)
+
+
+def _scan_parallel(path, parts, factory_fn, record_fn, weighted):
+    from multiprocessing import Process, Queue
+    from scoville import profiling
+    from scoville.percentiles import _Collector
+
+    output_queue = Queue(len(parts))
+    profile = None
+    if profiling.active() is not None:
+        profile = profiling.active().options()
+
+    workers = []
+    for entries in parts:
+        w = Process(target=_scan_worker, args=(
+            path, entries, output_queue, factory_fn(), record_fn is not None,
+            weighted, profile))
+        w.start()
+        workers.append(w)
+
+    agg = factory_fn()
+    _Collector(output_queue, agg, workers, record_fn).join()
+
+    for w in workers:
+        w.join()
+
+    return agg.results
@@ -0,0 +1,300 @@
+import math
+from collections import defaultdict
+from time import perf_counter
+
+
+class LatencyHistogram(object):
+    """
+    Counts durations in logarithmic buckets, each GAMMA times wider than the
+    last, so that percentiles can be read off to within a few percent in a
+    small, fixed amount of memory. Histograms from different processes are
+    merged by adding up their counts.
+    """
+
+    GAMMA = 1.05
+
+    # durations are bucketed in microseconds, and anything shorter than a
+    # microsecond goes in bucket 0.
+    _LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        index = int(math.ceil(math.log(us) / self._LOG_GAMMA)) if us > 1 else 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        Returns the duration, in seconds, at percentile p.
+        """
+
+        if not self.count:
+            return 0.0
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        return min(self.max, self.GAMMA ** index / 1e6)
+
+    def encode(self):
+        return [list(self.counts.items()), self.count, self.total, self.max]
+
+    def merge(self, encoded):
+        pairs, count, total, max_ = encoded
+        for index, n in pairs:
+            self.counts[index] += n
+        self.count += count
+        self.total += total
+        self.max = max(self.max, max_)
+
+
+class _Stage(object):
+    """
+    Context manager which times the code inside it as a named stage.
+    """
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, self.start, perf_counter())
+        return False
+
+
+class _NullStage(object):
+    """
+    Context manager which does nothing, used when profiling is off so that
+    the instrumented code costs as little as possible.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler(object):
+    """
+    Collects a LatencyHistogram of the time spent in each named stage, such
+    as fetching or parsing tiles.
+
+    If trace is true, then every stage is also kept as an event for a Chrome
+    trace file, which can be loaded into chrome://tracing or Perfetto to see
+    exactly what each process and thread was doing when.
+
+    If cprofile is true, then the process is also profiled with cProfile
+    between start and stop, and the stats can be written out as a pstats
+    file. Note that cProfile only sees the thread which started it.
+
+    Profilers from worker processes are merged into the parent with encode
+    and merge_decode, like the aggregators.
+    """
+
+    def __init__(self, trace=False, cprofile=False):
+        import threading
+
+        self.trace = trace
+        self.cprofile = cprofile
+        self.histograms = defaultdict(LatencyHistogram)
+        self.events = []
+        self.cprofile_stats = []
+        self._cprofile = None
+        # stages can be timed from several threads at once, such as in the
+        # proxy server's request handlers.
+        self._lock = threading.Lock()
+
+    def options(self):
+        """
+        Returns the keyword arguments to make a new, empty Profiler which
+        collects the same things as this one, e.g: in a worker process.
+        """
+
+        return dict(trace=self.trace, cprofile=self.cprofile)
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, start, end):
+        with self._lock:
+            self.histograms[name].add(end - start)
+            if self.trace:
+                import os
+                import threading
+                self.events.append((name, start, end - start, os.getpid(),
+                                    threading.get_ident()))
+
+    def start(self):
+        if self.cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            import marshal
+
+            self._cprofile.disable()
+            self._cprofile.create_stats()
+            self.cprofile_stats.append(marshal.dumps(self._cprofile.stats))
+            self._cprofile = None
+
+    def discard(self):
+        """
+        Stops cProfile without keeping its stats.
+        """
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile = None
+
+    def encode(self):
+        from msgpack import packb
+
+        return packb(dict(
+            histograms={name: h.encode()
+                        for name, h in self.histograms.items()},
+            events=self.events,
+            cprofile_stats=self.cprofile_stats))
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+
+        profile = unpackb(data)
+        with self._lock:
+            for name, encoded in profile['histograms'].items():
+                self.histograms[name].merge(encoded)
+            self.events.extend(tuple(e) for e in profile['events'])
+            self.cprofile_stats.extend(profile['cprofile_stats'])
+
+    def write_summary(self, fh, percentiles=(50, 90, 99)):
+        """
+        Writes a table of the number of times each stage ran, its total time
+        and its latency at each of percentiles to fh.
+        """
+
+        headings = ['count', 'total s', 'mean ms'] + \
+            ['p%g ms' % (p,) for p in percentiles] + ['max ms']
+        fh.write('%-16s' % ('STAGE',) +
+                 ''.join(' %10s' % (h,) for h in headings) + '\n')
+
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            values = [h.total / h.count * 1e3] + \
+                [h.percentile(p) * 1e3 for p in percentiles] + [h.max * 1e3]
+            fh.write('%-16s' % (name,) + ' %10d' % (h.count,) +
+                     ' %10.3f' % (h.total,) +
+                     ''.join(' %10.3f' % (v,) for v in values) + '\n')
+
+    def write_trace(self, path):
+        """
+        Writes the trace events to path in the Chrome trace event format.
+        """
+
+        import json
+
+        events = [dict(name=name, ph='X', ts=start * 1e6, dur=duration * 1e6,
+                       pid=pid, tid=tid)
+                  for name, start, duration, pid, tid in self.events]
+        with open(path, 'w') as fh:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fh)
+
+    def write_pstats(self, path):
+        """
+        Writes the cProfile stats from this and all the merged processes to
+        path as a single pstats file.
+        """
+
+        import marshal
+        import pstats
+
+        stats = None
+        for data in self.cprofile_stats:
+            s = pstats.Stats(_RawStats(marshal.loads(data)))
+            if stats is None:
+                stats = s
+            else:
+                stats.add(s)
+
+        if stats is not None:
+            stats.dump_stats(path)
+
+
+class _RawStats(object):
+    """
+    Wraps a dict of cProfile stats so that pstats.Stats can load it, as it
+    only accepts file names or profiler objects.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# the profiler for this process, or None if profiling is off.
+_active = None
+
+
+def enable(profiler):
+    """
+    Makes profiler the active profiler for this process and starts it.
+    """
+
+    global _active
+    # a forked worker process inherits its parent's profiler, which has to be
+    # stopped, but its stats belong to the parent.
+    if _active is not None:
+        _active.discard()
+    _active = profiler
+    profiler.start()
+
+
+def disable():
+    """
+    Stops the active profiler, if there is one, and returns it.
+    """
+
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def active():
+    return _active
+
+
+def stage(name):
+    """
+    Returns a context manager which times the code inside it as the stage
+    name, if profiling is on, or does nothing otherwise.
+    """
+
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
@@ -0,0 +1,272 @@
+from collections import defaultdict
+
+from scoville import profiling
+from scoville.mvt import Tile
+from scoville.percentiles import _error_record
+from scoville.percentiles import _fetch_cache
+from scoville.percentiles import _fetch_http
+
+
+class HeavyHitters(object):
+    """
+    A mergeable summary of the items with the largest total weight in a
+    stream, using the Misra-Gries algorithm with weights.
+
+    Up to 2 * capacity items are counted exactly. When there are more, the
+    weight of the (capacity + 1)th largest is subtracted from all of them
+    and any which drop to zero or less are forgotten. Each estimate is then
+    at most the true weight, and at most error below it, where error is the
+    total subtracted so far. Any item with more than 1 / (capacity + 1) of
+    the total weight is guaranteed to be kept.
+
+    Summaries are merged by adding up their counts and errors and trimming
+    in the same way, which keeps the same guarantees.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, item, weight=1):
+        counts = self.counts
+        counts[item] = counts.get(item, 0) + weight
+        if len(counts) > 2 * self.capacity:
+            self._trim()
+
+    def _trim(self):
+        weights = sorted(self.counts.values(), reverse=True)
+        cut = weights[self.capacity]
+        self.counts = {item: weight - cut
+                       for item, weight in self.counts.items()
+                       if weight > cut}
+        self.error += cut
+
+    def top(self, num):
+        """
+        Returns the num items with the largest estimated weights, as a list of
+        (item, weight) pairs, largest first.
+        """
+
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[
+            :num]
+
+    def encode(self):
+        return [list(self.counts.items()), self.error]
+
+    def merge(self, encoded):
+        pairs, error = encoded
+        for item, weight in pairs:
+            self.counts[item] = self.counts.get(item, 0) + weight
+        self.error += error
+        if len(self.counts) > 2 * self.capacity:
+            self._trim()
+
+
+def _varint_size(value):
+    size = 1
+    while value > 127:
+        value >>= 7
+        size += 1
+    return size
+
+
+def _field_size(length):
+    # size of a length-delimited field with a single byte tag, as the keys
+    # and values tables are.
+    return 1 + _varint_size(length) + length
+
+
+# the per-key statistics, in the order they're kept in a list.
+FIELDS = (
+    'tiles',
+    'refs',
+    'key_bytes',
+    'tag_bytes',
+    'values',
+    'value_bytes',
+    'single_use',
+    'single_use_bytes',
+)
+
+TILES, REFS, KEY_BYTES, TAG_BYTES, VALUES, VALUE_BYTES, SINGLE_USE, \
+    SINGLE_USE_BYTES = range(len(FIELDS))
+
+# pseudo-key for entries in the values table which no feature refers to.
+UNREFERENCED = '~unreferenced'
+
+
+def layer_property_stats(layer):
+    """
+    Breaks down the bytes which the layer spends on properties by key.
+
+    Returns a tuple of a dict of key to a list of the FIELDS for that key,
+    and a dict of key to a dict of encoded value to the bytes spent on it.
+
+    For each key, this counts the bytes of its entry in the keys table, the
+    bytes of the feature tags which refer to it, and the bytes of the values
+    it refers to in the values table. The same value can be shared between
+    keys, in which case it's counted against the first key to use it. A
+    value which is only used once gets no benefit from deduplication, so
+    these are counted separately as single_use.
+    """
+
+    keys = layer.keys
+    values = layer.values
+    value_refs = [0] * len(values)
+    value_tag_bytes = [0] * len(values)
+    value_owner = [None] * len(values)
+
+    stats = {}
+    for k in keys:
+        entry = stats[k] = [0] * len(FIELDS)
+        entry[TILES] = 1
+        entry[KEY_BYTES] = _field_size(len(k.encode('utf-8')))
+
+    for feature in layer.features:
+        tags = feature.tags
+        for i in range(0, len(tags), 2):
+            k = tags[i]
+            v = tags[i + 1]
+            tag_bytes = _varint_size(k) + _varint_size(v)
+            entry = stats[keys[k]]
+            entry[REFS] += 1
+            entry[TAG_BYTES] += tag_bytes
+            value_refs[v] += 1
+            value_tag_bytes[v] += tag_bytes
+            if value_owner[v] is None:
+                value_owner[v] = keys[k]
+
+    value_costs = defaultdict(dict)
+    for v, data in enumerate(values):
+        key = value_owner[v]
+        if key is None:
+            key = UNREFERENCED
+            if key not in stats:
+                stats[key] = [0] * len(FIELDS)
+                stats[key][TILES] = 1
+
+        entry = stats[key]
+        value_bytes = _field_size(len(data))
+        entry[VALUES] += 1
+        entry[VALUE_BYTES] += value_bytes
+        if value_refs[v] == 1:
+            entry[SINGLE_USE] += 1
+            entry[SINGLE_USE_BYTES] += value_bytes
+
+        raw = bytes(data)
+        value_costs[key][raw] = value_costs[key].get(raw, 0) + \
+            value_bytes + value_tag_bytes[v]
+
+    return stats, value_costs
+
+
+class PropertyAggregator(object):
+    """
+    Aggregates layer_property_stats across tiles. The statistics for each key
+    in each layer are added up exactly, as there are only so many keys. The
+    values for each key are summarised with a HeavyHitters of the given
+    capacity, weighted by the bytes spent on each value, so that memory
+    stays bounded however many tiles there are.
+
+    Each job given to add is a tile URL. The results are a dict of layer name
+    to a dict of key to a pair of the list of FIELDS and the HeavyHitters of
+    its values.
+    """
+
+    def __init__(self, capacity=100, cache=False):
+        self.capacity = capacity
+        self.fetch_fn = _fetch_http
+        if cache:
+            self.fetch_fn = _fetch_cache
+
+        self.reset()
+
+    def reset(self):
+        self.results = defaultdict(dict)
+
+    def _key(self, name, key):
+        layer = self.results[name]
+        entry = layer.get(key)
+        if entry is None:
+            entry = layer[key] = ([0] * len(FIELDS),
+                                  HeavyHitters(self.capacity))
+        return entry
+
+    def add(self, tile_url):
+        """
+        Fetches the tile and adds the statistics for each of its layers.
+        Returns a record of the tile's sizes.
+        """
+
+        data = self.fetch_fn(tile_url)
+        if data is None:
+            return _error_record(tile_url)
+
+        sizes = {'~total': len(data)}
+        with profiling.stage('parse'):
+            for layer in Tile(data):
+                sizes[layer.name] = layer.size
+                stats, value_costs = layer_property_stats(layer)
+                for key, entry in stats.items():
+                    total, hitters = self._key(layer.name, key)
+                    for i, n in enumerate(entry):
+                        total[i] += n
+                    for raw, cost in value_costs.get(key, {}).items():
+                        hitters.add(raw, cost)
+
+        return dict(tile=tile_url, sizes=sizes)
+
+    def encode(self):
+        from msgpack import packb
+        return packb({
+            name: {key: [total, hitters.encode()]
+                   for key, (total, hitters) in keys.items()}
+            for name, keys in self.results.items()})
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        for name, keys in unpackb(data).items():
+            for key, (entry, encoded) in keys.items():
+                total, hitters = self._key(name, key)
+                for i, n in enumerate(entry):
+                    total[i] += n
+                hitters.merge(encoded)
+
+
+def calculate_property_stats(tile_urls, cache, nprocs, capacity=100,
+                             num_values=5, record_fn=None):
+    """
+    Fetch tiles and break down the bytes spent on properties by layer and
+    key, see PropertyAggregator.
+
+    Returns a dict of layer name to a dict of key to a dict of the FIELDS,
+    plus 'top_values', a list of up to num_values (value, bytes) pairs of the
+    values which the most bytes were spent on, and 'values_error', the most
+    that each of those bytes might be under-estimated by.
+    """
+
+    from scoville.mvt import _decode_value
+    from scoville.percentiles import FactoryFunctionHolder
+    from scoville.percentiles import parallel
+    from scoville.percentiles import sequential
+
+    def factory_fn():
+        return PropertyAggregator(capacity, cache)
+
+    if nprocs > 1:
+        results = parallel(
+            tile_urls, FactoryFunctionHolder(factory_fn), nprocs, record_fn)
+    else:
+        results = sequential(tile_urls, factory_fn, record_fn)
+
+    output = {}
+    for name, keys in results.items():
+        layer = output[name] = {}
+        for key, (total, hitters) in keys.items():
+            stats = layer[key] = dict(zip(FIELDS, total))
+            stats['top_values'] = [(_decode_value(raw), cost)
+                                   for raw, cost in hitters.top(num_values)]
+            stats['values_error'] = hitters.error
+
+    return output
@@ -1,56 +1,213 @@
 import http.server
 import re
 import socketserver
+import zlib
+from functools import lru_cache
+from http import HTTPStatus
 
-import pkg_resources
-import requests
-import squarify
-
+from scoville import profiling
+from scoville.compression import decompress
 from scoville.mvt import Tile
+from scoville.tilelist import UrlTemplate
+
+TILE_PATTERN = re.compile(
+    '^/tiles/([0-9]+)/([0-9]+)/([0-9]+)\\.(png|svg)$')
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# templates for the map page, and the content type each is served with.
+TEMPLATES = {
+    'index.html': 'text/html; charset=utf-8',
+    'style.css': 'text/css; charset=utf-8',
+    'map.js': 'application/javascript; charset=utf-8',
+}
+
+# how often, in seconds, to check whether the client has gone away while we
+# are waiting on upstream tiles.
+CLIENT_POLL_INTERVAL = 0.25
+
+
+def _response_status(fut):
+    """
+    Returns the HTTP status of a completed upstream fetch, mapping errors
+    which didn't produce a response at all onto a suitable gateway status.
+    """
+
+    import requests
+
+    try:
+        return fut.result().status_code
+    except requests.exceptions.Timeout:
+        return HTTPStatus.GATEWAY_TIMEOUT
+    except requests.exceptions.RequestException:
+        return HTTPStatus.BAD_GATEWAY
+
+
+def _observe_upstream(metrics, start, fut):
+    """
+    Done callback for an upstream fetch started at start, which counts it
+    and its latency in metrics.
+    """
+
+    from time import monotonic
+
+    if fut.cancelled():
+        metrics.upstream.inc(('cancelled',))
+        return
+
+    metrics.upstream.inc((str(int(_response_status(fut))),))
+    metrics.upstream_seconds.observe(monotonic() - start)
+
+
+def _client_disconnected(sock):
+    """
+    Returns True if the client at the other end of sock has closed the
+    connection, e.g: because the browser has panned away from the tile.
+    """
+
+    import select
+    import socket
+
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # a socket which is readable but has no data means EOF.
+        return sock.recv(1, socket.MSG_PEEK) == b''
+
+    except (OSError, ValueError):
+        return True
+
+
+def _text_size(font, text):
+    """
+    Returns the (width, height) of text when drawn in font.
+    """
+
+    left, top, right, bottom = font.getbbox(text)
+    return right - left, bottom - top
+
 
-TILE_PATTERN = re.compile('^/tiles/([0-9]+)/([0-9]+)/([0-9]+)/.png$')
+# crc32 is stable across processes and runs, unlike hash(), so each layer
+# keeps the same colour everywhere. the offset is chosen so that 'water' gets
+# hue 240, i.e: blue.
+_HUE_OFFSET = (240 - zlib.crc32(b'water')) % 360
+
+
+@lru_cache(maxsize=1024)
+def _squarify_layout(sizes, width, height):
+    """
+    Returns the treemap rectangles for a tuple of sizes, sorted largest first,
+    as a tuple of (x, y, dx, dy). Many tiles, such as those over the ocean,
+    have exactly the same layer sizes, so this is cached.
+    """
+
+    import squarify
+
+    values = squarify.normalize_sizes(list(sizes), width, height)
+    rects = squarify.squarify(values, 0, 0, width, height)
+    return tuple((r['x'], r['y'], r['dx'], r['dy']) for r in rects)
 
 
 class Treemap(object):
     """
     Draws a Treemap of layer sizes within the tile.
+
+    Colours and label sizes depend only on the layer name, so they're
+    computed once per name and remembered.
     """
 
+    # the treemap is drawn from a single tile, so there's nothing to render
+    # if that fails.
+    partial = False
+    png_options = {}
+
+    # each treemap uses only its own tile, so no tiles share upstream data.
+    shared_zoom = None
+
+    width = height = 256
+
+    def __init__(self):
+        self._font = None
+        self._styles = {}
+        self._label_sizes = {}
+
+    def __getstate__(self):
+        # fonts can't be pickled, but are cheap enough to load again in each
+        # worker process.
+        state = self.__dict__.copy()
+        state['_font'] = None
+        return state
+
     def tiles_for(self, z, x, y):
         return {0: (z, x, y)}
 
-    def render(self, tiles):
-        from PIL import Image, ImageDraw, ImageFont
+    @property
+    def font(self):
+        if self._font is None:
+            from PIL import ImageFont
+            self._font = ImageFont.load_default()
+        return self._font
+
+    def style(self, name):
+        """
+        Returns the (fill, outline) RGB colours for a layer name.
+        """
+
+        style = self._styles.get(name)
+        if style is None:
+            from colorsys import hls_to_rgb
+
+            hue = (zlib.crc32(name.encode('utf-8')) + _HUE_OFFSET) % 360
+            style = tuple(
+                tuple(int(round(c * 255))
+                      for c in hls_to_rgb(hue / 360.0, lightness, 1.0))
+                for lightness in (0.7, 0.3))
+            self._styles[name] = style
+        return style
+
+    def label_size(self, name):
+        size = self._label_sizes.get(name)
+        if size is None:
+            size = _text_size(self.font, name)
+            self._label_sizes[name] = size
+        return size
+
+    def layout(self, tile):
+        """
+        Returns a list of (name, x, y, dx, dy) for each layer in the tile, in
+        the order they should be drawn.
+        """
 
-        tile = tiles[0]
         sizes = []
         for layer in tile:
             sizes.append((layer.size, layer.name))
         sizes.sort(reverse=True)
 
-        width = height = 256
-        im = Image.new('RGB', (width, height), 'black')
-
-        values = squarify.normalize_sizes([r[0] for r in sizes], width, height)
-        rects = squarify.squarify(values, 0, 0, width, height)
+        rects = _squarify_layout(
+            tuple(r[0] for r in sizes), self.width, self.height)
         names = [r[1] for r in sizes]
 
+        return [(name,) + rect
+                for rect, name in reversed(list(zip(rects, names)))]
+
+    def render(self, tiles):
+        from PIL import Image, ImageDraw
+
+        tile = tiles[0]
+        im = Image.new('RGB', (self.width, self.height), 'black')
         draw = ImageDraw.Draw(im)
-        font = ImageFont.load_default()
-
-        for rect, name in reversed(list(zip(rects, names))):
-            # hack to get 'water' => hue(240) = blue
-            hue = (name.__hash__() + 192) % 360
-            colour = 'hsl(%d, 100%%, 70%%)' % (hue,)
-            outline_colour = 'hsl(%d, 100%%, 30%%)' % (hue,)
-            x = rect['x']
-            y = rect['y']
-            dx = rect['dx']
-            dy = rect['dy']
+        font = self.font
+
+        for name, x, y, dx, dy in self.layout(tile):
+            colour, outline_colour = self.style(name)
             draw.rectangle([x, y, x + dx, y + dy], fill=colour,
                            outline=outline_colour)
 
-            text_w, text_h = font.getsize(name)
+            text_w, text_h = self.label_size(name)
             if dx > text_w and dy > text_h:
                 centre = (x + dx / 2, y + dy / 2)
                 top_left = (centre[0] - text_w / 2,
@@ -58,8 +215,8 @@ class Treemap(object):
                 draw.text(top_left, name, fill='black', font=font)
 
         if tile.name:
-            text_w, text_h = font.getsize(tile.name)
-            center = (width / 2, height / 2)
+            text_w, text_h = self.label_size(tile.name)
+            center = (self.width / 2, self.height / 2)
             top_left_up_a_couple = (center[0] - text_w / 2,
                                     2 * text_h)
             draw.text(top_left_up_a_couple, tile.name, fill='black', font=font)
@@ -67,16 +224,114 @@ class Treemap(object):
         del draw
         return im
 
+    def render_svg(self, tiles):
+        """
+        Returns the treemap as an SVG document string, without rasterising
+        it. Labels are placed using the same metrics as the PNG output.
+        """
+
+        from xml.sax.saxutils import escape
+
+        tile = tiles[0]
+        parts = [
+            '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">'
+            % (self.width, self.height),
+            '<rect width="100%" height="100%" fill="black"/>',
+        ]
+
+        for name, x, y, dx, dy in self.layout(tile):
+            colour, outline_colour = self.style(name)
+            parts.append(
+                '<rect x="%.2f" y="%.2f" width="%.2f" height="%.2f" '
+                'fill="#%02x%02x%02x" stroke="#%02x%02x%02x"/>'
+                % ((x, y, dx, dy) + colour + outline_colour))
+
+            text_w, text_h = self.label_size(name)
+            if dx > text_w and dy > text_h:
+                parts.append(
+                    '<text x="%.2f" y="%.2f" text-anchor="middle" '
+                    'dominant-baseline="central" font-size="%d">%s</text>'
+                    % (x + dx / 2, y + dy / 2, text_h, escape(name)))
+
+        if tile.name:
+            text_w, text_h = self.label_size(tile.name)
+            parts.append(
+                '<text x="%.2f" y="%.2f" text-anchor="middle" '
+                'dominant-baseline="hanging" font-size="%d">%s</text>'
+                % (self.width / 2, 2 * text_h, text_h, escape(tile.name)))
+
+        parts.append('</svg>')
+        return '\n'.join(parts)
+
+
+class ColourMap(object):
+    """
+    Maps tile sizes onto colours by bucketing them against a sorted list of
+    size thresholds. A size below thresholds[0] gets colours[0], a size below
+    thresholds[1] gets colours[1], and so on, with anything at or over the
+    last threshold getting the last colour.
+    """
+
+    def __init__(self, thresholds, colours):
+        assert len(colours) == len(thresholds) + 1
+        assert list(thresholds) == sorted(thresholds)
+        self.thresholds = list(thresholds)
+        self.colours = list(colours)
+
+    def index(self, size):
+        from bisect import bisect_right
+        return bisect_right(self.thresholds, size)
+
+    def __call__(self, size):
+        return self.colours[self.index(size)]
+
 
 class Heatmap(object):
     """
     Renders each tile as a heatmap.
+
+    Sub-tiles which couldn't be fetched are passed to render as None, and are
+    drawn in error_colour rather than failing the whole tile.
+
+    The grid of sizes is drawn as one pixel per sub-tile in a palette image,
+    which is then scaled up to the full tile size in one go. If palette is
+    True, the PNG is written in palette mode as well, which is both smaller
+    and quicker to encode than RGB.
+
+    If a scoville.compression.Compressor is given, then tiles are coloured by
+    their compressed size rather than their raw size.
     """
 
-    def __init__(self, sub_zooms, max_zoom, colour_map):
+    partial = True
+
+    def __init__(self, sub_zooms, max_zoom, colour_map,
+                 error_colour='#808080', palette=True, compress_level=6,
+                 compressor=None):
         self.sub_zooms = sub_zooms
         self.max_zoom = max_zoom
         self.colour_map = colour_map
+        self.size_fn = len
+        if compressor is not None:
+            self.size_fn = compressor.size
+        self.error_colour = error_colour
+        self.palette = palette
+        self.png_options = dict(compress_level=compress_level)
+
+        # palette entries are the colour map's colours, in order, followed by
+        # the error colour and black for the outline and label.
+        self.error_index = len(colour_map.colours)
+        self.black_index = self.error_index + 1
+        self.palette_data = _palette_data(
+            colour_map.colours + [error_colour, '#000000'])
+
+    @property
+    def shared_zoom(self):
+        """
+        Zoom from which all the tiles beneath a common ancestor draw from the
+        same max_zoom upstream tiles.
+        """
+
+        return max(self.max_zoom - self.sub_zooms, 0)
 
     def tiles_for(self, z, x, y):
         sub_z = min(z + self.sub_zooms, self.max_zoom)
@@ -97,127 +352,542 @@ class Heatmap(object):
         assert len(tiles) == ntiles ** 2
 
         width = height = 256
-        im = Image.new('RGB', (width, height), 'black')
-
-        draw = ImageDraw.Draw(im)
-
-        scale = width / ntiles
+        scale = width // ntiles
         assert width == scale * ntiles
 
+        # build the grid of palette indices in row-major order, as that's
+        # what putdata expects.
+        indices = []
         parent_coord_name = ''
-        for x in range(0, ntiles):
-            for y in range(0, ntiles):
+        for y in range(0, ntiles):
+            for x in range(0, ntiles):
                 tile = tiles[(x, y)]
-                size = len(tile.data)
-                colour = self.colour_map(size)
+                if tile is None:
+                    indices.append(self.error_index)
+                    continue
 
                 if not parent_coord_name:
                     parent_coord_name = tile.name
+                indices.append(self.colour_map.index(self.size_fn(tile.data)))
+
+        grid = Image.new('P', (ntiles, ntiles))
+        grid.putpalette(self.palette_data)
+        grid.putdata(indices)
+        im = grid.resize((width, height), Image.NEAREST)
 
-                draw.rectangle(
-                    [x * scale, y * scale, (x + 1) * scale, (y + 1) * scale],
-                    fill=colour)
+        draw = ImageDraw.Draw(im)
 
         if parent_coord_name:
             font = ImageFont.load_default()
-            text_w, text_h = font.getsize(parent_coord_name)
+            text_w, text_h = _text_size(font, parent_coord_name)
             center = (width / 2, height / 2)
             top_left = (center[0] - text_w / 2, center[1] - text_h / 2)
-            draw.text(top_left, parent_coord_name, fill='black', font=font)
+            draw.text(top_left, parent_coord_name, fill=self.black_index,
+                      font=font)
 
-        draw.rectangle([0, 0, width, height], outline='black', fill=None)
+        draw.rectangle([0, 0, width, height], outline=self.black_index,
+                       fill=None)
 
         del draw
+
+        if not self.palette:
+            im = im.convert('RGB')
         return im
 
 
+def _palette_data(colours):
+    """
+    Flattens a list of colour names into the list of RGB values used by
+    PIL's putpalette.
+    """
+
+    from PIL import ImageColor
+
+    data = []
+    for colour in colours:
+        data.extend(ImageColor.getrgb(colour))
+    return data
+
+
+class Asset(object):
+    """
+    A rendered template, ready to be sent as-is, with a gzipped copy for
+    clients which accept it.
+    """
+
+    def __init__(self, data, content_type):
+        import gzip
+        from hashlib import sha1
+
+        self.data = data
+        self.gzipped = gzip.compress(data, 9)
+        self.content_type = content_type
+        # the two encodings are different representations, so caches need
+        # to be able to tell them apart by their ETags.
+        digest = sha1(data).hexdigest()
+        self.etag = '"%s"' % (digest,)
+        self.gzipped_etag = '"%s-gzip"' % (digest,)
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Returns True if the Accept-Encoding header value allows a gzipped
+    response, i.e: if gzip, or failing that *, is listed with a non-zero
+    quality.
+    """
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def _etag_matches(if_none_match, etag):
+    # If-None-Match is a list of ETags, any of which can be weak, or *.
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(
+        (tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def load_assets(port):
+    """
+    Renders all the templates for the map page for a server on port, and
+    returns a dict of template name to Asset.
+    """
+
+    from importlib.resources import files
+    from jinja2 import Template
+
+    resources = files('scoville').joinpath('proxy')
+    assets = {}
+    for name, content_type in TEMPLATES.items():
+        template = Template(resources.joinpath(name).read_text('utf-8'))
+        data = template.render(port=port).encode('utf-8')
+        assets[name] = Asset(data, content_type)
+    return assets
+
+
+def can_encode(renderer, fmt):
+    """
+    Returns True if the renderer is able to produce output in format fmt.
+    """
+
+    return fmt == 'png' or (fmt == 'svg' and hasattr(renderer, 'render_svg'))
+
+
+def render_image(renderer, tiles, fmt='png'):
+    """
+    Renders tiles into a PIL image or, for SVG, a document string, ready to
+    be passed to encode_image.
+    """
+
+    if fmt == 'svg':
+        return renderer.render_svg(tiles)
+    return renderer.render(tiles)
+
+
+def encode_image(renderer, im, fmt='png'):
+    """
+    Returns the bytes of an image from render_image in format fmt.
+    """
+
+    if fmt == 'svg':
+        return im.encode('utf-8')
+
+    from io import BytesIO
+
+    buf = BytesIO()
+    im.save(buf, 'PNG', **renderer.png_options)
+    return buf.getvalue()
+
+
+def encode_tile(renderer, tiles, fmt='png'):
+    """
+    Renders tiles and returns the encoded image as bytes in format fmt, which
+    should be one of the keys of CONTENT_TYPES.
+    """
+
+    return encode_image(renderer, render_image(renderer, tiles, fmt), fmt)
+
+
+class ProxyMetrics(object):
+    """
+    The metrics served on /metrics, for seeing how busy the server is, and
+    where the time goes, when sizing it.
+    """
+
+    def __init__(self):
+        import threading
+        from scoville.metrics import Registry
+
+        r = self.registry = Registry()
+        self.requests = r.counter(
+            'scoville_http_requests_total',
+            'HTTP requests served, by route and status.',
+            ('route', 'status'))
+        self.request_seconds = r.histogram(
+            'scoville_http_request_duration_seconds',
+            'Time taken to serve each HTTP request, by route.', ('route',))
+        self.in_flight = r.gauge(
+            'scoville_http_requests_in_flight',
+            'HTTP requests currently being served.')
+        self.disconnects = r.counter(
+            'scoville_client_disconnects_total',
+            'Tile requests abandoned because the client went away.')
+        self.upstream = r.counter(
+            'scoville_upstream_requests_total',
+            'Upstream tile fetches, by status.', ('status',))
+        self.upstream_seconds = r.histogram(
+            'scoville_upstream_request_duration_seconds',
+            'Time taken by each upstream tile fetch.')
+        self.render_seconds = r.histogram(
+            'scoville_render_duration_seconds',
+            'Time taken to draw each tile, by format.', ('format',))
+        self.encode_seconds = r.histogram(
+            'scoville_encode_duration_seconds',
+            'Time taken to encode each drawn tile, by format.', ('format',))
+        self.store = r.counter(
+            'scoville_tile_store_requests_total',
+            'Lookups in the pre-rendered tile store, by result.',
+            ('result',))
+        r.counter('scoville_layout_cache_hits_total',
+                  'Hits in the cache of treemap layouts.',
+                  fn=lambda: _squarify_layout.cache_info().hits)
+        r.counter('scoville_layout_cache_misses_total',
+                  'Misses in the cache of treemap layouts.',
+                  fn=lambda: _squarify_layout.cache_info().misses)
+        r.gauge('scoville_threads', 'Threads in the server process.',
+                fn=threading.active_count)
+
+
 class Handler(http.server.BaseHTTPRequestHandler):
     def do_GET(self):
+        from time import monotonic
+
+        metrics = self.server.metrics
+        start = monotonic()
+        self.status = None
+        self.response_size = 0
+        # time in seconds spent on each part of the request, for the log.
+        self.timings = {}
+        route = 'other'
+
+        metrics.in_flight.inc()
+        try:
+            route = self.route()
+        finally:
+            duration = monotonic() - start
+            metrics.in_flight.dec()
+            status = '-' if self.status is None else str(self.status)
+            metrics.requests.inc((route, status))
+            metrics.request_seconds.observe(duration, (route,))
+            self.log_access(route, duration)
+
+    def route(self):
+        """
+        Serves the request, returning the name of the route which served it,
+        for the metrics and log.
+        """
+
         if self.path in ('/', '/index.html', '/style.css', '/map.js'):
             template_name = self.path[1:]
             if not template_name:
                 template_name = 'index.html'
 
             self.send_template(template_name)
-            return
+            return 'template'
+
+        if self.path == '/metrics':
+            self.send_metrics()
+            return 'metrics'
 
         m = TILE_PATTERN.match(self.path)
         if m:
-            z, x, y = list(map(int, m.groups()))
+            z, x, y = list(map(int, m.groups()[0:3]))
+            fmt = m.group(4)
 
             if 0 <= z < 16 and \
                     0 <= x < (1 << z) and \
-                    0 <= y < (1 << z):
-                self.send_tile(z, x, y)
-                return
+                    0 <= y < (1 << z) and \
+                    can_encode(self.server.renderer, fmt):
+                with profiling.stage('proxy.request'):
+                    if not self.send_stored_tile(z, x, y, fmt):
+                        self.send_tile(z, x, y, fmt)
+                return 'tile'
 
         self.error_not_found()
+        return 'other'
+
+    def send_response(self, code, message=None):
+        self.status = int(code)
+        http.server.BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def log_request(self, code='-', size='-'):
+        # requests are logged by log_access once they're complete, so that
+        # the timings can be included.
+        pass
+
+    def log_access(self, route, duration):
+        """
+        Writes a JSON line about the request to the server's access log.
+        """
+
+        access_log = self.server.access_log
+        if access_log is None:
+            return
+
+        import json
+        from datetime import datetime, timezone
+
+        entry = dict(
+            time=datetime.now(timezone.utc).isoformat(),
+            client=self.client_address[0],
+            method=self.command,
+            path=self.path,
+            route=route,
+            status=self.status,
+            bytes=self.response_size,
+            duration_ms=round(duration * 1000, 3),
+        )
+        for name, seconds in self.timings.items():
+            entry[name + '_ms'] = round(seconds * 1000, 3)
+
+        line = json.dumps(entry) + '\n'
+        with self.server.access_log_lock:
+            access_log.write(line)
+            access_log.flush()
+
+    def send_metrics(self):
+        from scoville.metrics import Registry
+
+        data = self.server.metrics.registry.render().encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', Registry.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.response_size = len(data)
 
     def error_not_found(self):
-        self.send_response(requests.codes.not_found)
+        self.send_response(HTTPStatus.NOT_FOUND)
+        self.end_headers()
+
+    def send_stored_tile(self, z, x, y, fmt):
+        """
+        Sends a pre-rendered tile from the server's tile store, if there is
+        one, returning True if the tile was sent.
+        """
+
+        store = self.server.store
+        if store is None or store.ext != fmt:
+            return False
+
+        data = store.get(z, x, y)
+        self.server.metrics.store.inc(('miss' if data is None else 'hit',))
+        if data is None:
+            return False
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', CONTENT_TYPES[fmt])
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-control', 'max-age=300')
+        self.end_headers()
+        self.wfile.write(data)
+        self.response_size = len(data)
+        return True
+
+    def send_tile(self, z, x, y, fmt='png'):
+        from concurrent.futures import FIRST_COMPLETED
+        from concurrent.futures import ThreadPoolExecutor
+        from concurrent.futures import wait
+        from functools import partial
+        from time import monotonic
 
-    def send_tile(self, z, x, y):
         from requests_futures.sessions import FuturesSession
 
-        session = FuturesSession()
+        renderer = self.server.renderer
+        metrics = self.server.metrics
+        deadline = monotonic() + self.server.deadline
+
+        # we own the executor so that we can cancel any fetches which haven't
+        # started yet when we give up on the tile, rather than leaving them
+        # to run to completion in the background.
+        executor = ThreadPoolExecutor(max_workers=self.server.max_fetches)
+        session = FuturesSession(executor=executor)
 
         parent_coord = (z, x, y)
+        parent_name = '%s/%s/%s' % parent_coord
 
         futures = {}
-        tile_map = self.server.renderer.tiles_for(z, x, y)
+        tile_map = renderer.tiles_for(z, x, y)
         for name, coord in tile_map.items():
             z, x, y = coord
-            url = self.server.url_pattern \
-                .replace('{z}', str(z)) \
-                .replace('{x}', str(x)) \
-                .replace('{y}', str(y))
-
-            futures[name] = session.get(url)
+            url = self.server.tile_url(z, x, y)
+            fut = session.get(url, timeout=self.server.deadline)
+            fut.add_done_callback(
+                partial(_observe_upstream, metrics, monotonic()))
+            futures[fut] = name
 
         tiles = {}
-        for name, fut in futures.items():
-            res = fut.result()
-            if res.status_code != requests.codes.ok:
-                self.send_response(res.status_code)
-                return
+        status = None
+        start = monotonic()
+        with profiling.stage('proxy.upstream'):
+            try:
+                pending = set(futures)
+                while pending:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        status = status or HTTPStatus.GATEWAY_TIMEOUT
+                        break
+
+                    # wake up periodically, even if nothing has completed, to
+                    # check whether the client has gone away.
+                    done, pending = wait(
+                        pending, timeout=min(remaining, CLIENT_POLL_INTERVAL),
+                        return_when=FIRST_COMPLETED)
+
+                    for fut in done:
+                        res_status = _response_status(fut)
+                        if res_status == HTTPStatus.OK:
+                            tiles[futures[fut]] = Tile(
+                                decompress(fut.result().content),
+                                parent_name)
+                        else:
+                            status = status or res_status
+
+                    if _client_disconnected(self.connection):
+                        metrics.disconnects.inc()
+                        self.close_connection = True
+                        return
+
+                    if status and not renderer.partial:
+                        break
+
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.timings['upstream'] = monotonic() - start
+
+        if not tiles or (status and not renderer.partial):
+            self.send_response(status)
+            self.end_headers()
+            return
 
-            tiles[name] = Tile(res.content, '%s/%s/%s' %
-                               (parent_coord[0], parent_coord[1],
-                                parent_coord[2]))
+        # anything which didn't make it back is rendered as missing.
+        for name in tile_map:
+            tiles.setdefault(name, None)
 
-        im = self.server.renderer.render(tiles)
+        start = monotonic()
+        with profiling.stage('proxy.render'):
+            im = render_image(renderer, tiles, fmt)
+        self.timings['render'] = monotonic() - start
+        metrics.render_seconds.observe(self.timings['render'], (fmt,))
 
-        self.send_response(200)
-        self.send_header('Cache-control', 'max-age=300')
+        start = monotonic()
+        with profiling.stage('proxy.encode'):
+            data = encode_image(renderer, im, fmt)
+        del im
+        self.timings['encode'] = monotonic() - start
+        metrics.encode_seconds.observe(self.timings['encode'], (fmt,))
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', CONTENT_TYPES[fmt])
+        self.send_header('Content-Length', str(len(data)))
+        # don't let the browser cache a partial render for as long, as the
+        # failed sub-tiles may well succeed next time.
+        max_age = 300 if status is None else 10
+        self.send_header('Cache-control', 'max-age=%d' % (max_age,))
         self.end_headers()
 
-        im.save(self.wfile, 'PNG')
-        del im
+        try:
+            self.wfile.write(data)
+            self.response_size = len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
 
     def send_template(self, template_name):
-        from jinja2 import Template
-
-        resource = pkg_resources.resource_string(
-            __name__, 'proxy/' + template_name)
-        template = Template(resource.decode())
-
-        data = template.render(port=self.server.server_port)
+        asset = self.server.assets[template_name]
+
+        gzipped = accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        if gzipped:
+            data, etag = asset.gzipped, asset.gzipped_etag
+        else:
+            data, etag = asset.data, asset.etag
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None and _etag_matches(if_none_match, etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
 
-        self.send_response(200)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
         self.end_headers()
-        self.wfile.write(bytes(data, encoding='utf8'))
-        return
+        self.wfile.write(data)
+        self.response_size = len(data)
 
 
 class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    def __init__(self, server_address, handler_class, url_pattern, renderer):
+    """
+    Serves tiles drawn by renderer from upstream tiles at url_pattern, along
+    with metrics on /metrics. A JSON line is written to the file access_log,
+    if given, for each request.
+    """
+
+    def __init__(self, server_address, handler_class, url_pattern, renderer,
+                 deadline=30, max_fetches=8, store=None, access_log=None):
+        import threading
+
         http.server.HTTPServer.__init__(self, server_address, handler_class)
         self.url_pattern = url_pattern
+        self.tile_url = UrlTemplate(url_pattern)
         self.renderer = renderer
+        self.deadline = deadline
+        self.max_fetches = max_fetches
+        self.store = store
+        self.metrics = ProxyMetrics()
+        self.access_log = access_log
+        self.access_log_lock = threading.Lock()
+
+        # the templates only depend on the port, so they're rendered once up
+        # front rather than on every request.
+        self.assets = load_assets(self.server_port)
+
+
+def serve_http(url, port, renderer, deadline=30, max_fetches=8, store=None,
+               access_log=None):
+    """
+    Serves tiles drawn by renderer from upstream tiles at url. If store is
+    given, tiles which have been pre-rendered into it are served from there
+    instead. Requests are logged as JSON lines to the file access_log, or to
+    stderr if it isn't given.
+    """
 
+    if access_log is None:
+        import sys
+        access_log = sys.stderr
 
-def serve_http(url, port, renderer):
-    httpd = ThreadedHTTPServer(('', port), Handler, url, renderer)
+    httpd = ThreadedHTTPServer(('', port), Handler, url, renderer,
+                               deadline, max_fetches, store, access_log)
     print('Listening on port %d. Point your browser towards '
           'http://localhost:%d/' % (port, port))
     httpd.serve_forever()
@@ -0,0 +1,153 @@
+from scoville.mvt import Tile
+from scoville.percentiles import fetch
+from scoville.proxy import encode_tile
+from scoville.tilelist import _tile_range
+from scoville.tilelist import tiles_in_bbox
+from scoville.tilelist import UrlTemplate
+
+
+def pyramid_batches(renderer, bbox, min_zoom, max_zoom):
+    """
+    Lazily enumerates batches of tile coordinates covering bbox at all zooms
+    from min_zoom to max_zoom inclusive.
+
+    Tiles at or below the renderer's shared_zoom (if it has one) make use of
+    the same upstream tiles, so all the tiles under each shared_zoom ancestor
+    are put into the same batch. Other tiles get a batch of their own.
+    """
+
+    shared_zoom = renderer.shared_zoom
+    if shared_zoom is None:
+        shared_zoom = max_zoom + 1
+
+    for z in range(min_zoom, min(max_zoom, shared_zoom - 1) + 1):
+        for coord in tiles_in_bbox(bbox, z):
+            yield [coord]
+
+    if max_zoom < shared_zoom:
+        return
+
+    top_zoom = max(min_zoom, shared_zoom)
+    for _, ax, ay in tiles_in_bbox(bbox, shared_zoom):
+        batch = []
+        for z in range(top_zoom, max_zoom + 1):
+            dz = z - shared_zoom
+            min_x, min_y, max_x, max_y = _tile_range(bbox, z)
+            for x in range(max(ax << dz, min_x),
+                           min(((ax + 1) << dz) - 1, max_x) + 1):
+                for y in range(max(ay << dz, min_y),
+                               min(((ay + 1) << dz) - 1, max_y) + 1):
+                    batch.append((z, x, y))
+        if batch:
+            yield batch
+
+
+def render_tile(renderer, url_pattern, coord, fmt='png', cache=False,
+                fetched=None):
+    """
+    Fetches the tiles that renderer needs to draw coord and returns the
+    encoded image, or None if any of them couldn't be fetched.
+
+    Unlike the proxy, which draws missing sub-tiles of a heatmap in grey and
+    only lets them be cached briefly, a failed sub-tile fails the whole tile
+    here, as stored tiles are served as if they were complete and aren't
+    rendered again.
+
+    If fetched is given, it should be a dict of URL to tile data, which is
+    used to avoid fetching the same upstream tile more than once.
+    """
+
+    z, x, y = coord
+    name = '%d/%d/%d' % (z, x, y)
+
+    tile_url = UrlTemplate(url_pattern)
+    tiles = {}
+    for key, (sub_z, sub_x, sub_y) in renderer.tiles_for(z, x, y).items():
+        url = tile_url(sub_z, sub_x, sub_y)
+        if fetched is None:
+            data = fetch(url, cache)
+        elif url in fetched:
+            data = fetched[url]
+        else:
+            data = fetched[url] = fetch(url, cache)
+
+        if data is None:
+            return None
+        tiles[key] = Tile(data, name)
+
+    return encode_tile(renderer, tiles, fmt)
+
+
+def render_batch(renderer, url_pattern, batch, fmt='png', cache=False):
+    """
+    Renders each coordinate in batch, fetching each upstream tile only once,
+    and returns a list of (coord, data) pairs.
+    """
+
+    fetched = {}
+    return [(coord, render_tile(renderer, url_pattern, coord, fmt, cache,
+                                fetched))
+            for coord in batch]
+
+
+# per-process state for pool workers, set up once by _init_worker rather than
+# being pickled along with every task.
+_worker_args = None
+
+
+def _init_worker(renderer, url_pattern, fmt, cache):
+    global _worker_args
+    _worker_args = (renderer, url_pattern, fmt, cache)
+
+
+def _render_worker(batch):
+    renderer, url_pattern, fmt, cache = _worker_args
+    return render_batch(renderer, url_pattern, batch, fmt, cache)
+
+
+def render_batches(batches, url_pattern, renderer, store, fmt='png',
+                   cache=False, nprocs=1, chunksize=1):
+    """
+    Renders each batch of (z, x, y) tile coordinates in batches and puts the
+    results into store. Batches are spread over nprocs worker processes, but
+    all writes to the store happen in this process.
+
+    Returns a tuple of the number of tiles rendered and the number which
+    failed.
+    """
+
+    if nprocs > 1:
+        from multiprocessing import Pool
+
+        with Pool(nprocs, _init_worker,
+                  (renderer, url_pattern, fmt, cache)) as pool:
+            results = pool.imap_unordered(
+                _render_worker, batches, chunksize)
+            return _store_results(results, store)
+
+    _init_worker(renderer, url_pattern, fmt, cache)
+    return _store_results(map(_render_worker, batches), store)
+
+
+def render_tiles(coords, url_pattern, renderer, store, fmt='png',
+                 cache=False, nprocs=1):
+    """
+    Renders each (z, x, y) tile coordinate in coords and puts the result into
+    store. See render_batches.
+    """
+
+    batches = ([coord] for coord in coords)
+    return render_batches(batches, url_pattern, renderer, store, fmt, cache,
+                          nprocs, chunksize=8)
+
+
+def _store_results(results, store):
+    num_rendered = num_failed = 0
+    for batch in results:
+        for (z, x, y), data in batch:
+            if data is None:
+                num_failed += 1
+            else:
+                store.put(z, x, y, data)
+                num_rendered += 1
+    return num_rendered, num_failed
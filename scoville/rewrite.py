@@ -0,0 +1,235 @@
+from fnmatch import fnmatchcase
+
+from scoville.mvt import Feature
+from scoville.mvt import Layer
+from scoville.mvt import Tile
+from scoville.mvt import _decode_value
+from scoville.pbf import bytes_field
+from scoville.pbf import Message
+from scoville.pbf import packed_field
+
+
+def _raw_fields(data):
+    """
+    Yields each field of the message in data along with the bytes it was
+    encoded as, including its key, as a memoryview into data.
+    """
+
+    data = memoryview(data)
+    msg = Message(data)
+    while True:
+        start = msg.decoder.pos
+        field = next(msg, None)
+        if field is None:
+            break
+        yield field, data[start:start + field.size]
+
+
+def _matches(name, patterns):
+    return any(fnmatchcase(name, p) for p in patterns)
+
+
+class Rewriter(object):
+    """
+    Re-encodes MVT tiles without some of their data, to find out how much
+    smaller they would be.
+
+    Layers with names matching any of the drop_layers patterns are dropped,
+    as are properties with keys matching any of the drop_keys patterns, for
+    example 'name:*', and features where the kind_key property is a string
+    matching any of the drop_kinds patterns. The patterns are shell-style, as
+    used by fnmatch.
+
+    The keys and values tables of each changed layer are rebuilt with only
+    the entries which are still used, and values with the same encoding are
+    deduplicated. Entries stay in their original order, so that as many
+    features as possible keep the same tags. Layers and features which don't
+    change are copied byte for byte, and geometries are never decoded.
+    """
+
+    def __init__(self, drop_layers=(), drop_keys=(), drop_kinds=(),
+                 kind_key='kind'):
+        self.drop_layers = tuple(drop_layers)
+        self.drop_keys = tuple(drop_keys)
+        self.drop_kinds = tuple(drop_kinds)
+        self.kind_key = kind_key
+
+    def rewrite(self, data):
+        """
+        Returns the bytes of the tile in data after rewriting.
+        """
+
+        out = []
+        for field, raw in _raw_fields(data):
+            if field.tag != Tile.Tags.LAYER:
+                raise ValueError(
+                    'Expecting layer with tag %d, got tag %d instead.'
+                    % (Tile.Tags.LAYER, field.tag))
+
+            layer = Layer(field)
+            if _matches(layer.name, self.drop_layers):
+                continue
+            out.append(self._rewrite_layer(layer, raw))
+
+        return b''.join(out)
+
+    def _dropped_kinds(self, layer):
+        # returns the indices of the values which mark a feature as one of
+        # the dropped kinds.
+        if not self.drop_kinds or self.kind_key not in layer.keys:
+            return set()
+
+        dropped = set()
+        for v, data in enumerate(layer.values):
+            value = _decode_value(data)
+            if isinstance(value, str) and _matches(value, self.drop_kinds):
+                dropped.add(v)
+        return dropped
+
+    def _rewrite_layer(self, layer, raw):
+        keys = layer.keys
+        dropped_keys = set(k for k, name in enumerate(keys)
+                           if _matches(name, self.drop_keys))
+        dropped_kinds = self._dropped_kinds(layer)
+        if not dropped_keys and not dropped_kinds:
+            return raw
+
+        # first, work out which features, keys and values are kept.
+        kind_indices = set(k for k, name in enumerate(keys)
+                           if name == self.kind_key)
+        kept = []
+        used_keys = set()
+        used_values = set()
+        for feature in layer.features:
+            tags = feature.tags
+            pairs = [(tags[i], tags[i + 1]) for i in range(0, len(tags), 2)]
+            if any(k in kind_indices and v in dropped_kinds
+                   for k, v in pairs):
+                kept.append(None)
+                continue
+
+            pairs = [(k, v) for k, v in pairs if k not in dropped_keys]
+            used_keys.update(k for k, _ in pairs)
+            used_values.update(v for _, v in pairs)
+            kept.append(pairs)
+
+        key_map, new_keys = self._table(sorted(used_keys),
+                                        lambda k: keys[k])
+        value_map, new_values = self._table(sorted(used_values),
+                                            lambda v: bytes(layer.values[v]))
+
+        # then copy the layer, swapping in the new features and tables.
+        features = iter(zip(layer.features, kept))
+        out = []
+        wrote_keys = wrote_values = False
+        for field, field_raw in _raw_fields(layer.data):
+            if field.tag == Layer.Tags.FEATURES:
+                feature, pairs = next(features)
+                if pairs is not None:
+                    out.append(self._rewrite_feature(
+                        feature, field_raw, pairs, key_map, value_map))
+
+            elif field.tag == Layer.Tags.KEYS:
+                if not wrote_keys:
+                    out.extend(
+                        bytes_field(Layer.Tags.KEYS, k.encode('utf-8'))
+                        for k in new_keys)
+                    wrote_keys = True
+
+            elif field.tag == Layer.Tags.VALUES:
+                if not wrote_values:
+                    out.extend(bytes_field(Layer.Tags.VALUES, v)
+                               for v in new_values)
+                    wrote_values = True
+
+            else:
+                out.append(field_raw)
+
+        return bytes_field(Tile.Tags.LAYER, b''.join(out))
+
+    @staticmethod
+    def _table(indices, item_fn):
+        # returns a dict of old index to new index, and the list of entries
+        # in the new table, merging entries which are the same.
+        index_map = {}
+        new_indices = {}
+        entries = []
+        for i in indices:
+            item = item_fn(i)
+            new = new_indices.get(item)
+            if new is None:
+                new = new_indices[item] = len(entries)
+                entries.append(item)
+            index_map[i] = new
+        return index_map, entries
+
+    def _rewrite_feature(self, feature, raw, pairs, key_map, value_map):
+        tags = []
+        for k, v in pairs:
+            tags.append(key_map[k])
+            tags.append(value_map[v])
+        if tags == feature.tags:
+            return raw
+
+        out = []
+        for field, field_raw in _raw_fields(feature.data):
+            if field.tag == Feature.Tags.TAGS:
+                if tags:
+                    out.append(packed_field(Feature.Tags.TAGS, tags))
+                    tags = None
+            else:
+                out.append(field_raw)
+        return bytes_field(Layer.Tags.FEATURES, b''.join(out))
+
+
+def rewrite_sizes(data, rewriter, kind=None):
+    """
+    Rewrites the tile in data and returns a dict with the info breakdown of
+    bytes, as from scoville.info.tile_sizes, 'before' and 'after'. Each also
+    has the size of the whole tile as '~total'.
+    """
+
+    from scoville.info import tile_sizes
+
+    rewritten = rewriter.rewrite(data)
+
+    sizes = {}
+    for label, tile_data in (('before', data), ('after', rewritten)):
+        sizes[label] = tile_sizes(Tile(tile_data), kind)
+        sizes[label]['~total'] = len(tile_data)
+    return sizes
+
+
+def _rewrite_worker(args):
+    from scoville.info import FetchError, load_with_session
+
+    source, rewriter, kind = args
+
+    try:
+        data = load_with_session(source)
+        return source, rewrite_sizes(data, rewriter, kind), None
+
+    except (FetchError, OSError, EOFError, ValueError) as e:
+        return source, None, str(e)
+
+
+def rewrite_records(sources, rewriter, kind=None, nprocs=1):
+    """
+    Lazily rewrites each of sources, which can be URLs or file names, using
+    nprocs processes. Yields (source, sizes, error) tuples in the same order
+    as sources, where sizes is from rewrite_sizes and exactly one of sizes
+    and error is None.
+    """
+
+    tasks = ((source, rewriter, kind) for source in sources)
+
+    if nprocs > 1:
+        from multiprocessing import Pool
+
+        with Pool(nprocs) as pool:
+            for record in pool.imap(_rewrite_worker, tasks, chunksize=4):
+                yield record
+
+    else:
+        for task in tasks:
+            yield _rewrite_worker(task)
@@ -0,0 +1,149 @@
+import math
+from collections import defaultdict
+
+
+class StratifiedSampler(object):
+    """
+    Takes a fixed-size random sample from a stream of items, in a single pass
+    and without holding the whole stream in memory.
+
+    Each item belongs to a stratum, such as its zoom level, and the sample is
+    split between the strata in proportion to their share of the stream, so
+    that small strata aren't missed by chance. If weighted is true, then
+    items are sampled with probability in proportion to their weight, and
+    the strata are split in proportion to their total weight.
+
+    Each stratum keeps a reservoir of up to size items, using the weighted
+    reservoir algorithm of Efraimidis and Spirakis, where each item gets a
+    random key of u ** (1 / weight) and the items with the largest keys are
+    kept. Taking the top n of a reservoir is itself a sample of size n, so
+    the reservoirs are trimmed to the right share at the end.
+    """
+
+    def __init__(self, size, weighted=False, seed=None):
+        import random
+
+        self.size = size
+        self.weighted = weighted
+        self.random = random.Random(seed)
+        self.reservoirs = defaultdict(list)
+        self.totals = defaultdict(int)
+        self.counter = 0
+
+    def add(self, stratum, item, weight=1):
+        from heapq import heappush, heapreplace
+
+        if not self.weighted:
+            weight = 1
+        elif weight <= 0:
+            return
+
+        self.totals[stratum] += weight
+
+        # compare logs of the keys, so that very large weights don't round the
+        # key to 1.0. 1 - random() is in (0, 1], so the log is always defined.
+        key = math.log(1.0 - self.random.random()) / weight
+
+        # the counter breaks ties, so that items themselves are never compared.
+        self.counter += 1
+        entry = (key, self.counter, item)
+        reservoir = self.reservoirs[stratum]
+        if len(reservoir) < self.size:
+            heappush(reservoir, entry)
+        elif key > reservoir[0][0]:
+            heapreplace(reservoir, entry)
+
+    def allocation(self):
+        """
+        Returns a dict of stratum to the number of items to sample from it,
+        in proportion to its total and at least 1 from every stratum.
+        """
+
+        total = sum(self.totals.values())
+        return {stratum: min(len(self.reservoirs[stratum]),
+                             max(1, int(round(self.size * t / total))))
+                for stratum, t in self.totals.items()}
+
+    def sample(self):
+        """
+        Returns the sample as a list of (item, weight) pairs, where weight is
+        the share of the stream which each item stands for. These are the
+        weights to use when estimating something about the whole stream from
+        the sample.
+        """
+
+        result = []
+        for stratum, n in sorted(self.allocation().items()):
+            weight = self.totals[stratum] / float(n)
+            entries = sorted(self.reservoirs[stratum], reverse=True)[:n]
+            result.extend((item, weight) for _, _, item in entries)
+        return result
+
+
+def _normal_quantile(confidence):
+    from statistics import NormalDist
+    return NormalDist().inv_cdf(0.5 + confidence / 2.0)
+
+
+def confidence_levels(percentile, n, confidence=0.95):
+    """
+    Returns the (lower, upper) percentiles which bound a confidence interval
+    for the given percentile, estimated from a sample of n items.
+
+    This uses the normal approximation to the binomial distribution of the
+    number of sample items below the true percentile, so it's only a rough
+    guide for very small samples or extreme percentiles.
+    """
+
+    q = percentile / 100.0
+    if n <= 0:
+        return 0.0, 100.0
+
+    delta = _normal_quantile(confidence) * math.sqrt(q * (1.0 - q) / n)
+    # with q at 0 or 1 the interval would be empty, but the sample can't say
+    # that the extreme value isn't further out. widen it by one item.
+    delta = max(delta, 1.0 / n)
+    return max(0.0, q - delta) * 100.0, min(1.0, q + delta) * 100.0
+
+
+def sampled_percentiles(jobs, percentiles, cache, nprocs, record_fn=None,
+                        confidence=0.95):
+    """
+    Fetch the sampled tiles in jobs, a list of (url, weight) pairs as
+    returned by StratifiedSampler.sample, and estimate the percentile sizes
+    in total and per-layer.
+
+    Returns a dict of layer name to a list of (estimate, lower, upper) for
+    each of percentiles, where lower and upper bound the confidence interval.
+    """
+
+    from scoville.percentiles import aggregate_sizes
+    from scoville.percentiles import weighted_percentiles
+
+    for p in percentiles:
+        assert 0 <= p <= 100
+
+    # the width of the confidence interval depends on how many sampled tiles
+    # each layer was found in, which is counted from the records.
+    counts = defaultdict(int)
+
+    def count_fn(record):
+        for name in record.get('sizes') or ():
+            counts[name] += 1
+        if record_fn is not None:
+            record_fn(record)
+
+    results = aggregate_sizes(jobs, cache, nprocs, count_fn, weighted=True)
+
+    pct = {}
+    for label, weights in results.items():
+        levels = []
+        for p in percentiles:
+            lower, upper = confidence_levels(p, counts[label], confidence)
+            levels.extend((p, lower, upper))
+
+        values = weighted_percentiles(weights, levels)
+        pct[label] = [tuple(values[i:i + 3])
+                      for i in range(0, len(values), 3)]
+
+    return pct
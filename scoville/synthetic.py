@@ -0,0 +1,354 @@
+import http.server
+import re
+import socketserver
+from functools import lru_cache
+from http import HTTPStatus
+
+from scoville.mvt import Feature
+from scoville.mvt import GeomType
+from scoville.mvt import Layer
+from scoville.mvt import Tile
+from scoville.mvt import ValueTags
+from scoville.pbf import bytes_field
+from scoville.pbf import field_key
+from scoville.pbf import packed_field
+from scoville.pbf import varint_field
+from scoville.pbf import WireType
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_value(value):
+    """
+    Encodes an MVT Value message for a string, bool, int or float value.
+    """
+
+    if isinstance(value, str):
+        return bytes_field(ValueTags.STRING, value.encode('utf-8'))
+    elif isinstance(value, bool):
+        return varint_field(ValueTags.BOOL, int(value))
+    elif isinstance(value, int):
+        if value < 0:
+            return varint_field(ValueTags.SINT64, _zigzag(value))
+        return varint_field(ValueTags.UINT64, value)
+    elif isinstance(value, float):
+        from struct import pack
+        return field_key(ValueTags.DOUBLE, WireType.bits64) + pack('<d', value)
+    raise ValueError('Can\'t encode value %r of type %s'
+                     % (value, type(value).__name__))
+
+
+def _command(cmd, count):
+    return (count << 3) | cmd
+
+
+def encode_geometry(geom_type, parts):
+    """
+    Returns the list of MVT geometry command integers for parts, which is a
+    list of lists of (x, y) tile coordinates. For points, each part is a
+    single point. For polygons, each part is a ring, which shouldn't repeat
+    its first point at the end.
+    """
+
+    MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+    cmds = []
+    append = cmds.append
+    cx = cy = 0
+    for part in parts:
+        x, y = part[0]
+        append(_command(MOVE_TO, 1))
+        append(_zigzag(x - cx))
+        append(_zigzag(y - cy))
+        cx, cy = x, y
+
+        if geom_type == GeomType.point:
+            continue
+
+        append(_command(LINE_TO, len(part) - 1))
+        for x, y in part[1:]:
+            dx = x - cx
+            dy = y - cy
+            append((dx << 1) ^ (dx >> 63))
+            append((dy << 1) ^ (dy >> 63))
+            cx, cy = x, y
+
+        if geom_type == GeomType.polygon:
+            cmds.append(_command(CLOSE_PATH, 1))
+
+    return cmds
+
+
+class LayerEncoder(object):
+    """
+    Builds up an MVT layer one feature at a time, deduplicating the property
+    keys and values in the same way as real tile encoders.
+    """
+
+    def __init__(self, name, extent=Layer.DEFAULT_EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add_feature(self, properties, geom_type, parts, fid=None):
+        tags = []
+        for k, v in properties.items():
+            tags.append(self._index(self.keys, k))
+            # values of different types which compare equal, like 1 and True,
+            # must not be merged.
+            tags.append(self._index(self.values, (type(v), v)))
+
+        data = b''
+        if fid is not None:
+            data += varint_field(Feature.Tags.ID, fid)
+        if tags:
+            data += packed_field(Feature.Tags.TAGS, tags)
+        data += varint_field(Feature.Tags.GEOM_TYPE, geom_type.value)
+        data += packed_field(Feature.Tags.GEOM_CMDS,
+                             encode_geometry(geom_type, parts))
+        self.features.append(data)
+
+    def encode(self):
+        out = [
+            varint_field(Layer.Tags.VERSION, 2),
+            bytes_field(Layer.Tags.NAME, self.name.encode('utf-8')),
+        ]
+        out.extend(bytes_field(Layer.Tags.FEATURES, f)
+                   for f in self.features)
+        out.extend(bytes_field(Layer.Tags.KEYS, k.encode('utf-8'))
+                   for k in self.keys)
+        out.extend(bytes_field(Layer.Tags.VALUES, encode_value(v))
+                   for _, v in self.values)
+        out.append(varint_field(Layer.Tags.EXTENT, self.extent))
+        return b''.join(out)
+
+
+def encode_tile(layers):
+    """
+    Returns the bytes of an MVT tile made of the given LayerEncoders.
+    """
+
+    return b''.join(bytes_field(Tile.Tags.LAYER, layer.encode())
+                    for layer in layers)
+
+
+@lru_cache(maxsize=64)
+def _unit_circle(num_vertices):
+    import math
+
+    return [(math.cos(2 * math.pi * i / num_vertices),
+             math.sin(2 * math.pi * i / num_vertices))
+            for i in range(num_vertices)]
+
+
+def _polygon_ring(rng, extent, num_vertices):
+    """
+    Returns a ring of num_vertices points in a rough circle inside the tile,
+    with some noise to make it look less regular.
+    """
+
+    cx = rng.randrange(extent // 4, 3 * extent // 4)
+    cy = rng.randrange(extent // 4, 3 * extent // 4)
+    radius = rng.randrange(extent // 16, extent // 4)
+    random = rng.random
+
+    ring = []
+    for cos, sin in _unit_circle(num_vertices):
+        r = radius * (0.8 + 0.2 * random())
+        ring.append((int(cx + r * cos), int(cy + r * sin)))
+    return ring
+
+
+def _linestring(rng, extent, num_vertices):
+    x = rng.randrange(extent)
+    y = rng.randrange(extent)
+    line = [(x, y)]
+    for _ in range(num_vertices - 1):
+        x = min(max(x + rng.randrange(-64, 65), 0), extent)
+        y = min(max(y + rng.randrange(-64, 65), 0), extent)
+        line.append((x, y))
+    return line
+
+
+def synthetic_tile(num_layers=4, num_features=100, num_properties=4,
+                   cardinality=10, vertices=8, geom_type=GeomType.polygon,
+                   seed=0):
+    """
+    Returns the bytes of a valid MVT tile of made-up features, for tests and
+    benchmarks. The same arguments always give the same tile.
+
+    Each of the num_layers layers has num_features features, each of which has
+    a 'kind' and num_properties other properties. Each property has up to
+    cardinality distinct values across the layer, so a low cardinality means
+    lots of deduplication. Each feature's geometry has vertices points per
+    line or polygon ring.
+    """
+
+    import random
+
+    rng = random.Random(seed)
+    extent = Layer.DEFAULT_EXTENT
+
+    layers = []
+    for layer_num in range(num_layers):
+        layer = LayerEncoder('layer%d' % (layer_num,), extent)
+        for fid in range(num_features):
+            properties = {'kind': 'kind%d' % (rng.randrange(cardinality),)}
+            for p in range(num_properties):
+                properties['prop%d' % (p,)] = \
+                    'value%d' % (rng.randrange(cardinality),)
+
+            if geom_type == GeomType.point:
+                parts = [[(rng.randrange(extent), rng.randrange(extent))]]
+            elif geom_type == GeomType.linestring:
+                parts = [_linestring(rng, extent, vertices)]
+            else:
+                parts = [_polygon_ring(rng, extent, vertices)]
+
+            layer.add_feature(properties, geom_type, parts, fid)
+        layers.append(layer)
+
+    return encode_tile(layers)
+
+
+class SyntheticTiles(object):
+    """
+    A made-up tile set, where each tile is generated on demand by
+    synthetic_tile. The same coordinate always gives the same tile, but
+    neighbouring tiles differ, and the number of features in each tile varies
+    from half to one and a half times num_features, so that there's a spread
+    of sizes to measure.
+
+    The most recently generated tiles are kept, up to cache_size of them, as
+    very large tiles can take a while to generate.
+    """
+
+    def __init__(self, num_layers=4, num_features=100, num_properties=4,
+                 cardinality=10, vertices=8, geom_type=GeomType.polygon,
+                 seed=0, cache_size=256):
+        self.num_layers = num_layers
+        self.num_features = num_features
+        self.num_properties = num_properties
+        self.cardinality = cardinality
+        self.vertices = vertices
+        self.geom_type = geom_type
+        self.seed = seed
+        self.tile = lru_cache(maxsize=cache_size)(self._tile)
+
+    def _tile(self, z, x, y):
+        import random
+
+        # seeding from a string hashes it with sha512, so it's stable across
+        # processes and runs, unlike hash().
+        tile_seed = '%d/%d/%d/%d' % (self.seed, z, x, y)
+        rng = random.Random(tile_seed)
+        num_features = rng.randint(
+            self.num_features // 2, max(1, self.num_features * 3 // 2))
+
+        return synthetic_tile(
+            self.num_layers, num_features, self.num_properties,
+            self.cardinality, self.vertices, self.geom_type, tile_seed)
+
+
+TILE_PATTERN = re.compile('^/([0-9]+)/([0-9]+)/([0-9]+)(\\.mvt|\\.pbf)?$')
+
+
+class SyntheticHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        m = TILE_PATTERN.match(self.path)
+        if m:
+            z, x, y = list(map(int, m.groups()[0:3]))
+            if 0 <= z <= 30 and 0 <= x < (1 << z) and 0 <= y < (1 << z):
+                self.send_tile(z, x, y)
+                return
+
+        self.send_response(HTTPStatus.NOT_FOUND)
+        self.end_headers()
+
+    def send_tile(self, z, x, y):
+        from time import sleep
+
+        server = self.server
+        delay, fail = server.next_request()
+        if delay > 0:
+            sleep(delay)
+
+        if fail:
+            self.send_response(HTTPStatus.INTERNAL_SERVER_ERROR)
+            self.end_headers()
+            return
+
+        data = server.tiles.tile(z, x, y)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/vnd.mapbox-vector-tile')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # a load test makes far too many requests for a line per request to
+        # be useful.
+        pass
+
+
+class SyntheticTileServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Serves SyntheticTiles under /{z}/{x}/{y}, optionally with a .mvt or .pbf
+    extension, as a stand-in for a real tile server in load tests.
+
+    Each response is delayed by latency seconds, plus or minus up to jitter
+    seconds, and fails with a 500 with probability error_rate.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, tiles, latency=0.0, jitter=0.0,
+                 error_rate=0.0, seed=None):
+        import random
+        import threading
+
+        http.server.HTTPServer.__init__(
+            self, server_address, SyntheticHandler)
+        self.tiles = tiles
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def next_request(self):
+        """
+        Returns the (delay, fail) for the next request.
+        """
+
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+            fail = self.random.random() < self.error_rate
+        return max(0.0, self.latency + jitter), fail
+
+
+def serve_synthetic(port, tiles, latency=0.0, jitter=0.0, error_rate=0.0,
+                    seed=None):
+    """
+    Serves synthetic tiles on port until interrupted.
+    """
+
+    httpd = SyntheticTileServer(('', port), tiles, latency, jitter,
+                                error_rate, seed)
+    print('Serving synthetic tiles at http://localhost:%d/{z}/{x}/{y}.mvt'
+          % (httpd.server_port,))
+    httpd.serve_forever()
@@ -0,0 +1,243 @@
+import math
+import re
+
+# leading bytes of the compressed formats we can read, and the module which
+# can open each of them.
+_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'lzma'),
+)
+
+# prefix of a "file name" which is actually a bounding box and zoom range to
+# generate tiles for, rather than a file to read them from.
+BBOX_PREFIX = 'bbox:'
+
+_QUADKEY = re.compile(r'^[0-3]+$')
+
+
+class BadLine(ValueError):
+    pass
+
+
+def open_text(file_name):
+    """
+    Opens file_name for reading as text, decompressing it if it's gzip, bzip2
+    or xz compressed. The compression is detected from the contents rather
+    than the name. A file name of '-' reads from stdin.
+    """
+
+    import io
+
+    if file_name == '-':
+        import sys
+        fh = sys.stdin.buffer
+    else:
+        fh = open(file_name, 'rb')
+
+    if not hasattr(fh, 'peek'):
+        fh = io.BufferedReader(fh)
+
+    head = fh.peek(6)
+    for magic, module_name in _MAGIC:
+        if head.startswith(magic):
+            from importlib import import_module
+            module = import_module(module_name)
+            fh = module.open(fh, 'rb')
+            break
+
+    return io.TextIOWrapper(fh, encoding='utf-8')
+
+
+def quadkey_to_tile(quadkey):
+    """
+    Returns the (z, x, y) of the tile with the given quadkey.
+    """
+
+    x = y = 0
+    for digit in quadkey:
+        d = ord(digit) - 48
+        x = (x << 1) | (d & 1)
+        y = (y << 1) | (d >> 1)
+    return len(quadkey), x, y
+
+
+def parse_line(line):
+    """
+    Parses a line from a tile list, returning (z, x, y, count), or None if the
+    line is blank or a comment starting with '#'. Raises BadLine if the line
+    can't be parsed or the coordinate is out of range.
+
+    Lines can be:
+
+      * 'z/x/y', optionally followed by a space and anything else,
+      * 'z|x|y|count', as in the tile request logs, or
+      * a quadkey, such as '0231'.
+
+    Count is 1 unless given.
+    """
+
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    try:
+        if '/' in line:
+            z, x, y = line.split(None, 1)[0].split('/')
+            z, x, y, count = int(z), int(x), int(y), 1
+
+        elif '|' in line:
+            z, x, y, count = line.split('|')
+            z, x, y, count = int(z), int(x), int(y), int(count)
+
+        elif _QUADKEY.match(line):
+            z, x, y = quadkey_to_tile(line)
+            count = 1
+
+        else:
+            raise BadLine('Unrecognised tile format')
+
+    except ValueError as e:
+        if isinstance(e, BadLine):
+            raise
+        raise BadLine('Unable to parse tile: %s' % (e,))
+
+    if z < 0 or not (0 <= x < (1 << z)) or not (0 <= y < (1 << z)):
+        raise BadLine('Tile %d/%d/%d is out of range' % (z, x, y))
+
+    return z, x, y, count
+
+
+def parse_bbox_spec(spec):
+    """
+    Parses a spec of the form 'bbox:west,south,east,north:min_zoom-max_zoom',
+    returning ((west, south, east, north), min_zoom, max_zoom). The zoom
+    range can also be a single zoom.
+    """
+
+    try:
+        _, bbox, zooms = spec.split(':')
+        west, south, east, north = map(float, bbox.split(','))
+        min_zoom, _, max_zoom = zooms.partition('-')
+        min_zoom = int(min_zoom)
+        max_zoom = int(max_zoom) if max_zoom else min_zoom
+
+    except ValueError:
+        raise ValueError('Expected a bounding box of the form "%sW,S,E,N:'
+                         'MINZ-MAXZ", not %r.' % (BBOX_PREFIX, spec))
+
+    if west > east or south > north or min_zoom > max_zoom:
+        raise ValueError('Bounding box or zoom range %r is empty.' % (spec,))
+
+    return (west, south, east, north), min_zoom, max_zoom
+
+
+# web mercator can't represent the poles, so latitudes are clamped to this.
+MAX_LATITUDE = 85.0511287798
+
+
+def lonlat_to_tile(lon, lat, z):
+    """
+    Returns the (x, y) of the tile at zoom z which contains lon, lat.
+    """
+
+    n = 1 << z
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    lat_rad = math.radians(lat)
+
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_range(bbox, z):
+    """
+    Returns the (min_x, min_y, max_x, max_y) inclusive range of tiles at zoom
+    z which cover bbox, given as (west, south, east, north).
+    """
+
+    west, south, east, north = bbox
+    min_x, min_y = lonlat_to_tile(west, north, z)
+    max_x, max_y = lonlat_to_tile(east, south, z)
+    return min_x, min_y, max_x, max_y
+
+
+def tiles_in_bbox(bbox, z):
+    """
+    Lazily enumerates the (z, x, y) coordinates of tiles at zoom z which cover
+    bbox, given as (west, south, east, north) in degrees.
+    """
+
+    min_x, min_y, max_x, max_y = _tile_range(bbox, z)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield z, x, y
+
+
+def bbox_tiles(bbox, min_zoom, max_zoom):
+    """
+    Lazily enumerates (z, x, y, 1) for the tiles covering bbox, given as
+    (west, south, east, north), at each zoom from min_zoom to max_zoom
+    inclusive.
+    """
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        for z, x, y in tiles_in_bbox(bbox, zoom):
+            yield z, x, y, 1
+
+
+def read_tile_list(file_name, error_fn=None):
+    """
+    Lazily reads (z, x, y, count) tuples from the tile list in file_name. See
+    open_text and parse_line for the formats which can be read.
+
+    If file_name starts with 'bbox:', then it's parsed with parse_bbox_spec
+    and the tiles are generated rather than read from a file.
+
+    Bad lines are skipped. If error_fn is given, it's called with the line
+    number, the line and the BadLine exception for each of them.
+    """
+
+    if file_name.startswith(BBOX_PREFIX):
+        for tile in bbox_tiles(*parse_bbox_spec(file_name)):
+            yield tile
+        return
+
+    with open_text(file_name) as fh:
+        for line_number, line in enumerate(fh, 1):
+            try:
+                tile = parse_line(line)
+            except BadLine as e:
+                if error_fn is not None:
+                    error_fn(line_number, line, e)
+                continue
+
+            if tile is not None:
+                yield tile
+
+
+class UrlTemplate(object):
+    """
+    A URL pattern with {z}, {x} and {y} replacements, compiled once into a
+    format string so that generating each URL is a single call.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+        # splitting on a group returns the literal text at even indices and
+        # the replacements at odd ones. any other braces in the literal text
+        # need escaping from format.
+        fields = {'{z}': '{0}', '{x}': '{1}', '{y}': '{2}'}
+        parts = []
+        for i, part in enumerate(re.split(r'(\{[zxy]\})', pattern)):
+            if i % 2:
+                parts.append(fields[part])
+            else:
+                parts.append(part.replace('{', '{{').replace('}', '}}'))
+
+        self.format = ''.join(parts).format
+
+    def __call__(self, z, x, y):
+        return self.format(z, x, y)
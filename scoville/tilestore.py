@@ -0,0 +1,201 @@
+import os
+
+
+class DirectoryStore(object):
+    """
+    Stores tiles as files in a z/x/y.ext directory hierarchy, which any static
+    file server can serve.
+    """
+
+    def __init__(self, path, ext='png'):
+        self.path = path
+        self.ext = ext
+
+    def _file_name(self, z, x, y):
+        return os.path.join(self.path, str(z), str(x), '%d.%s' % (y, self.ext))
+
+    def put(self, z, x, y, data):
+        file_name = self._file_name(z, x, y)
+        dir_name = os.path.dirname(file_name)
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+
+        # write to a temporary file and rename, so that a reader never sees a
+        # half-written tile.
+        tmp_name = '%s.%d.tmp' % (file_name, os.getpid())
+        with open(tmp_name, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_name, file_name)
+
+    def get(self, z, x, y):
+        try:
+            with open(self._file_name(z, x, y), 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        pass
+
+
+class MBTilesStore(object):
+    """
+    Stores tiles in an MBTiles-style SQLite database. Note that MBTiles uses
+    TMS row numbering, so y is flipped on the way in and out.
+
+    Writes are batched into transactions of commit_every tiles, so only one
+    process should write to the store at a time. Within a process, the store
+    can be shared between threads.
+    """
+
+    def __init__(self, path, ext='png', commit_every=1000):
+        import sqlite3
+        from threading import Lock
+
+        self.ext = ext
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, '
+            'tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        self.conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS tile_index '
+            'ON tiles (zoom_level, tile_column, tile_row)')
+        self.conn.execute('DELETE FROM metadata WHERE name = ?', ('format',))
+        self.conn.execute(
+            'INSERT INTO metadata (name, value) VALUES (?, ?)', ('format', ext))
+        self.conn.commit()
+
+    def put(self, z, x, y, data):
+        import sqlite3
+
+        tms_y = (1 << z) - 1 - y
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO tiles (zoom_level, tile_column, '
+                'tile_row, tile_data) VALUES (?, ?, ?, ?)',
+                (z, x, tms_y, sqlite3.Binary(data)))
+
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.conn.commit()
+                self.uncommitted = 0
+
+    def get(self, z, x, y):
+        tms_y = (1 << z) - 1 - y
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+                'tile_column = ? AND tile_row = ?', (z, x, tms_y)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class MBTilesReader(object):
+    """
+    Reads tiles from an MBTiles-style SQLite database without changing it,
+    for serving tiles rendered ahead of time by an MBTilesStore. The format
+    recorded in the database's metadata, if any, overrides ext.
+    """
+
+    def __init__(self, path, ext='png'):
+        import sqlite3
+        from threading import Lock
+
+        self.lock = Lock()
+        self.conn = sqlite3.connect(
+            _readonly_uri(path), uri=True, check_same_thread=False)
+
+        row = self.conn.execute(
+            'SELECT value FROM metadata WHERE name = ?',
+            ('format',)).fetchone()
+        self.ext = ext if row is None else row[0]
+
+    def get(self, z, x, y):
+        tms_y = (1 << z) - 1 - y
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+                'tile_column = ? AND tile_row = ?', (z, x, tms_y)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _readonly_uri(path):
+    # opening read-only means that a mistyped path is an error rather than a
+    # new, empty database.
+    from urllib.request import pathname2url
+
+    return 'file:%s?mode=ro' % (pathname2url(os.path.abspath(path)),)
+
+
+def is_mbtiles(path):
+    return path.endswith('.mbtiles')
+
+
+def read_mbtiles(path, batch_size=1000):
+    """
+    Yields (z, x, y, data) for each tile in the MBTiles file at path, in the
+    order they're stored in the file, reading batch_size rows at a time. The
+    tile rows are flipped from TMS numbering, and gzipped tile data, as
+    vector MBTiles usually have, is decompressed.
+    """
+
+    import sqlite3
+    from scoville.compression import decompress
+
+    conn = sqlite3.connect(_readonly_uri(path), uri=True)
+    try:
+        # without an ORDER BY, SQLite scans the table in rowid order, which
+        # is the order the pages are in the file.
+        cursor = conn.execute(
+            'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for z, x, tms_y, data in rows:
+                yield z, x, (1 << z) - 1 - tms_y, decompress(bytes(data))
+    finally:
+        conn.close()
+
+
+def open_store(path, ext='png'):
+    """
+    Opens a tile store at path. Paths ending in .mbtiles are opened as MBTiles
+    databases, anything else is treated as a directory.
+    """
+
+    if is_mbtiles(path):
+        return MBTilesStore(path, ext)
+    return DirectoryStore(path, ext)
+
+
+def open_reader(path, ext='png'):
+    """
+    Opens the tile store at path for reading only, as with open_store. Raises
+    FileNotFoundError if there's nothing at path, and sqlite3.Error if an
+    .mbtiles path isn't a database of tiles.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError('No tile store at %r' % (path,))
+    if is_mbtiles(path):
+        return MBTilesReader(path, ext)
+    return DirectoryStore(path, ext)
@@ -31,12 +31,17 @@ setup(
     zip_safe=False,
     install_requires=[
         'click',
+        'Jinja2',
         'requests',
         'requests_futures',
         'squarify',
         'msgpack',
         'Pillow'
     ],
+    extras_require=dict(
+        parquet=['pyarrow'],
+        brotli=['brotli'],
+    ),
     entry_points=dict(
         console_scripts=[
             'scoville = scoville.command:scoville_main',
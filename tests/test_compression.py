@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+
+class TestDecompress(TestCase):
+
+    def test_decompress(self):
+        import gzip
+        from scoville.compression import decompress
+
+        data = b'\x1a\x03foo' * 100
+        self.assertEqual(decompress(gzip.compress(data)), data)
+        self.assertIs(decompress(data), data)
+
+    def test_decompress_chunks(self):
+        import gzip
+        from scoville.compression import decompress_chunks
+
+        data = b'\x1a\x03foo' * 100
+        compressed = gzip.compress(data)
+        # the gzip header is split over the first two chunks.
+        chunks = [compressed[:1], compressed[1:10], compressed[10:]]
+        self.assertEqual(decompress_chunks(chunks), data)
+        self.assertEqual(decompress_chunks([data[:1], data[1:]]), data)
+        self.assertEqual(decompress_chunks([]), b'')
+
+
+class TestCompressor(TestCase):
+
+    def test_gzip_size(self):
+        import gzip
+        from scoville.compression import Compressor
+
+        data = b'water ' * 1000
+        compressor = Compressor('gzip', 9)
+        self.assertEqual(compressor.size(data), len(gzip.compress(data, 9)))
+        self.assertEqual(compressor.size(memoryview(data)),
+                         compressor.size(data))
+
+    def test_sizes(self):
+        from scoville.compression import Compressor
+        from scoville.mvt import Tile
+        from scoville.synthetic import synthetic_tile
+
+        data = synthetic_tile(num_layers=2, num_features=50)
+        sizes = Compressor().sizes(data, list(Tile(data)))
+
+        self.assertEqual(sorted(sizes), ['layer0', 'layer1', '~total'])
+        for name, size in sizes.items():
+            self.assertLess(size, len(data))
+        # the layers compress slightly worse on their own than together.
+        self.assertGreaterEqual(sizes['layer0'] + sizes['layer1'],
+                                sizes['~total'] - 20)
+
+    def test_unknown_method(self):
+        from scoville.compression import Compressor
+
+        with self.assertRaises(ValueError):
+            Compressor('zip')
+
+    def test_split_compressed(self):
+        from scoville.compression import compressed_name
+        from scoville.compression import split_compressed
+
+        result = {'water': 1, compressed_name('water', 'gzip'): 2}
+        self.assertEqual(split_compressed(result, 'gzip'),
+                         ({'water': 1}, {'water': 2}))
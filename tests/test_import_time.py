@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+# generous limit on the cumulative time to import the command line module, in
+# microseconds. it's well under this on a laptop, so going over means that
+# something heavy has been imported at module level. override with the
+# SCOVILLE_IMPORT_TIME_LIMIT environment variable on slow machines.
+IMPORT_TIME_LIMIT = 250000
+
+# modules which are slow to import and should only be imported by the
+# commands which need them.
+HEAVY_MODULES = (
+    'PIL',
+    'jinja2',
+    'msgpack',
+    'pkg_resources',
+    'requests',
+    'requests_futures',
+    'squarify',
+)
+
+
+def _import_times(module):
+    """
+    Imports module in a fresh interpreter with -X importtime, and returns a
+    dict of the cumulative import time, in microseconds, of every module it
+    imported.
+    """
+
+    import subprocess
+    import sys
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True)
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative = cumulative.strip()
+        if cumulative.isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime(TestCase):
+
+    def test_command_import_time(self):
+        from os import environ
+
+        limit = int(environ.get(
+            'SCOVILLE_IMPORT_TIME_LIMIT', IMPORT_TIME_LIMIT))
+        times = _import_times('scoville.command')
+
+        self.assertIn('scoville.command', times)
+        self.assertLess(times['scoville.command'], limit)
+
+    def test_no_heavy_imports(self):
+        for module in ('scoville.command', 'scoville.proxy'):
+            times = _import_times(module)
+            for heavy in HEAVY_MODULES:
+                self.assertNotIn(heavy, times, '%r imported by %r'
+                                 % (heavy, module))
@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+# a tile with a single 'water' layer containing one feature with properties
+# foo=bar and baz=foo.
+_WATER_TILE = (
+    b'\x1a\x3a\x0a\x05\x77\x61\x74\x65\x72\x12\x14\x12\x04'
+    b'\x00\x00\x01\x01\x18\x02\x22\x0a\x09\x8d\x01\xac\x3f'
+    b'\x12\x00\x01\x00\x02\x1a\x03\x66\x6f\x6f\x1a\x03\x62'
+    b'\x61\x7a\x22\x05\x0a\x03\x62\x61\x72\x22\x05\x0a\x03'
+    b'\x66\x6f\x6f\x28\x80\x20\x78\x01')
+
+
+class TestInfo(TestCase):
+
+    def test_tile_sizes(self):
+        from scoville.info import tile_sizes
+        from scoville.mvt import Tile
+
+        sizes = tile_sizes(Tile(_WATER_TILE))
+
+        self.assertEqual(sizes, {
+            'water': {
+                'properties': {
+                    'size': 24,
+                    'keys': {'count': 2},
+                    'values': {'count': 2},
+                },
+                'metadata': 14,
+                'features': 22,
+            },
+        })
+
+    def test_tile_sizes_kind(self):
+        from scoville.info import tile_sizes
+        from scoville.mvt import Tile
+
+        sizes = tile_sizes(Tile(_WATER_TILE), 'foo')
+
+        self.assertEqual(list(sizes['water']['features'].keys()), ['bar'])
+        self.assertEqual(sizes['water']['features']['bar']['count'], 1)
+
+    def test_merge_sizes(self):
+        from scoville.info import merge_sizes
+
+        total = {}
+        merge_sizes(total, {'a': {'b': 1, 'c': 2}, 'd': 3})
+        merge_sizes(total, {'a': {'b': 10}, 'e': {'f': 4}})
+
+        self.assertEqual(total, {'a': {'b': 11, 'c': 2}, 'd': 3,
+                                 'e': {'f': 4}})
+
+    def test_info_records(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.info import info_records
+
+        with TemporaryDirectory() as tmp:
+            sources = []
+            for i in range(0, 5):
+                file_name = join(tmp, '%d.mvt' % (i,))
+                with open(file_name, 'wb') as fh:
+                    fh.write(_WATER_TILE)
+                sources.append(file_name)
+            sources.append(join(tmp, 'missing.mvt'))
+
+            for nprocs in (1, 2):
+                records = list(info_records(iter(sources), None, nprocs))
+
+                self.assertEqual([r[0] for r in records], sources)
+                for source, sizes, error in records[:-1]:
+                    self.assertIsNone(error)
+                    self.assertEqual(sizes['water']['features'], 22)
+                self.assertIsNone(records[-1][1])
+                self.assertIsNotNone(records[-1][2])
+
+    def test_load_gzipped(self):
+        import gzip
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.info import load_tile_data
+
+        with TemporaryDirectory() as tmp:
+            file_name = join(tmp, '0.mvt')
+            with open(file_name, 'wb') as fh:
+                fh.write(gzip.compress(_WATER_TILE))
+
+            self.assertEqual(load_tile_data(file_name), _WATER_TILE)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+
+class TestRegistry(TestCase):
+
+    def test_counter(self):
+        from scoville.metrics import Registry
+
+        r = Registry()
+        c = r.counter('requests_total', 'Requests.', ('route', 'status'))
+        c.inc(('tile', '200'))
+        c.inc(('tile', '200'))
+        c.inc(('other', '404'))
+
+        self.assertEqual(r.render().splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{route="other",status="404"} 1',
+            'requests_total{route="tile",status="200"} 2',
+        ])
+
+    def test_gauge_fn(self):
+        from scoville.metrics import Registry
+
+        r = Registry()
+        values = [3]
+        r.gauge('threads', 'Threads.', fn=lambda: values[0])
+        self.assertIn('threads 3', r.render().splitlines())
+        values[0] = 5
+        self.assertIn('threads 5', r.render().splitlines())
+
+    def test_histogram(self):
+        from scoville.metrics import Registry
+
+        r = Registry()
+        h = r.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            h.observe(value)
+
+        self.assertEqual(r.render().splitlines()[2:], [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_count 4',
+            'latency_seconds_sum 2.65',
+        ])
+
+    def test_escape(self):
+        from scoville.metrics import Registry
+
+        r = Registry()
+        r.counter('paths_total', 'Paths.', ('path',)).inc(('a"b\\c',))
+        self.assertIn('paths_total{path="a\\"b\\\\c"} 1', r.render())
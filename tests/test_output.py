@@ -0,0 +1,96 @@
+from unittest import TestCase
+from unittest import skipIf
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestOutput(TestCase):
+
+    def test_flatten(self):
+        from scoville.output import _flatten
+
+        self.assertEqual(
+            _flatten({'water': {'features': 1, 'properties': {'size': 2}}}),
+            {'water.features': 1, 'water.properties.size': 2})
+
+    def test_json_lines(self):
+        from io import StringIO
+        from json import loads
+        from scoville.output import JSONLinesWriter
+
+        fh = StringIO()
+        writer = JSONLinesWriter(fh)
+        writer.write(dict(tile='a', sizes={'~total': 1}))
+        writer.write(dict(tile='b', error='Failed'))
+        writer.close()
+
+        lines = fh.getvalue().splitlines()
+        self.assertEqual([loads(line) for line in lines], [
+            dict(tile='a', sizes={'~total': 1}),
+            dict(tile='b', error='Failed'),
+        ])
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from pyarrow.parquet import read_table
+        from scoville.output import open_writer
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'records.parquet')
+            writer = open_writer(path)
+            writer.batch_size = 2
+            for i in range(0, 5):
+                writer.write(dict(tile=str(i), sizes={'water': {'size': i}}))
+            writer.write(dict(tile='x', error='Failed'))
+            writer.write(dict(tile='y', sizes={'~total': 10},
+                              compressed={'~total': 4}, weight=3))
+            writer.close()
+
+            rows = read_table(path).to_pylist()
+
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[3]['tile'], '3')
+        self.assertEqual(rows[3]['sizes'], [('water.size', 3)])
+        self.assertIsNone(rows[3]['compressed'])
+        self.assertIsNone(rows[3]['weight'])
+        self.assertEqual(rows[5]['error'], 'Failed')
+        self.assertEqual(rows[6]['compressed'], [('~total', 4)])
+        self.assertEqual(rows[6]['weight'], 3)
+
+    def test_csv_rows(self):
+        from io import StringIO
+        from scoville.output import CSVWriter
+
+        fh = StringIO()
+        writer = CSVWriter(fh, [('z', 'int'), ('layer', 'string')])
+        writer.write(dict(z=1, layer='water'))
+        writer.close()
+
+        self.assertEqual(fh.getvalue().splitlines(), ['z,layer', '1,water'])
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_rows(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from pyarrow.parquet import read_table
+        from scoville.output import open_writer
+        from scoville.percentiles import LayerExporter
+
+        row = dict(z=16, x=10482, y=25330, layer='buildings', size=1000,
+                   features_size=800, properties_size=150, num_features=10,
+                   num_keys=5, num_values=20)
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'rows.parquet')
+            writer = open_writer(path, LayerExporter.FIELDS)
+            writer.write(row)
+            writer.close()
+
+            rows = read_table(path).to_pylist()
+
+        self.assertEqual(rows, [row])
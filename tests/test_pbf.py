@@ -67,6 +67,22 @@ class PBFTest(unittest.TestCase):
         expect(2147483647, 4294967294)
         expect(-2147483648, 4294967295)
 
+    def test_encode_fields(self):
+        from scoville.pbf import bytes_field, Message, packed_field
+        from scoville.pbf import varint_field, WireType
+
+        data = varint_field(1, 150) + bytes_field(2, b'testing') + \
+            packed_field(4, [3, 270, 86942])
+        self.assertEqual(data, b'\x08\x96\x01' +
+                         b'\x12\x07\x74\x65\x73\x74\x69\x6e\x67' +
+                         b'\x22\x06\x03\x8e\x02\x9e\xa7\x05')
+
+        fields = list(Message(data))
+        self.assertEqual([f.tag for f in fields], [1, 2, 4])
+        self.assertEqual(
+            [f.as_uint32() for f in fields[2].as_packed(WireType.varint)],
+            [3, 270, 86942])
+
     def test_twoscomplement(self):
         from scoville.pbf import _twoscomplement
 
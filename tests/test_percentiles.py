@@ -0,0 +1,531 @@
+from unittest import TestCase
+
+# a tile with a single 'water' layer containing one feature with properties
+# foo=bar and baz=foo.
+_WATER_TILE = (
+    b'\x1a\x3a\x0a\x05\x77\x61\x74\x65\x72\x12\x14\x12\x04'
+    b'\x00\x00\x01\x01\x18\x02\x22\x0a\x09\x8d\x01\xac\x3f'
+    b'\x12\x00\x01\x00\x02\x1a\x03\x66\x6f\x6f\x1a\x03\x62'
+    b'\x61\x7a\x22\x05\x0a\x03\x62\x61\x72\x22\x05\x0a\x03'
+    b'\x66\x6f\x6f\x28\x80\x20\x78\x01')
+
+
+class _LengthAggregator(object):
+    """
+    Stands in for Aggregator, using the length of each "URL" as its size so
+    that no fetching is needed.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.results = {'~total': []}
+
+    def add(self, tile_url):
+        self.results['~total'].append(len(tile_url))
+        return dict(tile=tile_url, sizes={'~total': len(tile_url)})
+
+    def encode(self):
+        from msgpack import packb
+        return packb(self.results)
+
+    def merge_decode(self, data):
+        from msgpack import unpackb
+        for k, v in unpackb(data).items():
+            self.results[k].extend(v)
+
+
+class _CrashingAggregator(_LengthAggregator):
+    # exits the worker process part way through, as if it had been killed.
+
+    def add(self, tile_url):
+        import os
+
+        if len(tile_url) == 50:
+            os._exit(3)
+        return _LengthAggregator.add(self, tile_url)
+
+
+class _RecordError(Exception):
+    pass
+
+
+def _fail_record(record):
+    raise _RecordError(record['tile'])
+
+
+class TestParallel(TestCase):
+
+    def test_parallel_records(self):
+        from scoville.percentiles import FactoryFunctionHolder, parallel
+
+        urls = ['x' * i for i in range(1, 501)]
+        records = []
+
+        results = parallel(iter(urls), FactoryFunctionHolder(
+            _LengthAggregator), 3, records.append)
+
+        self.assertEqual(sorted(results['~total']), list(range(1, 501)))
+        self.assertEqual(sorted(r['tile'] for r in records), sorted(urls))
+
+    def test_parallel_record_error(self):
+        from scoville.percentiles import FactoryFunctionHolder, parallel
+
+        urls = ['x' * i for i in range(1, 501)]
+
+        with self.assertRaises(_RecordError):
+            parallel(iter(urls), FactoryFunctionHolder(_LengthAggregator), 3,
+                     _fail_record)
+
+    def test_parallel_worker_crash(self):
+        from scoville.percentiles import FactoryFunctionHolder, parallel
+        from scoville.percentiles import WorkerError
+
+        urls = ['x' * i for i in range(1, 501)]
+
+        with self.assertRaises(WorkerError):
+            parallel(iter(urls), FactoryFunctionHolder(_CrashingAggregator),
+                     3)
+
+    def test_parallel_profile(self):
+        from scoville import profiling
+        from scoville.percentiles import FactoryFunctionHolder, parallel
+
+        profiler = profiling.Profiler()
+        profiling.enable(profiler)
+        try:
+            parallel(['x' * i for i in range(1, 101)], FactoryFunctionHolder(
+                _LengthAggregator), 3)
+        finally:
+            profiling.disable()
+
+        # every job is added in one of the workers, which send their timings
+        # back to be merged with ours.
+        self.assertEqual(profiler.histograms['add'].count, 100)
+        self.assertEqual(profiler.histograms['queue.put'].count, 100)
+        self.assertEqual(profiler.histograms['encode'].count, 3)
+
+    def test_sequential_records(self):
+        from scoville.percentiles import sequential
+
+        records = []
+        results = sequential(['a', 'bb'], _LengthAggregator, records.append)
+
+        self.assertEqual(results['~total'], [1, 2])
+        self.assertEqual(records, [
+            dict(tile='a', sizes={'~total': 1}),
+            dict(tile='bb', sizes={'~total': 2}),
+        ])
+
+
+class TestWorker(TestCase):
+
+    def _run(self, num_jobs, flush_every=None):
+        from queue import Queue
+        from scoville.percentiles import Sentinel, worker
+
+        input_queue = Queue()
+        output_queue = Queue()
+        for i in range(num_jobs):
+            input_queue.put((i, 'x' * (i + 1)))
+        input_queue.put(Sentinel())
+
+        worker(input_queue, output_queue, _LengthAggregator(),
+               flush_every=flush_every, flush_interval=3600)
+
+        messages = []
+        while not output_queue.empty():
+            messages.append(output_queue.get())
+        return messages
+
+    def test_no_indices_without_checkpoint(self):
+        messages = self._run(10)
+        self.assertEqual([m[0] for m in messages], ['result'])
+        self.assertEqual(messages[0][2], [])
+
+    def test_indices_flushed(self):
+        messages = self._run(5, flush_every=2)
+        self.assertEqual([(m[0], m[2]) for m in messages], [
+            ('partial', [0, 1]), ('partial', [2, 3]), ('result', [4])])
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _interrupt_after(items, n):
+    # yields the first n items and then raises, as if the run was killed.
+    for i, item in enumerate(items):
+        if i == n:
+            raise _Interrupted()
+        yield item
+
+
+class TestCheckpoint(TestCase):
+
+    def test_sequential_resume(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import Checkpoint, sequential
+
+        urls = ['x' * i for i in range(1, 21)]
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint')
+
+            with self.assertRaises(_Interrupted):
+                sequential(_interrupt_after(urls, 12), _LengthAggregator,
+                           checkpoint=Checkpoint(path, interval=0))
+
+            records = []
+            checkpoint = Checkpoint(path, resume=True)
+            results = sequential(urls, _LengthAggregator, records.append,
+                                 checkpoint)
+
+        self.assertEqual(sorted(results['~total']), list(range(1, 21)))
+        self.assertEqual([r['tile'] for r in records], urls[12:])
+        self.assertEqual(checkpoint.num_done(), 20)
+
+    def test_parallel_resume(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import Checkpoint, FactoryFunctionHolder, \
+            parallel
+
+        urls = ['x' * i for i in range(1, 101)]
+        factory = FactoryFunctionHolder(_LengthAggregator)
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint')
+
+            checkpoint = Checkpoint(path, interval=0, flush_every=7)
+            results = parallel(iter(urls), factory, 3, checkpoint=checkpoint)
+            self.assertEqual(sorted(results['~total']), list(range(1, 101)))
+
+            # resuming a finished run shouldn't process anything again, but
+            # should give the same result.
+            records = []
+            checkpoint = Checkpoint(path, resume=True)
+            results = parallel(iter(urls), factory, 3, records.append,
+                               checkpoint)
+
+        self.assertEqual(sorted(results['~total']), list(range(1, 101)))
+        self.assertEqual(records, [])
+
+    def test_resume_different_run(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import Checkpoint, CheckpointError
+        from scoville.percentiles import sequential
+
+        gzip = dict(tiles_file='tiles.txt', urls=['http://a/{z}/{x}/{y}'],
+                    aggregator=dict(kind='percentiles', compression='gzip:6'))
+        plain = dict(gzip, aggregator=dict(kind='percentiles',
+                                           compression=None))
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint')
+            sequential(['a'], _LengthAggregator,
+                       checkpoint=Checkpoint(path, run=gzip))
+
+            # the same run can be resumed.
+            self.assertTrue(Checkpoint(path, True, run=gzip).check())
+
+            with self.assertRaises(CheckpointError) as cm:
+                Checkpoint(path, True, run=plain).check()
+            self.assertIn('aggregator', str(cm.exception))
+
+            with self.assertRaises(CheckpointError):
+                sequential(['a'], _LengthAggregator,
+                           checkpoint=Checkpoint(path, True))
+
+    def test_resume_old_version(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from msgpack import packb
+        from scoville.percentiles import Checkpoint, CheckpointError
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint')
+            with open(path, 'wb') as fh:
+                fh.write(packb(dict(version=1, state=packb({}), done=b'')))
+
+            with self.assertRaises(CheckpointError) as cm:
+                Checkpoint(path, True).check()
+            self.assertIn('version 1', str(cm.exception))
+
+    def test_no_resume_ignores_file(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import Checkpoint, sequential
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint')
+            sequential(['a'], _LengthAggregator, checkpoint=Checkpoint(path))
+            results = sequential(['bb'], _LengthAggregator,
+                                 checkpoint=Checkpoint(path))
+
+        self.assertEqual(results['~total'], [2])
+
+
+class TestLocalTile(TestCase):
+
+    def test_no_fetch(self):
+        import pickle
+        from scoville.percentiles import Aggregator, LocalTile
+
+        tile = pickle.loads(pickle.dumps(LocalTile('a/0/0/0', _WATER_TILE)))
+        self.assertEqual(tile, 'a/0/0/0')
+
+        # the real fetch function is used, but the data comes from the tile.
+        agg = Aggregator()
+        record = agg.add(tile)
+        self.assertEqual(record['sizes'], {'~total': 60, 'water': 60})
+        # and is dropped once read, so records don't carry it around.
+        self.assertIsNone(tile.data)
+
+
+class TestCompressedSizes(TestCase):
+
+    def test_aggregator(self):
+        import gzip
+        from scoville.compression import Compressor
+        from scoville.percentiles import Aggregator
+
+        agg = Aggregator(compressor=Compressor('gzip', 9))
+        agg.fetch_fn = {'a': _WATER_TILE}.get
+        record = agg.add('a')
+
+        total = len(gzip.compress(_WATER_TILE, 9))
+        self.assertEqual(record['compressed']['~total'], total)
+        self.assertEqual(agg.results['~total@gzip'], [total])
+        self.assertEqual(agg.results['water@gzip'],
+                         [record['compressed']['water']])
+        self.assertEqual(agg.results['water'], [60])
+
+    def test_weighted_aggregator(self):
+        from scoville.compression import Compressor
+        from scoville.percentiles import WeightedAggregator
+
+        agg = WeightedAggregator(compressor=Compressor())
+        agg.fetch_fn = {'a': _WATER_TILE}.get
+        record = agg.add(('a', 5))
+
+        self.assertEqual(dict(agg.results['water@gzip']),
+                         {record['compressed']['water']: 5})
+
+    def test_outliers_ranked_by_compressed_size(self):
+        from scoville.compression import Compressor
+        from scoville.percentiles import LargestN
+
+        # many copies of the same feature are large, but compress well.
+        tiles = {
+            'repetitive': _feature_tile(*[(1, 'lake', 4)] * 300),
+            'noisy': _feature_tile((1, 'lake', 300)),
+        }
+        agg = LargestN(1, compressor=Compressor())
+        agg.fetch_fn = tiles.get
+        for url in tiles:
+            agg.add(url)
+
+        other = LargestN(1, compressor=Compressor())
+        other.merge_decode(agg.encode())
+
+        (compressed, size, _, _, url), = other.results['water']
+        self.assertEqual(url, 'noisy')
+        self.assertLess(compressed, size)
+
+
+class TestWeightedPercentiles(TestCase):
+
+    def test_unit_weights_match_unweighted(self):
+        from scoville.percentiles import weighted_percentiles
+
+        values = [5, 1, 4, 1, 5, 9, 2, 6, 5, 3]
+        percentiles = [0, 10, 50, 90, 99.9, 100]
+
+        weights = {}
+        for v in values:
+            weights[v] = weights.get(v, 0) + 1
+
+        values.sort()
+        expected = [values[min(len(values) - 1, int(len(values) * p / 100.0))]
+                    for p in percentiles]
+        self.assertEqual(weighted_percentiles(weights, percentiles), expected)
+
+    def test_large_weights(self):
+        from scoville.percentiles import weighted_percentiles
+
+        # one huge tile which is hardly ever requested shouldn't move the
+        # median, but does show up in the top percentile.
+        weights = {100: 1000000, 200: 10, 100000: 1}
+        self.assertEqual(weighted_percentiles(weights, [99.999, 50, 100]),
+                         [200, 100, 100000])
+
+    def test_weighted_aggregator_merge(self):
+        from scoville.percentiles import WeightedAggregator
+
+        a = WeightedAggregator()
+        b = WeightedAggregator()
+        a.results['~total'][10] += 3
+        b.results['~total'][10] += 2
+        b.results['~total'][20] += 1
+        a.merge_decode(b.encode())
+
+        self.assertEqual(dict(a.results['~total']), {10: 5, 20: 1})
+
+
+class TestSizeBins(TestCase):
+
+    def test_relative_accuracy(self):
+        from scoville.percentiles import SizeBins
+
+        bins = SizeBins(0.01)
+        for size in (0, 1, 2, 3, 10, 99, 1000, 12345, 10000000):
+            value = bins.value(bins.index(size))
+            self.assertLessEqual(abs(value - size), 0.01 * size + 0.5)
+
+        # a few hundred bins cover everything up to 10MB.
+        self.assertLess(bins.index(10000000), 1000)
+
+    def test_exact(self):
+        from scoville.percentiles import SizeBins
+
+        bins = SizeBins(0)
+        self.assertEqual(bins.value(bins.index(12345)), 12345)
+
+
+class TestZoomBuckets(TestCase):
+
+    def test_buckets(self):
+        from scoville.percentiles import ZoomBuckets
+
+        buckets = ZoomBuckets('0-7, 8-12,14,15-')
+        self.assertEqual(buckets(0, 0, 0), '0-7')
+        self.assertEqual(buckets(8, 0, 0), '8-12')
+        self.assertEqual(buckets(13, 0, 0), 'other')
+        self.assertEqual(buckets(14, 0, 0), '14')
+        self.assertEqual(buckets(20, 0, 0), '15-')
+
+    def test_empty_range(self):
+        from scoville.percentiles import ZoomBuckets
+
+        with self.assertRaises(ValueError):
+            ZoomBuckets('8-7')
+
+
+class TestGroupedAggregator(TestCase):
+
+    def test_group_by_zoom(self):
+        from scoville.percentiles import GroupedAggregator
+        from scoville.percentiles import binned_percentiles
+        from scoville.percentiles import group_by_zoom
+
+        def fetch_fn(url):
+            return _WATER_TILE if url == 'water' else None
+
+        a = GroupedAggregator(group_by_zoom)
+        b = GroupedAggregator(group_by_zoom)
+        a.fetch_fn = b.fetch_fn = fetch_fn
+
+        a.add((0, 0, 0, 'water', 1))
+        b.add((1, 0, 0, 'water', 3))
+        record = b.add((1, 1, 0, 'missing', 1))
+        self.assertIn('error', record)
+
+        a.merge_decode(b.encode())
+        result = binned_percentiles(a.bins, a.results, [50])
+
+        self.assertEqual(result, {
+            '0': {'~total': [60], 'water': [60]},
+            '1': {'~total': [60], 'water': [60]},
+        })
+        self.assertEqual(sum(a.results['1']['~total'].values()), 3)
+
+
+class TestMultiSourceAggregator(TestCase):
+
+    def test_deltas_and_ratios(self):
+        from scoville.percentiles import MultiSourceAggregator
+
+        agg = MultiSourceAggregator(3)
+        agg.fetch_fn = {'a': _WATER_TILE, 'b': _WATER_TILE * 2}.get
+
+        record = agg.add(['a', 'b', 'a'])
+        failed = agg.add(['a', 'missing', 'a'])
+
+        self.assertEqual(record['sizes']['url2'],
+                         {'~total': 120, 'water': 60})
+        self.assertIn('missing', failed['error'])
+
+        # the failed tile isn't counted for any of the sources.
+        self.assertEqual(dict(agg.results['url1']),
+                         {'~total': [60], 'water': [60]})
+        self.assertEqual(dict(agg.results['url2-url1']),
+                         {'~total': [60], 'water': [0]})
+        self.assertEqual(dict(agg.results['url3-url1']),
+                         {'~total': [0], 'water': [0]})
+        self.assertEqual(agg.results['url2/url1']['~total'], [2.0])
+
+    def test_missing_layer(self):
+        from scoville.percentiles import MultiSourceAggregator
+
+        agg = MultiSourceAggregator(2)
+        agg.fetch_fn = {'water': _WATER_TILE, 'empty': b''}.get
+        agg.add(['water', 'empty'])
+
+        # the layer counts as zero-sized in the second source.
+        self.assertEqual(agg.results['url2-url1']['water'], [-60])
+        self.assertEqual(agg.results['url2/url1']['water'], [0.0])
+        self.assertNotIn('water', agg.results['url2'])
+
+
+def _feature_tile(*features):
+    # builds a tile with a 'water' layer of polygon features, each given as
+    # (fid, kind, number of vertices).
+    from scoville.mvt import GeomType
+    from scoville.synthetic import encode_tile, LayerEncoder
+
+    layer = LayerEncoder('water')
+    for fid, kind, vertices in features:
+        ring = [(i, i * i % 97) for i in range(vertices)]
+        layer.add_feature(dict(kind=kind), GeomType.polygon, [ring], fid)
+    return encode_tile([layer])
+
+
+class TestLargestFeatures(TestCase):
+
+    def test_largest(self):
+        from scoville.percentiles import LargestFeatures
+
+        agg = LargestFeatures(2)
+        agg.fetch_fn = {
+            'a': _feature_tile((1, 'lake', 3), (2, 'ocean', 50),
+                               (3, 'lake', 10)),
+            'b': _feature_tile((4, 'ocean', 100)),
+        }.get
+
+        agg.add((0, 0, 0, 'a'))
+        agg.add((1, 1, 0, 'b'))
+
+        largest = sorted(agg.results['water'], reverse=True)
+        self.assertEqual([(e[1], e[6], e[7]) for e in largest],
+                         [('1/1/0', 4, 'ocean'), ('0/0/0', 2, 'ocean')])
+
+    def test_merge(self):
+        from scoville.percentiles import LargestFeatures
+
+        tiles = {
+            'a': _feature_tile((1, 'lake', 30), (2, 'ocean', 5)),
+            'b': _feature_tile((3, 'ocean', 20), (4, 'lake', 40)),
+        }
+        a = LargestFeatures(2, measure='size')
+        b = LargestFeatures(2, measure='size')
+        a.fetch_fn = b.fetch_fn = tiles.get
+
+        a.add((0, 0, 0, 'a'))
+        b.add((0, 0, 0, 'b'))
+        a.merge_decode(b.encode())
+
+        self.assertEqual(sorted(e[6] for e in a.results['water']), [1, 4])
@@ -0,0 +1,183 @@
+from unittest import TestCase
+
+
+def _directory(entries):
+    # encodes (tile_id, offset, length, run_length) entries as a PMTiles
+    # directory, gzipped.
+    import gzip
+    from scoville.pbf import encode_varints
+
+    values = [len(entries)]
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        values.append(tile_id - last_id)
+        last_id = tile_id
+    values.extend(e[3] for e in entries)
+    values.extend(e[2] for e in entries)
+    for i, (_, offset, length, _) in enumerate(entries):
+        prev = entries[i - 1] if i > 0 else None
+        if prev is not None and offset == prev[1] + prev[2]:
+            values.append(0)
+        else:
+            values.append(offset + 1)
+    return gzip.compress(encode_varints(values))
+
+
+def _write_archive(path, tiles):
+    # writes a PMTiles archive of tiles, a list of (tile_id, data, run_length)
+    # in tile ID order, where data can repeat an earlier tile's. the first
+    # tile goes in the root directory and the rest in a leaf directory.
+    from struct import pack
+
+    data = b''
+    offsets = {}
+    entries = []
+    for tile_id, tile, run_length in tiles:
+        if tile not in offsets:
+            offsets[tile] = len(data)
+            data += tile
+        entries.append((tile_id, offsets[tile], len(tile), run_length))
+
+    leaf = _directory(entries[1:])
+    root = _directory([entries[0], (entries[1][0], 0, len(leaf), 0)])
+
+    root_offset = 127
+    leaf_offset = root_offset + len(root)
+    data_offset = leaf_offset + len(leaf)
+    header = pack('<7sB11Q4B2B', b'PMTiles', 3,
+                  root_offset, len(root), data_offset, 0,
+                  leaf_offset, len(leaf), data_offset, len(data),
+                  sum(e[3] for e in entries), len(entries), len(offsets),
+                  1, 2, 1, 1, 0, 1)
+    header += b'\0' * (127 - len(header))
+
+    with open(path, 'wb') as fh:
+        fh.write(header + root + leaf + data)
+
+
+def _water_tile(vertices):
+    from scoville.mvt import GeomType
+    from scoville.synthetic import encode_tile, LayerEncoder
+
+    layer = LayerEncoder('water')
+    ring = [(i, i * i % 97) for i in range(vertices)]
+    layer.add_feature(dict(kind='ocean'), GeomType.polygon, [ring])
+    return encode_tile([layer])
+
+
+class TestTileId(TestCase):
+
+    def test_round_trip(self):
+        from scoville.pmtiles import tile_id_to_zxy, zxy_to_tile_id
+
+        tile_id = 0
+        for z in range(5):
+            for x in range(1 << z):
+                for y in range(1 << z):
+                    self.assertEqual(
+                        tile_id_to_zxy(zxy_to_tile_id(z, x, y)), (z, x, y))
+        for tile_id in range(341):
+            self.assertEqual(zxy_to_tile_id(*tile_id_to_zxy(tile_id)),
+                             tile_id)
+
+    def test_hilbert_order(self):
+        from scoville.pmtiles import tile_id_to_zxy
+
+        self.assertEqual([tile_id_to_zxy(i) for i in range(6)], [
+            (0, 0, 0), (1, 0, 0), (1, 0, 1), (1, 1, 1), (1, 1, 0),
+            (2, 0, 0)])
+
+
+class TestPMTiles(TestCase):
+
+    def _archive(self, tmp):
+        from os.path import join
+
+        path = join(tmp, 'tiles.pmtiles')
+        small = _water_tile(3)
+        large = _water_tile(50)
+        # the middle two z1 tiles share the same data, as do the first and
+        # last.
+        _write_archive(path, [
+            (0, large, 1),
+            (1, small, 1),
+            (2, _water_tile(10), 2),
+            (4, small, 1),
+        ])
+        return path, small, large
+
+    def test_entries(self):
+        from tempfile import TemporaryDirectory
+        from scoville.pmtiles import PMTiles
+
+        with TemporaryDirectory() as tmp:
+            path, small, large = self._archive(tmp)
+            archive = PMTiles(path)
+            entries = list(archive.entries())
+            self.assertEqual([(e[0], e[3]) for e in entries],
+                             [(0, 1), (1, 1), (2, 2), (4, 1)])
+            self.assertEqual(entries[1][1:3], entries[3][1:3])
+            self.assertEqual(bytes(archive.tile(*entries[0][1:3])), large)
+            self.assertEqual(bytes(archive.tile(*entries[3][1:3])), small)
+            archive.close()
+
+    def test_not_pmtiles(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.pmtiles import PMTiles
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'bad.pmtiles')
+            with open(path, 'wb') as fh:
+                fh.write(b'\0' * 200)
+            with self.assertRaises(ValueError):
+                PMTiles(path)
+
+    def test_split_by_offset(self):
+        from scoville.pmtiles import split_by_offset
+
+        entries = [(i, 100 * (9 - i), 100, 1) for i in range(10)]
+        parts = split_by_offset(entries, 3)
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(sum(len(p) for p in parts), 10)
+        # each part is a contiguous range of the file, in order.
+        offsets = [e[1] for p in parts for e in p]
+        self.assertEqual(offsets, sorted(offsets))
+        self.assertTrue(all(3 <= len(p) <= 4 for p in parts))
+
+        self.assertEqual(len(split_by_offset(entries[:2], 3)), 2)
+
+    def test_percentiles(self):
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import calculate_archive_percentiles
+
+        with TemporaryDirectory() as tmp:
+            path, small, large = self._archive(tmp)
+            records = []
+            sequential = calculate_archive_percentiles(
+                path, [0, 50, 100], 1, records.append)
+            parallel = calculate_archive_percentiles(path, [0, 50, 100], 2)
+
+        self.assertEqual(sequential, parallel)
+        # 5 tiles, 2 of which are one entry, so the median is the 10 vertex
+        # tile.
+        self.assertEqual(sequential['~total'][0], len(small))
+        self.assertEqual(sequential['~total'][2], len(large))
+        self.assertEqual(sequential['~total'][1], len(_water_tile(10)))
+
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[2]['tile'], path + '/1/0/1')
+        self.assertEqual(records[2]['weight'], 2)
+
+    def test_outliers(self):
+        from tempfile import TemporaryDirectory
+        from scoville.percentiles import calculate_archive_outliers
+
+        with TemporaryDirectory() as tmp:
+            path, small, large = self._archive(tmp)
+            records = []
+            result = calculate_archive_outliers(path, 1, 2, records.append)
+
+        self.assertEqual(len(records), 4)
+        entry, = result['water']
+        self.assertEqual(entry[-1], path + '/0/0/0')
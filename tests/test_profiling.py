@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_percentiles(self):
+        from scoville.profiling import LatencyHistogram
+
+        h = LatencyHistogram()
+        for ms in range(1, 101):
+            h.add(ms / 1000.0)
+
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.total, 5.05)
+        self.assertEqual(h.max, 0.1)
+        # buckets are 5% wide, so each percentile is within 5% of the truth.
+        for p in (10, 50, 90):
+            self.assertAlmostEqual(h.percentile(p), p / 1000.0,
+                                   delta=p / 1000.0 * 0.05)
+        self.assertEqual(h.percentile(100), 0.1)
+
+    def test_merge(self):
+        from scoville.profiling import LatencyHistogram
+
+        a = LatencyHistogram()
+        b = LatencyHistogram()
+        both = LatencyHistogram()
+        for i in range(1, 50):
+            a.add(i / 1000.0)
+            b.add(i / 100.0)
+            both.add(i / 1000.0)
+            both.add(i / 100.0)
+
+        a.merge(b.encode())
+        self.assertEqual(dict(a.counts), dict(both.counts))
+        self.assertEqual(a.count, both.count)
+        self.assertEqual(a.max, both.max)
+
+
+class TestProfiler(TestCase):
+
+    def tearDown(self):
+        from scoville import profiling
+        profiling.disable()
+
+    def test_disabled(self):
+        from scoville import profiling
+
+        with profiling.stage('parse'):
+            pass
+        self.assertIsNone(profiling.active())
+
+    def test_trace(self):
+        from scoville import profiling
+
+        profiler = profiling.Profiler(trace=True)
+        profiling.enable(profiler)
+        with profiling.stage('parse'):
+            pass
+        with profiling.stage('parse'):
+            pass
+
+        merged = profiling.Profiler(trace=True)
+        merged.merge_decode(profiler.encode())
+        self.assertEqual(merged.histograms['parse'].count, 2)
+        self.assertEqual([e[0] for e in merged.events], ['parse', 'parse'])
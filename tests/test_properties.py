@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+
+def _property_tile(*properties):
+    from scoville.mvt import GeomType
+    from scoville.synthetic import encode_tile
+    from scoville.synthetic import LayerEncoder
+
+    layer = LayerEncoder('places')
+    for props in properties:
+        layer.add_feature(props, GeomType.point, [[(1, 1)]])
+    return encode_tile([layer])
+
+
+class TestLayerPropertyStats(TestCase):
+
+    def test_stats(self):
+        from scoville.mvt import Tile
+        from scoville.properties import layer_property_stats
+        from scoville.properties import KEY_BYTES, TAG_BYTES, VALUE_BYTES
+        from scoville.properties import TILES, REFS, VALUES, SINGLE_USE
+
+        data = _property_tile(
+            dict(kind='city', name='Paris'),
+            dict(kind='city', name='Lyon'),
+            dict(kind='town', name='Town'))
+        layer, = Tile(data)
+        stats, value_costs = layer_property_stats(layer)
+
+        # every byte of the keys and values tables is counted against
+        # exactly one key.
+        self.assertEqual(
+            sum(s[KEY_BYTES] + s[VALUE_BYTES] for s in stats.values()),
+            layer.properties_size)
+        # each tag is two single byte indices.
+        self.assertEqual(sum(s[TAG_BYTES] for s in stats.values()), 12)
+
+        # kind is used 3 times with 2 values, one of which is used once.
+        kind = stats['kind']
+        self.assertEqual((kind[TILES], kind[REFS]), (1, 3))
+        self.assertEqual((kind[VALUES], kind[SINGLE_USE]), (2, 1))
+        # all 3 names are only used once.
+        name = stats['name']
+        self.assertEqual((name[VALUES], name[SINGLE_USE]), (3, 3))
+
+        self.assertEqual(len(value_costs['kind']), 2)
+        self.assertGreater(value_costs['kind'][b'\x0a\x04city'],
+                           value_costs['kind'][b'\x0a\x04town'])
+
+
+class TestHeavyHitters(TestCase):
+
+    def test_heavy_items_kept(self):
+        from scoville.properties import HeavyHitters
+
+        hh = HeavyHitters(2)
+        for i in range(100):
+            hh.add('heavy', 10)
+            hh.add('item%d' % i, 1)
+
+        top = hh.top(1)
+        self.assertEqual(top[0][0], 'heavy')
+        # estimates are never more than the true weight, and at most error
+        # less.
+        self.assertLessEqual(top[0][1], 1000)
+        self.assertGreaterEqual(top[0][1] + hh.error, 1000)
+        self.assertLessEqual(len(hh.counts), 4)
+
+    def test_merge(self):
+        from scoville.properties import HeavyHitters
+
+        a = HeavyHitters(2)
+        b = HeavyHitters(2)
+        for i in range(10):
+            a.add('a%d' % i)
+            b.add('b%d' % i)
+        a.add('both', 20)
+        b.add('both', 20)
+
+        a.merge(b.encode())
+        self.assertEqual(a.top(1)[0][0], 'both')
+        self.assertLessEqual(len(a.counts), 4)
+
+
+class TestPropertyAggregator(TestCase):
+
+    def test_merge(self):
+        from scoville.properties import PropertyAggregator
+        from scoville.properties import TILES, REFS, VALUES
+
+        tiles = {
+            'a': _property_tile(dict(kind='city'), dict(kind='city')),
+            'b': _property_tile(dict(kind='city'), dict(kind='town')),
+        }
+        a = PropertyAggregator()
+        b = PropertyAggregator()
+        a.fetch_fn = b.fetch_fn = tiles.get
+
+        a.add('a')
+        b.add('b')
+        a.merge_decode(b.encode())
+
+        total, hitters = a.results['places']['kind']
+        self.assertEqual((total[TILES], total[REFS], total[VALUES]),
+                         (2, 4, 3))
+        self.assertEqual(hitters.top(1)[0][0], b'\x0a\x04city')
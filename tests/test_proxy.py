@@ -0,0 +1,342 @@
+from unittest import TestCase
+
+
+class _FakeTile(object):
+    def __init__(self, size, name='0/0/0'):
+        self.data = b'\x00' * size
+        self.name = name
+
+
+class TestColourMap(TestCase):
+
+    def test_buckets(self):
+        from scoville.proxy import ColourMap
+
+        colour_map = ColourMap([10, 20], ['#ffffff', '#ff0000', '#000000'])
+
+        self.assertEqual(colour_map(0), '#ffffff')
+        self.assertEqual(colour_map(9), '#ffffff')
+        self.assertEqual(colour_map(10), '#ff0000')
+        self.assertEqual(colour_map(19), '#ff0000')
+        self.assertEqual(colour_map(20), '#000000')
+        self.assertEqual(colour_map(1000), '#000000')
+
+
+class TestHeatmap(TestCase):
+
+    def _heatmap(self, **kwargs):
+        from scoville.proxy import ColourMap, Heatmap
+
+        colour_map = ColourMap([10, 20], ['#ffffff', '#ff0000', '#0000ff'])
+        return Heatmap(1, 16, colour_map, error_colour='#00ff00', **kwargs)
+
+    def test_render(self):
+        heatmap = self._heatmap(palette=False)
+        tiles = {
+            (0, 0): _FakeTile(0),
+            (1, 0): _FakeTile(15),
+            (0, 1): _FakeTile(25),
+            (1, 1): None,
+        }
+
+        im = heatmap.render(tiles)
+
+        self.assertEqual(im.mode, 'RGB')
+        self.assertEqual(im.size, (256, 256))
+        # sample away from the outline and label in the middle.
+        self.assertEqual(im.getpixel((32, 32)), (255, 255, 255))
+        self.assertEqual(im.getpixel((224, 32)), (255, 0, 0))
+        self.assertEqual(im.getpixel((32, 224)), (0, 0, 255))
+        self.assertEqual(im.getpixel((224, 224)), (0, 255, 0))
+        self.assertEqual(im.getpixel((0, 0)), (0, 0, 0))
+
+    def test_render_palette(self):
+        heatmap = self._heatmap()
+        tiles = dict(((x, y), _FakeTile(0)) for x in (0, 1) for y in (0, 1))
+
+        im = heatmap.render(tiles)
+
+        self.assertEqual(im.mode, 'P')
+        self.assertEqual(im.convert('RGB').getpixel((32, 32)),
+                         (255, 255, 255))
+
+    def test_render_compressed(self):
+        from scoville.compression import Compressor
+        from scoville.proxy import ColourMap, Heatmap
+
+        colour_map = ColourMap([100, 200], ['#ffffff', '#ff0000', '#0000ff'])
+        heatmap = Heatmap(1, 16, colour_map, palette=False,
+                          compressor=Compressor())
+        # a kilobyte of zeros compresses to a few tens of bytes.
+        tiles = dict(((x, y), _FakeTile(1000)) for x in (0, 1) for y in (0, 1))
+
+        im = heatmap.render(tiles)
+
+        self.assertEqual(im.getpixel((32, 32)), (255, 255, 255))
+
+
+# a tile with a single 'water' layer containing one feature.
+_WATER_TILE = (
+    b'\x1a\x3a\x0a\x05\x77\x61\x74\x65\x72\x12\x14\x12\x04'
+    b'\x00\x00\x01\x01\x18\x02\x22\x0a\x09\x8d\x01\xac\x3f'
+    b'\x12\x00\x01\x00\x02\x1a\x03\x66\x6f\x6f\x1a\x03\x62'
+    b'\x61\x7a\x22\x05\x0a\x03\x62\x61\x72\x22\x05\x0a\x03'
+    b'\x66\x6f\x6f\x28\x80\x20\x78\x01')
+
+
+class TestTreemap(TestCase):
+
+    def test_style_stable(self):
+        from scoville.proxy import Treemap
+
+        fill, outline = Treemap().style('water')
+        # 'water' should come out blue.
+        self.assertEqual(fill, (102, 102, 255))
+        self.assertEqual(outline, (0, 0, 153))
+
+    def test_render(self):
+        from scoville.mvt import Tile
+        from scoville.proxy import Treemap
+
+        treemap = Treemap()
+        im = treemap.render({0: Tile(_WATER_TILE, '1/2/3')})
+
+        self.assertEqual(im.size, (256, 256))
+        self.assertEqual(im.getpixel((10, 128)), (102, 102, 255))
+
+    def test_render_svg(self):
+        from scoville.mvt import Tile
+        from scoville.proxy import Treemap
+
+        svg = Treemap().render_svg({0: Tile(_WATER_TILE, '1/2/3')})
+
+        self.assertTrue(svg.startswith('<svg '))
+        self.assertIn('fill="#6666ff"', svg)
+        self.assertIn('>water</text>', svg)
+        self.assertIn('>1/2/3</text>', svg)
+
+
+class TestTemplates(TestCase):
+
+    def setUp(self):
+        from io import StringIO
+        from threading import Thread
+        from scoville.proxy import Handler, ThreadedHTTPServer, Treemap
+
+        self.access_log = StringIO()
+        self.server = ThreadedHTTPServer(
+            ('127.0.0.1', 0), Handler, 'http://localhost/{z}/{x}/{y}.mvt',
+            Treemap(), access_log=self.access_log)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _get(self, path, headers={}):
+        from http.client import HTTPConnection
+
+        conn = HTTPConnection('127.0.0.1', self.server.server_port)
+        conn.request('GET', path, headers=headers)
+        res = conn.getresponse()
+        body = res.read()
+        conn.close()
+        return res, body
+
+    def test_template(self):
+        res, body = self._get('/map.js')
+
+        self.assertEqual(res.status, 200)
+        self.assertEqual(int(res.getheader('Content-Length')), len(body))
+        self.assertIn(b'localhost:%d/tiles' % self.server.server_port, body)
+
+    def test_gzip(self):
+        from gzip import decompress
+
+        plain_res, plain = self._get('/')
+        res, body = self._get('/', {'Accept-Encoding': 'gzip, deflate'})
+
+        self.assertEqual(res.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(decompress(body), plain)
+        self.assertEqual(res.getheader('Vary'), 'Accept-Encoding')
+        self.assertNotEqual(res.getheader('ETag'), plain_res.getheader('ETag'))
+
+        res, body = self._get('/', {'Accept-Encoding': 'gzip;q=0, br'})
+        self.assertIsNone(res.getheader('Content-Encoding'))
+        self.assertEqual(body, plain)
+
+    def test_accepts_gzip(self):
+        from scoville.proxy import accepts_gzip
+
+        self.assertTrue(accepts_gzip('gzip'))
+        self.assertTrue(accepts_gzip('deflate, GZIP;q=0.5'))
+        self.assertTrue(accepts_gzip('br, *'))
+        self.assertFalse(accepts_gzip(''))
+        self.assertFalse(accepts_gzip('identity'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('gzip; q=0.0, *'))
+        self.assertFalse(accepts_gzip('*;q=0'))
+        self.assertFalse(accepts_gzip('xgzip'))
+
+    def test_etag(self):
+        res, _ = self._get('/style.css')
+        etag = res.getheader('ETag')
+
+        res, body = self._get('/style.css', {'If-None-Match': etag})
+
+        self.assertEqual(res.status, 304)
+        self.assertEqual(body, b'')
+
+        # the plain ETag doesn't match the gzipped representation.
+        gzip = {'Accept-Encoding': 'gzip'}
+        res, body = self._get('/style.css', dict(gzip, **{
+            'If-None-Match': etag}))
+        self.assertEqual(res.status, 200)
+
+        gzip_etag = res.getheader('ETag')
+        res, body = self._get('/style.css', dict(gzip, **{
+            'If-None-Match': '"other", W/%s' % (gzip_etag,)}))
+        self.assertEqual(res.status, 304)
+        self.assertEqual(res.getheader('ETag'), gzip_etag)
+
+    def test_metrics(self):
+        self._get('/style.css')
+        self._get('/nope')
+        res, body = self._get('/metrics')
+
+        self.assertEqual(res.status, 200)
+        lines = body.decode('utf-8').splitlines()
+        self.assertIn('scoville_http_requests_total{route="template",'
+                      'status="200"} 1', lines)
+        self.assertIn('scoville_http_requests_total{route="other",'
+                      'status="404"} 1', lines)
+        self.assertIn('# TYPE scoville_upstream_request_duration_seconds '
+                      'histogram', lines)
+
+    def test_access_log(self):
+        import json
+        from time import sleep
+
+        _, body = self._get('/style.css')
+
+        # the request is logged just after the response is sent.
+        for _ in range(100):
+            if self.access_log.getvalue():
+                break
+            sleep(0.01)
+
+        entry = json.loads(self.access_log.getvalue().splitlines()[0])
+        self.assertEqual(entry['path'], '/style.css')
+        self.assertEqual(entry['route'], 'template')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['bytes'], len(body))
+        self.assertIn('duration_ms', entry)
+
+
+def _quad_treemap():
+    # a treemap which fetches the four tiles beneath the one it's drawing,
+    # to check that any failure aborts the whole tile when partial is False.
+    from scoville.proxy import Treemap
+
+    class QuadTreemap(Treemap):
+        def tiles_for(self, z, x, y):
+            return dict(((dx, dy), (z + 1, 2 * x + dx, 2 * y + dy))
+                        for dx in (0, 1) for dy in (0, 1))
+
+    return QuadTreemap()
+
+
+class TestSendTile(TestCase):
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in reversed(self.servers):
+            server.close()
+
+    def _upstream(self, fail=(), latency=0.0):
+        from tests.upstream import Upstream
+
+        upstream = Upstream(fail, latency)
+        self.servers.append(upstream)
+        return upstream
+
+    def _get(self, renderer, upstream, path, deadline=30):
+        from http.client import HTTPConnection
+        from threading import Thread
+        from time import monotonic
+        from scoville.proxy import Handler, ThreadedHTTPServer
+
+        server = ThreadedHTTPServer(('127.0.0.1', 0), Handler, upstream.url,
+                                    renderer, deadline)
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            start = monotonic()
+            conn = HTTPConnection('127.0.0.1', server.server_port)
+            conn.request('GET', path)
+            res = conn.getresponse()
+            body = res.read()
+            conn.close()
+            elapsed = monotonic() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        return res, body, elapsed
+
+    def _heatmap(self):
+        from scoville.proxy import ColourMap, Heatmap
+
+        return Heatmap(1, 16, ColourMap([], ['#ffffff']), palette=False)
+
+    def test_treemap(self):
+        from scoville.proxy import Treemap
+
+        upstream = self._upstream()
+        res, body, _ = self._get(Treemap(), upstream, '/tiles/3/1/2.png')
+
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader('Content-Type'), 'image/png')
+        self.assertEqual(res.getheader('Cache-control'), 'max-age=300')
+        self.assertEqual(int(res.getheader('Content-Length')), len(body))
+        self.assertEqual(dict(upstream.requests), {(3, 1, 2): 1})
+
+    def test_treemap_aborts(self):
+        # the failed tile comes back straight away, well before the others.
+        upstream = self._upstream(fail=[(1, 1, 1)], latency=2.0)
+        res, body, elapsed = self._get(
+            _quad_treemap(), upstream, '/tiles/0/0/0.png')
+
+        self.assertEqual(res.status, 404)
+        self.assertEqual(body, b'')
+        self.assertLess(elapsed, 1.0)
+
+    def test_heatmap_partial(self):
+        from io import BytesIO
+        from PIL import Image
+
+        upstream = self._upstream(fail=[(1, 1, 1)])
+        res, body, _ = self._get(self._heatmap(), upstream, '/tiles/0/0/0.png')
+
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader('Cache-control'), 'max-age=10')
+        self.assertEqual(len(upstream.requests), 4)
+
+        im = Image.open(BytesIO(body)).convert('RGB')
+        self.assertEqual(im.getpixel((32, 32)), (255, 255, 255))
+        self.assertEqual(im.getpixel((224, 224)), (128, 128, 128))
+
+    def test_deadline(self):
+        from scoville.proxy import Treemap
+
+        upstream = self._upstream(latency=2.0)
+        res, body, elapsed = self._get(
+            Treemap(), upstream, '/tiles/3/1/2.png', deadline=0.2)
+
+        self.assertEqual(res.status, 504)
+        self.assertEqual(body, b'')
+        self.assertLess(elapsed, 1.0)
@@ -0,0 +1,124 @@
+from unittest import TestCase
+
+
+class TestRender(TestCase):
+
+    def test_pyramid_batches(self):
+        from scoville.proxy import Heatmap, ColourMap
+        from scoville.render import pyramid_batches
+        from scoville.tilelist import tiles_in_bbox
+
+        heatmap = Heatmap(3, 16, ColourMap([], ['#ffffff']))
+        bbox = (-122.52, 37.70, -122.35, 37.83)
+
+        batches = list(pyramid_batches(heatmap, bbox, 10, 15))
+
+        # every tile in the pyramid should appear exactly once
+        expected = set()
+        for z in range(10, 16):
+            expected.update(tiles_in_bbox(bbox, z))
+        coords = [coord for batch in batches for coord in batch]
+        self.assertEqual(len(coords), len(expected))
+        self.assertEqual(set(coords), expected)
+
+        # and tiles from z13 up should be grouped with their z13 ancestor,
+        # with which they share upstream z16 tiles.
+        for batch in batches:
+            ancestors = set()
+            for z, x, y in batch:
+                if z < 13:
+                    self.assertEqual(len(batch), 1)
+                else:
+                    ancestors.add((x >> (z - 13), y >> (z - 13)))
+            self.assertLessEqual(len(ancestors), 1)
+
+    def test_pyramid_batches_treemap(self):
+        from scoville.proxy import Treemap
+        from scoville.render import pyramid_batches
+
+        batches = list(pyramid_batches(Treemap(), (-180, -85, 180, 85), 0, 2))
+
+        self.assertEqual(len(batches), 1 + 4 + 16)
+        self.assertTrue(all(len(batch) == 1 for batch in batches))
+
+
+class _Store(object):
+    def __init__(self):
+        self.tiles = {}
+
+    def put(self, z, x, y, data):
+        self.tiles[(z, x, y)] = data
+
+
+class TestRenderTiles(TestCase):
+
+    # a z1 tile and the four z2 tiles beneath it, which are all drawn from
+    # the same four upstream z2 tiles.
+    BATCH = [(1, 0, 0), (2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)]
+
+    def _heatmap(self):
+        from scoville.proxy import ColourMap, Heatmap
+
+        return Heatmap(1, 2, ColourMap([10], ['#ffffff', '#ff0000']))
+
+    def test_render_tile(self):
+        from scoville.render import render_tile
+        from tests.upstream import Upstream
+
+        upstream = Upstream()
+        try:
+            data = render_tile(self._heatmap(), upstream.url, (1, 0, 0))
+        finally:
+            upstream.close()
+
+        self.assertTrue(data.startswith(b'\x89PNG'))
+        self.assertEqual(sorted(upstream.requests), self.BATCH[1:])
+
+    def test_render_tile_failed(self):
+        from scoville.proxy import Treemap
+        from scoville.render import render_tile
+        from tests.upstream import Upstream
+
+        upstream = Upstream(fail=[(2, 1, 1)])
+        try:
+            treemap = render_tile(Treemap(), upstream.url, (2, 1, 1))
+            # a heatmap with one missing sub-tile isn't stored either.
+            heatmap = render_tile(self._heatmap(), upstream.url, (1, 0, 0))
+        finally:
+            upstream.close()
+
+        self.assertIsNone(treemap)
+        self.assertIsNone(heatmap)
+
+    def test_render_batch_fetches_once(self):
+        from scoville.render import render_batch
+        from tests.upstream import Upstream
+
+        upstream = Upstream()
+        try:
+            results = render_batch(self._heatmap(), upstream.url, self.BATCH)
+        finally:
+            upstream.close()
+
+        self.assertEqual([coord for coord, _ in results], self.BATCH)
+        self.assertTrue(all(data is not None for _, data in results))
+        self.assertEqual(dict(upstream.requests),
+                         dict((coord, 1) for coord in self.BATCH[1:]))
+
+    def test_render_batches_counts(self):
+        from scoville.render import render_batches
+        from tests.upstream import Upstream
+
+        store = _Store()
+        upstream = Upstream(fail=[(2, 1, 1)])
+        try:
+            counts = render_batches(
+                [self.BATCH], upstream.url, self._heatmap(), store)
+        finally:
+            upstream.close()
+
+        # the failed upstream tile fails both the z1 tile and its own.
+        self.assertEqual(counts, (3, 2))
+        self.assertEqual(sorted(store.tiles),
+                         [(2, 0, 0), (2, 0, 1), (2, 1, 0)])
+        self.assertEqual(upstream.requests[(2, 1, 1)], 1)
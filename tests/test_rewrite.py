@@ -0,0 +1,141 @@
+from unittest import TestCase
+
+
+def _places_layer():
+    from scoville.mvt import GeomType
+    from scoville.synthetic import LayerEncoder
+
+    layer = LayerEncoder('places')
+    layer.add_feature(dict(kind='city', name='Paris', pop=5),
+                      GeomType.point, [[(1, 1)]], 1)
+    layer.add_feature(dict(kind='town', name='Lyon'),
+                      GeomType.point, [[(2, 2)]], 2)
+    layer.add_feature(dict(kind='hamlet', name='X', **{'name:fr': 'X'}),
+                      GeomType.point, [[(3, 3)]], 3)
+    return layer
+
+
+def _water_layer():
+    from scoville.mvt import GeomType
+    from scoville.synthetic import LayerEncoder
+
+    layer = LayerEncoder('water')
+    layer.add_feature(dict(kind='ocean'), GeomType.polygon,
+                      [[(0, 0), (5, 0), (5, 5)]])
+    return layer
+
+
+class TestRewriter(TestCase):
+
+    def _rewrite(self, data, **kwargs):
+        from scoville.mvt import Tile
+        from scoville.rewrite import Rewriter
+
+        rewritten = Rewriter(**kwargs).rewrite(data)
+        return rewritten, {layer.name: layer for layer in Tile(rewritten)}
+
+    def test_unchanged(self):
+        from scoville.synthetic import encode_tile
+
+        data = encode_tile([_places_layer(), _water_layer()])
+        rewritten, _ = self._rewrite(data, drop_keys=['missing'])
+        self.assertEqual(rewritten, data)
+
+    def test_drop_layer(self):
+        from scoville.synthetic import encode_tile
+
+        rewritten, layers = self._rewrite(
+            encode_tile([_places_layer(), _water_layer()]),
+            drop_layers=['w*'])
+        self.assertEqual(rewritten, encode_tile([_places_layer()]))
+        self.assertEqual(list(layers), ['places'])
+
+    def test_drop_keys(self):
+        from scoville.mvt import Tile
+        from scoville.synthetic import encode_tile
+
+        data = encode_tile([_places_layer(), _water_layer()])
+        rewritten, layers = self._rewrite(data, drop_keys=['name:*', 'pop'])
+
+        places = layers['places']
+        self.assertEqual(places.keys, ['kind', 'name'])
+        # 'X' was shared between name and name:fr, and 5 was only used by
+        # pop, so both entries are gone from the values table.
+        self.assertEqual(len(places.values), 6)
+        self.assertEqual(
+            [f.properties for f in places.features],
+            [dict(kind='city', name='Paris'), dict(kind='town', name='Lyon'),
+             dict(kind='hamlet', name='X')])
+        self.assertEqual([f.fid for f in places.features], [1, 2, 3])
+        before, _ = Tile(data)
+        self.assertEqual([f.geom_cmds_size for f in places.features],
+                         [f.geom_cmds_size for f in before.features])
+
+        # the water layer is copied as it was.
+        self.assertEqual(bytes(layers['water'].data),
+                         encode_tile([_water_layer()])[2:])
+
+    def test_untouched_features_copied(self):
+        from scoville.mvt import Tile
+        from scoville.synthetic import encode_tile
+
+        data = encode_tile([_places_layer()])
+        rewritten, layers = self._rewrite(data, drop_keys=['name:fr'])
+        before, = Tile(data)
+        after = layers['places']
+
+        # name:fr is the last key and its value is shared, so the tags of
+        # the first two features don't change.
+        for i in range(2):
+            self.assertEqual(bytes(after.features[i].data),
+                             bytes(before.features[i].data))
+        self.assertNotEqual(bytes(after.features[2].data),
+                            bytes(before.features[2].data))
+        self.assertEqual(after.values, before.values)
+
+    def test_drop_kinds(self):
+        from scoville.synthetic import encode_tile
+
+        data = encode_tile([_places_layer(), _water_layer()])
+        _, layers = self._rewrite(data, drop_kinds=['hamlet', 'oc*'])
+
+        self.assertEqual([f.properties['kind'] for f in layers['places']],
+                         ['city', 'town'])
+        self.assertEqual(layers['places'].keys, ['kind', 'name', 'pop'])
+        self.assertEqual(len(layers['water'].features), 0)
+        self.assertEqual(layers['water'].keys, [])
+
+    def test_duplicate_values_merged(self):
+        from scoville.mvt import GeomType, Tile
+        from scoville.synthetic import encode_tile, LayerEncoder
+
+        # a tile where the values table has 'x' twice, as a less careful
+        # encoder might write.
+        layer = LayerEncoder('roads')
+        layer.add_feature(dict(a='x', c='y'), GeomType.point, [[(1, 1)]])
+        layer.add_feature(dict(b='z'), GeomType.point, [[(2, 2)]])
+        layer.values = {(str, 'x'): 0, (str, 'y'): 1, (object, 'x'): 2}
+        data = encode_tile([layer])
+        before, = Tile(data)
+        self.assertEqual(before.features[1].properties, dict(b='x'))
+
+        _, layers = self._rewrite(data, drop_keys=['c'])
+        roads = layers['roads']
+        self.assertEqual(len(roads.values), 1)
+        self.assertEqual([f.properties for f in roads.features],
+                         [dict(a='x'), dict(b='x')])
+
+
+class TestRewriteSizes(TestCase):
+
+    def test_sizes(self):
+        from scoville.rewrite import rewrite_sizes, Rewriter
+        from scoville.synthetic import encode_tile
+
+        data = encode_tile([_places_layer(), _water_layer()])
+        sizes = rewrite_sizes(data, Rewriter(drop_layers=['places']))
+
+        self.assertEqual(sizes['before']['~total'], len(data))
+        self.assertEqual(set(sizes['before']), {'places', 'water', '~total'})
+        self.assertEqual(set(sizes['after']), {'water', '~total'})
+        self.assertEqual(sizes['after']['water'], sizes['before']['water'])
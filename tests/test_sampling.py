@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+
+class TestStratifiedSampler(TestCase):
+
+    def test_sample_size(self):
+        from scoville.sampling import StratifiedSampler
+
+        sampler = StratifiedSampler(100, seed=1)
+        for i in range(10000):
+            sampler.add(i % 2, i)
+
+        sample = sampler.sample()
+        self.assertEqual(len(sample), 100)
+        self.assertEqual(len(set(item for item, _ in sample)), 100)
+
+        # each sampled item stands for 100 items of the stream.
+        self.assertEqual(set(weight for _, weight in sample), {100.0})
+
+    def test_small_stratum_included(self):
+        from scoville.sampling import StratifiedSampler
+
+        # a single item at zoom 0 would usually be missed by a plain sample
+        # of 10 from 100,001 items.
+        sampler = StratifiedSampler(10, seed=1)
+        sampler.add(0, 'z0')
+        for i in range(100000):
+            sampler.add(10, i)
+
+        sample = dict(sampler.sample())
+        self.assertIn('z0', sample)
+        self.assertEqual(sample['z0'], 1.0)
+
+    def test_fewer_items_than_size(self):
+        from scoville.sampling import StratifiedSampler
+
+        sampler = StratifiedSampler(100, seed=1)
+        for i in range(5):
+            sampler.add(0, i)
+
+        self.assertEqual(sorted(sampler.sample()),
+                         [(i, 1.0) for i in range(5)])
+
+    def test_weighted(self):
+        from scoville.sampling import StratifiedSampler
+
+        # the heavy item should almost always be in a weighted sample, but is
+        # no more likely than any other in an unweighted one.
+        found = dict(weighted=0, unweighted=0)
+        for seed in range(20):
+            for name, weighted in found.items():
+                sampler = StratifiedSampler(5, weighted=name == 'weighted',
+                                            seed=seed)
+                for i in range(1000):
+                    sampler.add(0, i, 1000000 if i == 500 else 1)
+                if 500 in dict(sampler.sample()):
+                    found[name] += 1
+
+        self.assertEqual(found['weighted'], 20)
+        self.assertLess(found['unweighted'], 5)
+
+    def test_seed_repeatable(self):
+        from scoville.sampling import StratifiedSampler
+
+        samples = []
+        for _ in range(2):
+            sampler = StratifiedSampler(10, seed=42)
+            for i in range(1000):
+                sampler.add(i % 3, i)
+            samples.append(sampler.sample())
+
+        self.assertEqual(samples[0], samples[1])
+
+
+class TestConfidenceLevels(TestCase):
+
+    def test_interval_narrows(self):
+        from scoville.sampling import confidence_levels
+
+        lower, upper = confidence_levels(50, 100)
+        self.assertAlmostEqual(lower, 40.2, places=1)
+        self.assertAlmostEqual(upper, 59.8, places=1)
+
+        lower, upper = confidence_levels(50, 10000)
+        self.assertAlmostEqual(lower, 49.02, places=2)
+        self.assertAlmostEqual(upper, 50.98, places=2)
+
+    def test_clamped(self):
+        from scoville.sampling import confidence_levels
+
+        self.assertEqual(confidence_levels(100, 10), (90.0, 100.0))
+        self.assertEqual(confidence_levels(0, 0), (0.0, 100.0))
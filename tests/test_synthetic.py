@@ -0,0 +1,110 @@
+from unittest import TestCase
+
+
+class TestSynthetic(TestCase):
+
+    def test_round_trip(self):
+        from scoville.mvt import GeomType
+        from scoville.mvt import Tile
+        from scoville.synthetic import encode_tile
+        from scoville.synthetic import LayerEncoder
+
+        layer = LayerEncoder('water')
+        properties = dict(kind='lake', name='é', area=1.5, id=12345,
+                          offset=-3, wet=True)
+        layer.add_feature(properties, GeomType.polygon,
+                          [[(0, 0), (10, 0), (10, 10)]], fid=7)
+        layer.add_feature(dict(kind='lake'), GeomType.point, [[(5, 5)]])
+
+        layers = list(Tile(encode_tile([layer])))
+        self.assertEqual(len(layers), 1)
+        self.assertEqual(layers[0].name, 'water')
+        # the second feature's kind is deduplicated with the first.
+        self.assertEqual(len(layers[0].values), len(properties))
+
+        first, second = layers[0].features
+        self.assertEqual(first.fid, 7)
+        self.assertEqual(first.geom_type, GeomType.polygon)
+        self.assertEqual(first.properties, properties)
+        self.assertEqual(second.properties, dict(kind='lake'))
+
+    def test_synthetic_tile(self):
+        from scoville.mvt import Tile
+        from scoville.synthetic import synthetic_tile
+
+        data = synthetic_tile(num_layers=3, num_features=10, num_properties=2,
+                              cardinality=2)
+        self.assertEqual(data, synthetic_tile(num_layers=3, num_features=10,
+                                              num_properties=2, cardinality=2))
+
+        layers = list(Tile(data))
+        self.assertEqual([layer.name for layer in layers],
+                         ['layer0', 'layer1', 'layer2'])
+        for layer in layers:
+            self.assertEqual(len(layer.features), 10)
+            self.assertEqual(layer.keys, ['kind', 'prop0', 'prop1'])
+            # kind and the two properties share two "valueN" strings.
+            self.assertLessEqual(len(layer.values), 4)
+
+    def test_synthetic_tiles(self):
+        from scoville.mvt import Tile
+        from scoville.synthetic import SyntheticTiles
+
+        tiles = SyntheticTiles(num_layers=2, num_features=10)
+        self.assertEqual(tiles.tile(3, 1, 2),
+                         SyntheticTiles(num_layers=2,
+                                        num_features=10).tile(3, 1, 2))
+        self.assertNotEqual(tiles.tile(3, 1, 2), tiles.tile(3, 2, 1))
+
+        for layer in Tile(tiles.tile(3, 1, 2)):
+            self.assertTrue(5 <= len(layer.features) <= 15)
+
+
+class TestSyntheticTileServer(TestCase):
+
+    def _serve(self, **kwargs):
+        from threading import Thread
+        from scoville.synthetic import SyntheticTiles, SyntheticTileServer
+
+        self.tiles = SyntheticTiles(num_layers=2, num_features=5)
+        server = SyntheticTileServer(('127.0.0.1', 0), self.tiles, **kwargs)
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def _get(self, server, path):
+        from http.client import HTTPConnection
+
+        conn = HTTPConnection('127.0.0.1', server.server_port)
+        conn.request('GET', path)
+        res = conn.getresponse()
+        body = res.read()
+        conn.close()
+        return res, body
+
+    def test_tile(self):
+        server = self._serve()
+
+        res, body = self._get(server, '/3/1/2.mvt')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(body, self.tiles.tile(3, 1, 2))
+
+        res, _ = self._get(server, '/3/8/2.mvt')
+        self.assertEqual(res.status, 404)
+
+    def test_latency_and_errors(self):
+        from time import monotonic
+
+        server = self._serve(latency=0.1, error_rate=1.0)
+
+        start = monotonic()
+        res, _ = self._get(server, '/0/0/0')
+        self.assertGreaterEqual(monotonic() - start, 0.1)
+        self.assertEqual(res.status, 500)
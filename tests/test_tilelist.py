@@ -0,0 +1,117 @@
+from unittest import TestCase
+
+
+class TestParseLine(TestCase):
+
+    def test_formats(self):
+        from scoville.tilelist import parse_line
+
+        self.assertEqual(parse_line('1/0/1\n'), (1, 0, 1, 1))
+        self.assertEqual(parse_line('1/0/1 some comment'), (1, 0, 1, 1))
+        self.assertEqual(parse_line('1|0|1|123\n'), (1, 0, 1, 123))
+        self.assertEqual(parse_line('0231'), (4, 3, 6, 1))
+
+    def test_blank_and_comments(self):
+        from scoville.tilelist import parse_line
+
+        self.assertIsNone(parse_line(''))
+        self.assertIsNone(parse_line('  \n'))
+        self.assertIsNone(parse_line('# z/x/y'))
+
+    def test_bad_lines(self):
+        from scoville.tilelist import BadLine, parse_line
+
+        for line in ('foo', '1/2', '1/a/0', '1|0|0', '1/2/0', '0123x'):
+            with self.assertRaises(BadLine, msg=line):
+                parse_line(line)
+
+
+class TestReadTileList(TestCase):
+
+    def _write(self, tmp, name, data, opener=open):
+        from os.path import join
+
+        file_name = join(tmp, name)
+        with opener(file_name, 'wb') as fh:
+            fh.write(data)
+        return file_name
+
+    def test_compressed(self):
+        import bz2
+        import gzip
+        import lzma
+        from tempfile import TemporaryDirectory
+        from scoville.tilelist import read_tile_list
+
+        data = b'0/0/0\n1|1|1|5\n'
+        with TemporaryDirectory() as tmp:
+            for opener in (open, gzip.open, bz2.open, lzma.open):
+                # the name doesn't say what the compression is.
+                file_name = self._write(tmp, 'tiles.txt', data, opener)
+                self.assertEqual(list(read_tile_list(file_name)),
+                                 [(0, 0, 0, 1), (1, 1, 1, 5)])
+
+    def test_bad_lines_reported(self):
+        from tempfile import TemporaryDirectory
+        from scoville.tilelist import read_tile_list
+
+        errors = []
+
+        def error_fn(line_number, line, e):
+            errors.append((line_number, line))
+
+        with TemporaryDirectory() as tmp:
+            file_name = self._write(
+                tmp, 'tiles.txt', b'# tiles\n0/0/0\n\nfoo\n1/5/0\n1/1/1\n')
+            tiles = list(read_tile_list(file_name, error_fn))
+
+        self.assertEqual(tiles, [(0, 0, 0, 1), (1, 1, 1, 1)])
+        self.assertEqual(errors, [(4, 'foo\n'), (5, '1/5/0\n')])
+
+    def test_bbox(self):
+        from scoville.tilelist import read_tile_list
+
+        tiles = list(read_tile_list('bbox:-180,-85,180,85:0-2'))
+        self.assertEqual(len(tiles), 1 + 4 + 16)
+        self.assertEqual(tiles[0], (0, 0, 0, 1))
+
+    def test_bad_bbox(self):
+        from scoville.tilelist import parse_bbox_spec
+
+        for spec in ('bbox:1,2:0', 'bbox:0,0,1,1:x', 'bbox:1,0,0,1:0-1',
+                     'bbox:0,0,1,1:3-2'):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_bbox_spec(spec)
+
+
+class TestBbox(TestCase):
+
+    def test_lonlat_to_tile(self):
+        from scoville.tilelist import lonlat_to_tile
+
+        self.assertEqual(lonlat_to_tile(0, 0, 0), (0, 0))
+        self.assertEqual(lonlat_to_tile(-180, 90, 1), (0, 0))
+        self.assertEqual(lonlat_to_tile(180, -90, 1), (1, 1))
+        # san francisco
+        self.assertEqual(lonlat_to_tile(-122.4194, 37.7749, 12), (655, 1583))
+
+    def test_no_render_import(self):
+        import subprocess
+        import sys
+
+        # reading a tile list shouldn't load the rendering stack.
+        code = ('import sys; from scoville.tilelist import read_tile_list; '
+                'list(read_tile_list("bbox:0,0,1,1:0-2")); '
+                'print("scoville.render" in sys.modules)')
+        out = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(out.strip(), b'False')
+
+
+class TestUrlTemplate(TestCase):
+
+    def test_template(self):
+        from scoville.tilelist import UrlTemplate
+
+        tile_url = UrlTemplate('http://{s}.example.com/{z}/{x}/{y}.mvt?a={z}')
+        self.assertEqual(tile_url(1, 2, 3),
+                         'http://{s}.example.com/1/2/3.mvt?a=1')
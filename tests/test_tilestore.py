@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+
+class TestTileStore(TestCase):
+
+    def _check_store(self, store):
+        store.put(1, 0, 1, b'foo')
+        store.put(1, 1, 0, b'bar')
+        store.put(1, 1, 0, b'baz')
+
+        self.assertEqual(store.get(1, 0, 1), b'foo')
+        self.assertEqual(store.get(1, 1, 0), b'baz')
+        self.assertIsNone(store.get(1, 0, 0))
+
+    def test_directory(self):
+        from os.path import isfile, join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import open_store, DirectoryStore
+
+        with TemporaryDirectory() as tmp:
+            store = open_store(tmp)
+            self.assertIsInstance(store, DirectoryStore)
+            self._check_store(store)
+            store.close()
+            self.assertTrue(isfile(join(tmp, '1', '0', '1.png')))
+
+    def test_mbtiles(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import open_store, MBTilesStore
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'tiles.mbtiles')
+            store = open_store(path)
+            self.assertIsInstance(store, MBTilesStore)
+            self._check_store(store)
+            store.close()
+
+            # MBTiles rows are flipped, and the data should survive reopening
+            store = open_store(path)
+            row = store.conn.execute(
+                'SELECT tile_row FROM tiles WHERE tile_data = ?',
+                (b'foo',)).fetchone()
+            self.assertEqual(row[0], 0)
+            self.assertEqual(store.get(1, 1, 0), b'baz')
+            store.close()
+
+    def test_read_mbtiles(self):
+        import gzip
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import MBTilesStore, read_mbtiles
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'tiles.mbtiles')
+            store = MBTilesStore(path, 'pbf')
+            store.put(2, 1, 0, b'\x1afoo')
+            store.put(0, 0, 0, gzip.compress(b'\x1abar'))
+            store.put(2, 3, 1, b'\x1abaz')
+            store.close()
+
+            # tiles come back in the order they were written, with XYZ rows
+            # and gzipped data decompressed, however small the batches.
+            self.assertEqual(list(read_mbtiles(path, batch_size=2)), [
+                (2, 1, 0, b'\x1afoo'),
+                (0, 0, 0, b'\x1abar'),
+                (2, 3, 1, b'\x1abaz'),
+            ])
+
+    def test_read_mbtiles_missing(self):
+        import sqlite3
+        from os.path import exists, join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import read_mbtiles
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'missing.mbtiles')
+            with self.assertRaises(sqlite3.Error):
+                list(read_mbtiles(path))
+            self.assertFalse(exists(path))
+
+    def test_open_reader(self):
+        from os.path import getmtime, join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import MBTilesStore, open_reader
+
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'tiles.mbtiles')
+            store = MBTilesStore(path, 'svg')
+            store.put(1, 1, 0, b'foo')
+            store.close()
+            mtime = getmtime(path)
+
+            # the format comes from the database, and reading doesn't change
+            # it.
+            reader = open_reader(path)
+            self.assertEqual(reader.ext, 'svg')
+            self.assertEqual(reader.get(1, 1, 0), b'foo')
+            self.assertIsNone(reader.get(1, 0, 0))
+            reader.close()
+            self.assertEqual(getmtime(path), mtime)
+
+            self.assertEqual(open_reader(tmp).get(1, 1, 0), None)
+
+    def test_open_reader_missing(self):
+        import sqlite3
+        from os import listdir
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from scoville.tilestore import open_reader
+
+        with TemporaryDirectory() as tmp:
+            for name in ('missing.mbtiles', 'missing'):
+                with self.assertRaises(FileNotFoundError):
+                    open_reader(join(tmp, name))
+            self.assertEqual(listdir(tmp), [])
+
+            path = join(tmp, 'empty.mbtiles')
+            open(path, 'wb').close()
+            with self.assertRaises(sqlite3.Error):
+                open_reader(path)
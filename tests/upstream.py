@@ -0,0 +1,53 @@
+from scoville.synthetic import SyntheticHandler
+from scoville.synthetic import SyntheticTileServer
+
+
+class _Handler(SyntheticHandler):
+    def send_tile(self, z, x, y):
+        from http import HTTPStatus
+
+        server = self.server
+        with server.lock:
+            server.requests[(z, x, y)] += 1
+
+        if (z, x, y) in server.fail:
+            self.send_response(HTTPStatus.NOT_FOUND)
+            self.end_headers()
+            return
+
+        SyntheticHandler.send_tile(self, z, x, y)
+
+
+class Upstream(object):
+    """
+    A synthetic tile server running on a local port for the duration of a
+    test, which counts the requests for each tile and fails those in fail
+    with a 404. Each response is delayed by latency seconds.
+    """
+
+    def __init__(self, fail=(), latency=0.0):
+        from collections import Counter
+        from threading import Thread
+        from scoville.synthetic import SyntheticTiles
+
+        tiles = SyntheticTiles(num_layers=2, num_features=10)
+        self.server = SyntheticTileServer(('127.0.0.1', 0), tiles, latency)
+        self.server.RequestHandlerClass = _Handler
+        self.server.requests = Counter()
+        self.server.fail = set(fail)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/{z}/{x}/{y}.mvt' % (
+            self.server.server_port,)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()